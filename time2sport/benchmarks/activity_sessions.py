@@ -0,0 +1,92 @@
+'''
+Benchmark of the session list of activity_detail with its waiting list data.
+
+Compares the previous per-session waiting list lookups with the annotated
+query of get_activity_sessions.
+
+    python -m benchmarks.activity_sessions [sessions] [waiting_users]
+'''
+import sys
+from datetime import date, time, timedelta
+
+from benchmarks.utils import benchmark_database, timer, report
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from sbai.models import Activity, DayOfWeek, Schedule
+from sbai.views import get_activity_sessions
+from sgu.models import User
+from slegpn.models import WaitingList
+from src.models import Session
+
+
+def legacy_activity_sessions(activity_id, user):
+    ''' Previous implementation: several waiting list queries per session '''
+    sessions = Session.objects.filter(
+        activity_id=activity_id).order_by("date", "schedule__hour_begin")
+    for session in sessions:
+        waiting_list = session.waiting_list.all()
+        if waiting_list.exists():
+            is_first_user = waiting_list.first()
+            session.is_first_user = is_first_user.user == user and not session.is_full()
+        else:
+            session.is_first_user = True
+        # The template also loaded the schedule of every session
+        session.schedule.get_day_of_week_display()
+    return sessions
+
+
+def annotated_activity_sessions(activity_id, user):
+    sessions = get_activity_sessions(activity_id, user)
+    for session in sessions:
+        session.schedule.get_day_of_week_display()
+    return sessions
+
+
+def create_fixture(sessions, waiting_users):
+    ''' Create an activity with full sessions, every one with a waiting list '''
+    schedule = Schedule.objects.create(
+        day_of_week=DayOfWeek.LUNES, hour_begin=time(8, 0), hour_end=time(9, 0))
+    activity = Activity.objects.create(
+        name="Benchmark", location="Pabellón", description="Benchmark", activity_type="terrestre")
+    users = User.objects.bulk_create(
+        [User(username=f"bench{i}", password="!") for i in range(waiting_users)])
+
+    created = Session.objects.bulk_create([
+        Session(activity=activity, schedule=schedule, capacity=10, free_places=i % 2,
+                date=date.today() + timedelta(days=i), start_time=time(8, 0), end_time=time(9, 0))
+        for i in range(sessions)
+    ])
+    WaitingList.objects.bulk_create([
+        WaitingList(user=user, session=session)
+        for session in created for user in users
+    ])
+    return activity, users[0]
+
+
+def measure(label, function, activity, user, results):
+    with CaptureQueriesContext(connection) as queries:
+        with timer(label, results):
+            list(function(activity.id, user))
+    return len(queries)
+
+
+def run(sessions=500, waiting_users=5):
+    with benchmark_database():
+        activity, user = create_fixture(sessions, waiting_users)
+        results = {}
+
+        legacy_queries = measure(
+            'legacy', legacy_activity_sessions, activity, user, results)
+        annotated_queries = measure(
+            'annotated', annotated_activity_sessions, activity, user, results)
+
+        report(f"Activity sessions ({sessions} sessions, {waiting_users} users waiting each)", [
+            ("legacy", f"{results['legacy'] * 1000:.1f} ms, {legacy_queries} queries"),
+            ("annotated", f"{results['annotated'] * 1000:.1f} ms, {annotated_queries} queries"),
+            ("speed-up", f"{results['legacy'] / results['annotated']:.1f}x"),
+        ])
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,106 @@
+'''
+Micro-benchmark of the overlap checks of the facility checkout.
+
+Compares the previous pairwise comparison of the chosen slots and the query per
+slot of the reserved sessions with the sweep lines over the sorted intervals,
+with 50 selected slots and 500 existing reservations without any conflict,
+so every check runs to the end.
+
+    python -m benchmarks.conflict_detection [slots] [reservations]
+'''
+import sys
+import timeit
+from datetime import date, time, timedelta
+
+from benchmarks.utils import benchmark_database, report
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from sbai.models import DayOfWeek, Schedule, SportFacility
+from sgu.models import User
+from src.models import FacilitySlot, Reservation, Session
+from src.views import _is_conflict_chosen_sessions, _is_conflict_reserved_sessions, _is_conflict_reserved_slots
+
+RESERVATIONS_PER_DAY = 10
+
+
+def legacy_chosen(selected_slots):
+    ''' Previous implementation: compare every pair of chosen slots '''
+    for i, slot1 in enumerate(selected_slots):
+        for j, slot2 in enumerate(selected_slots):
+            if i != j and slot1.overlaps(slot2):
+                return True
+    return False
+
+
+def legacy_reserved(user, selected_slots):
+    ''' Previous implementation: one query per slot and a lazy fetch of every session '''
+    for slot in selected_slots:
+        user_sessions = user.reservations.filter(session__date=slot.date)
+        if _is_conflict_reserved_sessions(user_sessions, slot.start_time, slot.end_time):
+            return True
+    return False
+
+
+def sweep_reserved(user, selected_slots):
+    ''' One query for all the days and the sweep line '''
+    reserved_sessions = [reservation.session for reservation in user.reservations.filter(
+        session__date__in={slot.date for slot in selected_slots}).select_related('session')]
+    return _is_conflict_reserved_slots(selected_slots, reserved_sessions)
+
+
+def create_fixture(slots, reservations):
+    ''' Reserved sessions in the morning of every day and free slots in the evening '''
+    schedule = Schedule.objects.create(
+        day_of_week=DayOfWeek.LUNES, hour_begin=time(8, 0), hour_end=time(22, 0))
+    court = SportFacility.objects.create(
+        name="Pista", number_of_facilities=1, description="Pista", hour_price=10, facility_type="Exterior")
+    user = User.objects.create(username="bench", password="!")
+    first_day = date.today() + timedelta(days=1)
+
+    reserved = Session.objects.bulk_create([
+        Session(facility=court, schedule=schedule, capacity=1, free_places=0,
+                date=first_day + timedelta(days=i // RESERVATIONS_PER_DAY),
+                start_time=time(8 + i % RESERVATIONS_PER_DAY, 0),
+                end_time=time(9 + i % RESERVATIONS_PER_DAY, 0))
+        for i in range(reservations)])
+    Reservation.objects.bulk_create([Reservation(user=user, session=session) for session in reserved])
+
+    days = reservations // RESERVATIONS_PER_DAY
+    free = Session.objects.bulk_create([
+        Session(facility=court, schedule=schedule, capacity=1, free_places=1,
+                date=first_day + timedelta(days=i % days), start_time=time(18 + i // days, 0),
+                end_time=time(19 + i // days, 0))
+        for i in range(slots)])
+    return user, FacilitySlot.load([session.id for session in free])
+
+
+def best_of(function, number):
+    ''' Best time of a call in microseconds '''
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def count_queries(function):
+    connection.queries_log.clear()
+    with CaptureQueriesContext(connection) as queries:
+        function()
+    return len(queries)
+
+
+def run(slots=50, reservations=500):
+    with benchmark_database():
+        user, selected_slots = create_fixture(slots, reservations)
+        assert not legacy_chosen(selected_slots) and not sweep_reserved(user, selected_slots)
+
+        report(f"Conflict detection ({slots} selected slots, {reservations} reservations)", [
+            ("legacy chosen", f"{best_of(lambda: legacy_chosen(selected_slots), 200):.0f} us"),
+            ("sweep chosen", f"{best_of(lambda: _is_conflict_chosen_sessions(selected_slots), 200):.0f} us"),
+            ("legacy reserved", f"{best_of(lambda: legacy_reserved(user, selected_slots), 3) / 1000:.1f} ms, "
+                                f"{count_queries(lambda: legacy_reserved(user, selected_slots))} queries"),
+            ("sweep reserved", f"{best_of(lambda: sweep_reserved(user, selected_slots), 20) / 1000:.1f} ms, "
+                               f"{count_queries(lambda: sweep_reserved(user, selected_slots))} queries"),
+        ])
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
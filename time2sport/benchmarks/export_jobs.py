@@ -0,0 +1,109 @@
+'''
+Benchmark of the web-worker occupancy of 50 concurrent export requests.
+
+Compares the previous render of the PDF of the sessions of a week inside every
+request with the export jobs: every request joins the job of the same file and
+a Celery worker renders it once. The requests are served by a pool of web
+workers (threads with their own connection); the tasks are published to an
+in-memory broker and the render is measured apart, as a worker would run it.
+
+    python -m benchmarks.export_jobs [requests] [workers] [facilities]
+'''
+import sys
+import tempfile
+import time as clock
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time, timedelta
+
+from benchmarks.utils import benchmark_database, timer, report
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+from sbai.exports import week_bounds, write_week_sessions_pdf
+from sbai.models import DayOfWeek, ExportJob, Schedule, SportFacility
+from sbai.tasks import render_export
+from sgu.models import User
+from src.models import Session
+from time2sport.celery import app
+
+HOURS = range(9, 21)
+
+
+def legacy_request(client, monday):
+    ''' Previous approach: the web worker renders the PDF of the week in the request '''
+    with tempfile.SpooledTemporaryFile(max_size=settings.EXPORT_SPOOL_MAX_SIZE) as output:
+        write_week_sessions_pdf(output, monday)
+
+
+def job_request(client, monday):
+    ''' The web worker joins or queues the export job and redirects to the exports page '''
+    response = client.post(reverse('request_export'),
+                           {'kind': 'week_sessions', 'format': 'pdf', 'week': monday.isoformat()})
+    assert response.status_code == 302
+
+
+def serve(function, clients, monday, workers, results, label):
+    ''' Serves one request per client with a pool of web workers, returns the seconds they were busy '''
+    def handle(client):
+        start = clock.perf_counter()
+        try:
+            function(client, monday)
+        finally:
+            connection.close()
+        return clock.perf_counter() - start
+
+    with timer(label, results):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return sum(pool.map(handle, clients))
+
+
+def create_fixture(requests, facilities):
+    ''' Sessions every hour of a week for many facility instances and a user per request '''
+    schedule = Schedule.objects.create(
+        day_of_week=DayOfWeek.LUNES, hour_begin=time(HOURS[0], 0), hour_end=time(HOURS[-1] + 1, 0))
+    SportFacility.objects.create(
+        name="Pista", number_of_facilities=facilities, description="Pista", hour_price=10, facility_type="Exterior")
+    monday, _ = week_bounds(date.today())
+    Session.objects.bulk_create([
+        Session(facility=facility, schedule=schedule, capacity=1, free_places=1,
+                date=monday + timedelta(days=day), start_time=time(hour, 0), end_time=time(hour + 1, 0))
+        for facility in SportFacility.objects.all() for day in range(7) for hour in HOURS
+    ], batch_size=5000)
+    clients = []
+    for i in range(requests):
+        client = Client()
+        client.force_login(User.objects.create_user(username=f"bench{i}", password="bench"))
+        clients.append(client)
+    return clients, monday
+
+
+def run(requests=50, workers=8, facilities=12):
+    setup_test_environment()
+    app.conf.broker_url = 'memory://'
+    with tempfile.TemporaryDirectory() as media_root, benchmark_database():
+        settings.MEDIA_ROOT = media_root
+        clients, monday = create_fixture(requests, facilities)
+        results = {}
+
+        legacy_busy = serve(legacy_request, clients, monday, workers, results, 'legacy')
+        jobs_busy = serve(job_request, clients, monday, workers, results, 'jobs')
+
+        jobs = list(ExportJob.objects.all())
+        with timer('render', results):
+            for job in jobs:
+                render_export(job.id)
+
+        report(f"Export of the sessions of a week ({Session.objects.count()} sessions, "
+               f"{requests} concurrent requests, {workers} web workers)", [
+            ("legacy", f"{legacy_busy:.1f} s of web workers, last response after {results['legacy']:.1f} s"),
+            ("jobs", f"{jobs_busy:.2f} s of web workers, last response after {results['jobs']:.2f} s"),
+            ("renders", f"{len(jobs)} job for {requests} requests, {results['render']:.2f} s in a Celery worker"),
+            ("occupancy", f"{legacy_busy / jobs_busy:.0f}x less"),
+        ])
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
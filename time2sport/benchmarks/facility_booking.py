@@ -0,0 +1,121 @@
+'''
+Benchmark of the booking of several facility slots after the payment.
+
+Compares the previous lookup, reservation and save per slot with the batched
+Session.reserve_facility_slots, booking 10 slots across 3 courts for every user,
+and the parsing of the "id|HH:MM|HH:MM|Month DD YYYY" strings with the compact
+slots kept in the user session.
+
+    python -m benchmarks.facility_booking [bookings]
+'''
+import sys
+import timeit
+from datetime import date, datetime, time, timedelta
+
+from benchmarks.utils import benchmark_database, timer, report
+
+from django.db import connection
+from django.shortcuts import get_object_or_404
+from django.test.utils import CaptureQueriesContext
+from sbai.models import DayOfWeek, Schedule, SportFacility
+from sgu.models import User
+from src.models import FacilitySlot, Reservation, Session
+
+COURTS = 3
+SLOTS = 10
+DAYS = 60
+
+
+def legacy_booking(user, selected_sessions):
+    ''' Previous implementation: parse, look up, reserve and save every slot '''
+    for session in selected_sessions:
+        facility_id, start, end, day = session.split('|')
+        day_number = datetime.strptime(day, '%B %d %Y').weekday()
+        start_time = datetime.strptime(start, '%H:%M').time()
+        end_time = datetime.strptime(end, '%H:%M').time()
+
+        facility = get_object_or_404(SportFacility, id=facility_id)
+        session = facility.sessions.filter(
+            start_time=start_time, end_time=end_time).first()
+        if session and session.free_places > 0:
+            Reservation.objects.create(session=session, user=user)
+            session.free_places -= 1
+            session.save()
+
+
+def legacy_parse(selected_sessions):
+    ''' Previous parsing of the selected slots, done by every view of the checkout '''
+    for session in selected_sessions:
+        facility_id, start, end, day = session.split('|')
+        datetime.strptime(day, '%B %d %Y')
+        datetime.strptime(start, '%H:%M').time()
+        datetime.strptime(end, '%H:%M').time()
+
+
+def batched_booking(user, selected_slots):
+    ''' Read the compact slots and reserve them at once '''
+    slots = [FacilitySlot.from_compact(slot) for slot in selected_slots]
+    return Session.reserve_facility_slots(user, slots)
+
+
+def create_fixture(bookings):
+    ''' Create the courts with their sessions for the next days and the users '''
+    schedule = Schedule.objects.create(
+        day_of_week=DayOfWeek.LUNES, hour_begin=time(9, 0), hour_end=time(21, 0))
+    courts = [SportFacility.objects.create(
+        name=f"Pista {i}", number_of_facilities=1, description="Pista", hour_price=10, facility_type="Exterior")
+        for i in range(COURTS)]
+    day = date.today() + timedelta(days=1)
+    Session.objects.bulk_create([
+        Session(facility=court, schedule=schedule, capacity=2 * bookings, free_places=2 * bookings,
+                date=day + timedelta(days=i), start_time=time(hour, 0), end_time=time(hour + 1, 0))
+        for court in courts for i in range(DAYS) for hour in range(9, 21)
+    ])
+    users = User.objects.bulk_create(
+        [User(username=f"bench{i}", password="!") for i in range(2 * bookings)])
+
+    # 10 slots spread over the 3 courts on the same day
+    sessions = [Session.objects.get(facility=courts[i % COURTS], date=day, start_time=time(9 + i, 0))
+                for i in range(SLOTS)]
+    legacy_selected = [
+        f"{session.facility_id}|{session.start_time:%H:%M}|{session.end_time:%H:%M}|{day.strftime('%B %d %Y')}"
+        for session in sessions
+    ]
+    compact_selected = [slot.to_compact() for slot in FacilitySlot.load([session.id for session in sessions])]
+    return users[:bookings], users[bookings:], legacy_selected, compact_selected
+
+
+def measure(label, function, users, selected, results):
+    # The query log keeps at most 9000 queries
+    connection.queries_log.clear()
+    with CaptureQueriesContext(connection) as queries:
+        with timer(label, results):
+            for user in users:
+                function(user, selected)
+    return len(queries) // len(users)
+
+
+def run(bookings=200):
+    with benchmark_database():
+        results = {}
+        legacy_users, batched_users, legacy_selected, compact_selected = create_fixture(bookings)
+
+        legacy_queries = measure('legacy', legacy_booking, legacy_users, legacy_selected, results)
+        batched_queries = measure('batched', batched_booking, batched_users, compact_selected, results)
+
+        legacy_parse_us = min(timeit.repeat(
+            lambda: legacy_parse(legacy_selected), number=1000, repeat=5)) * 1000
+        compact_parse_us = min(timeit.repeat(
+            lambda: [FacilitySlot.from_compact(slot) for slot in compact_selected], number=1000, repeat=5)) * 1000
+
+        report(f"Facility booking ({bookings} bookings of {SLOTS} slots across {COURTS} courts)", [
+            ("legacy", f"{results['legacy'] / bookings * 1000:.1f} ms, {legacy_queries} queries per booking"),
+            ("batched", f"{results['batched'] / bookings * 1000:.1f} ms, {batched_queries} queries per booking"),
+            ("speed-up", f"{results['legacy'] / results['batched']:.1f}x"),
+            ("legacy parse", f"{legacy_parse_us:.0f} us per checkout view"),
+            ("compact parse", f"{compact_parse_us:.0f} us per checkout view"),
+        ])
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
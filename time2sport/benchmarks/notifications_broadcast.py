@@ -0,0 +1,64 @@
+'''
+Benchmark of a notification broadcast, e.g. the closure of a facility.
+
+Compares the previous Notification.objects.create per user with the
+notification service: the cost of queuing the broadcast in the request and
+the throughput of the worker writing it in batches.
+
+    python -m benchmarks.notifications_broadcast [users]
+'''
+import json
+import sys
+from unittest.mock import patch
+
+from benchmarks.utils import benchmark_database, timer, report
+
+from django.test.utils import override_settings
+from sgu.models import User
+from slegpn.models import Notification
+from slegpn.notifier import deliver_notifications, notify, render_notification
+
+CONTEXT = {'facility': "Pista de Tenis", 'date': "01/03/2025"}
+
+
+def legacy_broadcast(users):
+    ''' Previous implementation: one insert (and its signals) per user '''
+    for user in users:
+        Notification.objects.create(
+            user=user, title="Instalación cerrada",
+            content=f"La instalación {CONTEXT['facility']} estará cerrada el día {CONTEXT['date']}.")
+
+
+def run(users=10000):
+    with benchmark_database():
+        users = User.objects.bulk_create(
+            [User(username=f"bench{i}", password="!") for i in range(users)])
+        user_ids = [user.id for user in users]
+        results = {}
+
+        with timer('legacy', results):
+            legacy_broadcast(users)
+        Notification.objects.all().delete()
+
+        # Queuing in the request path: render once and serialize a single task message
+        # (the message is not sent so no task is left in the broker)
+        with override_settings(NOTIFICATIONS_SYNC_DELIVERY=False), \
+                patch.object(deliver_notifications, 'delay', side_effect=lambda *args: json.dumps(args, default=str)):
+            with timer('enqueue', results):
+                notify(user_ids, 'facility_reservation_failed')
+
+        # Work done by the Celery worker
+        title, content = render_notification('facility_reservation_failed')
+        with timer('worker', results):
+            deliver_notifications(user_ids, title, content)
+
+        report(f"Notification broadcast ({len(user_ids)} users)", [
+            ("legacy", f"{results['legacy'] * 1000:.0f} ms, {len(user_ids) / results['legacy']:.0f} notifications/s"),
+            ("enqueue (request)", f"{results['enqueue'] * 1000:.1f} ms"),
+            ("worker", f"{results['worker'] * 1000:.0f} ms, {len(user_ids) / results['worker']:.0f} notifications/s"),
+            ("speed-up", f"{results['legacy'] / results['worker']:.1f}x"),
+        ])
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
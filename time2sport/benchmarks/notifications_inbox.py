@@ -0,0 +1,72 @@
+'''
+Benchmark of the notifications inbox of a user with many notifications.
+
+Compares the previous render of the whole inbox with the keyset paginated
+pages of the notifications view.
+
+    python -m benchmarks.notifications_inbox [notifications]
+'''
+import sys
+from datetime import timedelta
+
+from benchmarks.utils import benchmark_database, timer, report
+
+from django.shortcuts import render
+from django.test import Client, RequestFactory
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from sgu.models import User
+from slegpn.models import Notification
+
+
+def legacy_inbox(user):
+    ''' Previous implementation: the whole inbox in one page '''
+    request = RequestFactory().get(reverse('notifications'))
+    request.user = user
+    notifications = user.notifications.order_by('read', '-timestamp')
+    return render(request, 'notifications.html', {'notifications': notifications})
+
+
+def create_fixture(notifications):
+    user = User.objects.create_user(username="bench", password="bench")
+    now = timezone.now()
+    Notification.objects.bulk_create([
+        Notification(user=user, title=f"Notification {i}", content="Benchmark",
+                     timestamp=now - timedelta(minutes=i), read=i % 3 != 0)
+        for i in range(notifications)
+    ], batch_size=5000)
+    return user
+
+
+def run(notifications=50000):
+    setup_test_environment()
+    with benchmark_database():
+        user = create_fixture(notifications)
+        client = Client()
+        client.force_login(user)
+        results = {}
+
+        with timer('legacy', results):
+            legacy_inbox(user)
+
+        with timer('first page', results):
+            response = client.get(reverse('notifications'))
+
+        # Walk to a page deep inside the read notifications
+        cursor = response.context['next_cursor']
+        for _ in range(notifications // 40):
+            cursor = client.get(reverse('notifications'), {'after': cursor}).context['next_cursor']
+        with timer('deep page', results):
+            client.get(reverse('notifications'), {'after': cursor})
+
+        report(f"Notifications inbox ({notifications} notifications)", [
+            ("legacy", f"{results['legacy'] * 1000:.1f} ms"),
+            ("first page", f"{results['first page'] * 1000:.1f} ms"),
+            ("deep page", f"{results['deep page'] * 1000:.1f} ms"),
+            ("speed-up", f"{results['legacy'] / results['first page']:.1f}x"),
+        ])
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,147 @@
+'''
+Load test of the unread notifications badge.
+
+Compares the previous polling of unread_notifications_count every 15 seconds
+with the long polling used under WSGI and the server-sent events of
+notifications_stream served over ASGI. Needs Redis running.
+
+    python -m benchmarks.notifications_push [clients] [minutes]
+'''
+import asyncio
+import statistics
+import sys
+import time
+
+from benchmarks.utils import benchmark_database, report
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.db import connections
+from django.test import AsyncClient
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+from sgu.models import User
+from slegpn.models import Notification
+
+POLLING_INTERVAL = 15
+
+
+def p95(values):
+    return statistics.quantiles(values, n=20)[-1]
+
+
+async def login_clients(users):
+    clients = []
+    for user in users:
+        client = AsyncClient()
+        await client.aforce_login(user)
+        clients.append(client)
+    return clients
+
+
+async def measure_polling(clients, requests_per_client=20):
+    ''' Latency of the unread count requests the polling badge sends '''
+    latencies = []
+
+    async def poll(client):
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            await client.get(reverse('unread_notifications_count'))
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[poll(client) for client in clients])
+    return latencies
+
+
+async def create_notifications(users):
+    ''' One unread notification per user, with the counters updated and published as the signals would '''
+    await sync_to_async(Notification.objects.bulk_create)([
+        Notification(user=user, title="Benchmark", content="Benchmark") for user in users])
+    await sync_to_async(Notification.refresh_unread_counts)([user.id for user in users])
+
+
+async def measure_long_poll(clients, users, rounds=5):
+    ''' Time from the creation of a notification until every waiting long poll is answered '''
+    url = reverse('unread_notifications_count')
+    latencies = []
+
+    async def get(client, path, **kwargs):
+        async def request():
+            # A thread per request as the ASGI servers, the sync middlewares keep it while the request waits
+            async with ThreadSensitiveContext():
+                return await client.get(path, **kwargs)
+        # In a task of its own, so the context left by the sync middlewares doesn't reach the next requests
+        return await asyncio.create_task(request())
+
+    async def receive(client, etag):
+        response = await get(client, url + '?wait=1', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        return time.perf_counter()
+
+    for _ in range(rounds):
+        etags = [(await get(client, url))['ETag'] for client in clients]
+        waiting = [asyncio.create_task(receive(client, etag)) for client, etag in zip(clients, etags)]
+        # Lets the requests subscribe before the notifications are created
+        await asyncio.sleep(0.5)
+        start = time.perf_counter()
+        await create_notifications(users)
+        latencies.extend(end - start for end in await asyncio.gather(*waiting))
+    return latencies
+
+
+async def measure_push(clients, users, rounds=5):
+    ''' Time from the creation of a notification until every open stream receives it '''
+    streams = []
+    for client in clients:
+        response = await client.get(reverse('notifications_stream'))
+        events = aiter(response.streaming_content)
+        await anext(events)  # retry
+        await anext(events)  # initial count
+        streams.append(events)
+
+    async def receive(events, start):
+        while not (await anext(events)).startswith(b"data:"):
+            pass
+        return time.perf_counter() - start
+
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        waiting = [asyncio.create_task(receive(events, start)) for events in streams]
+        await create_notifications(users)
+        latencies.extend(await asyncio.gather(*waiting))
+
+    for events in streams:
+        await events.aclose()
+    return latencies
+
+
+async def measure(users):
+    clients = await login_clients(users)
+    polling = await measure_polling(clients)
+    long_poll = await measure_long_poll(clients, users)
+    push = await measure_push(clients, users)
+    # Release the connection of the ORM thread before dropping the database
+    await sync_to_async(connections.close_all)()
+    return polling, long_poll, push
+
+
+def run(clients=50, minutes=60):
+    # Allows the testserver host of the test clients
+    setup_test_environment()
+    with benchmark_database():
+        users = User.objects.bulk_create(
+            [User(username=f"bench{i}", password="!") for i in range(clients)])
+        polling, long_poll, push = asyncio.run(measure(users))
+
+        polling_requests = clients * minutes * 60 // POLLING_INTERVAL
+        report(f"Unread notifications badge ({clients} clients, {minutes} minutes)", [
+            ("polling requests", f"{polling_requests}"),
+            ("polling request p95", f"{p95(polling) * 1000:.1f} ms"),
+            ("long-poll delivery p95", f"{p95(long_poll) * 1000:.1f} ms"),
+            ("push connections", f"{clients}"),
+            ("push delivery p95", f"{p95(push) * 1000:.1f} ms"),
+        ])
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,93 @@
+'''
+Concurrency benchmark for Session.reserve_activity.
+
+Fires many parallel reservations at a single activity session and checks that
+no place is overbooked. Needs the PostgreSQL database configured in settings.
+
+    python -m benchmarks.reservation_concurrency [attempts] [capacity] [workers]
+'''
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time, timedelta
+
+from benchmarks.utils import benchmark_database, timer, report
+
+from django.db import connection
+from sbai.models import Activity, Bonus, DayOfWeek, Schedule
+from sgu.models import User
+from slegpn.models import ProductBonus
+from src.models import Reservation, ReservationStatus, Session
+
+
+def create_fixture(attempts, capacity):
+    ''' Create one session and a user with a valid bonus per attempt '''
+    schedule = Schedule.objects.create(
+        day_of_week=DayOfWeek.LUNES, hour_begin=time(8, 0), hour_end=time(9, 0))
+    activity = Activity.objects.create(
+        name="Benchmark", location="Pabellón", description="Benchmark", activity_type="terrestre")
+    bonus = Bonus.objects.create(
+        activity=activity, bonus_type='semester', price=50)
+
+    session = Session.objects.create(
+        activity=activity,
+        schedule=schedule,
+        capacity=capacity,
+        free_places=capacity,
+        date=date.today() + timedelta(days=1),
+        start_time=time(8, 0),
+        end_time=time(9, 0)
+    )
+
+    users = User.objects.bulk_create(
+        [User(username=f"bench{i}", password="!") for i in range(attempts)])
+    ProductBonus.objects.bulk_create([
+        ProductBonus(user=user, bonus=bonus, date_begin=date.today(),
+                     date_end=date.today() + timedelta(days=30))
+        for user in users
+    ])
+    return session, users
+
+
+def reserve_all(session_id, users):
+    ''' Reserve for each user with a fresh session instance, as a request would do '''
+    try:
+        return [Session.objects.get(pk=session_id).reserve_activity(user).status for user in users]
+    finally:
+        connection.close()
+
+
+def run(attempts=500, capacity=50, workers=32):
+    with benchmark_database():
+        session, users = create_fixture(attempts, capacity)
+        results = {}
+
+        with timer('total', results):
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                chunks = [users[i::workers] for i in range(workers)]
+                statuses = [status for chunk in pool.map(
+                    lambda chunk: reserve_all(session.id, chunk), chunks) for status in chunk]
+
+        session.refresh_from_db()
+        reservations = Reservation.objects.filter(session=session).count()
+        reserved = statuses.count(ReservationStatus.RESERVED)
+        elapsed = results['total']
+
+        report("Reservation concurrency", [
+            ("attempts", attempts),
+            ("workers", workers),
+            ("capacity", capacity),
+            ("reserved", reserved),
+            ("rejected as full", statuses.count(ReservationStatus.FULL)),
+            ("reservations in db", reservations),
+            ("free places left", session.free_places),
+            ("elapsed", f"{elapsed:.3f} s"),
+            ("throughput", f"{attempts / elapsed:.0f} attempts/s"),
+        ])
+
+        # Zero overbooking: every place is taken exactly once
+        assert reserved == reservations == capacity, "Session overbooked"
+        assert session.free_places == 0, "Free places out of sync"
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,105 @@
+'''
+Benchmark of the reservations calendar feed of a user with 500 reservations.
+
+Compares the reservations page the users reload to check their bookings with
+the feed rendered from the database (first request of a version), the feed
+taken from the cache and the 304 answered to the calendar clients polling it
+with the ETag of their copy.
+
+    python -m benchmarks.reservations_calendar [requests] [reservations]
+'''
+import sys
+from datetime import date, time, timedelta
+
+from benchmarks.utils import benchmark_database, timer, report
+
+from django.core.cache import caches
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from sbai.models import Activity, DayOfWeek, Schedule
+from sgu.models import User
+from src.calendars import feed_key, render_reservations_calendar
+from src.models import Reservation, Session
+from src.views import reservations as reservations_page, reservations_calendar
+
+SESSIONS_PER_DAY = 10
+
+
+def create_fixture(reservations):
+    ''' Reservations of one user in the sessions of the days around today, a fifth of them past '''
+    schedule = Schedule.objects.create(
+        day_of_week=DayOfWeek.LUNES, hour_begin=time(8, 0), hour_end=time(22, 0))
+    activity = Activity.objects.create(
+        name="Zumba", location="Sala 4", description="Zumba", activity_type="terrestre")
+    user = User.objects.create_user(username="bench", password="bench")
+    first_day = date.today() - timedelta(days=reservations // SESSIONS_PER_DAY // 5)
+
+    sessions = Session.objects.bulk_create([
+        Session(activity=activity, schedule=schedule, capacity=20, free_places=19,
+                date=first_day + timedelta(days=i // SESSIONS_PER_DAY),
+                start_time=time(8 + i % SESSIONS_PER_DAY, 0), end_time=time(9 + i % SESSIONS_PER_DAY, 0))
+        for i in range(reservations)])
+    Reservation.objects.bulk_create([
+        Reservation(user=user, session=session, period=session.period) for session in sessions])
+    return user
+
+
+def feed_request(user, **headers):
+    return RequestFactory().get(
+        reverse('reservations_calendar', args=[user.id, user.calendar_token]), **headers)
+
+
+def page_request(user):
+    request = RequestFactory().get(reverse('reservations'), HTTP_HOST='localhost')
+    request.user = user
+    request._messages = []
+    return request
+
+
+def measure(label, function, requests, results):
+    with timer(label, results):
+        for _ in range(requests):
+            function()
+    return results[label] / requests * 1000
+
+
+def count_queries(function):
+    connection.queries_log.clear()
+    with CaptureQueriesContext(connection) as queries:
+        function()
+    return len(queries)
+
+
+def run(requests=200, reservations=500):
+    with benchmark_database():
+        caches['calendars'].clear()
+        user = create_fixture(reservations)
+        feed = lambda **headers: reservations_calendar(
+            feed_request(user, **headers), user.id, user.calendar_token)
+        results = {}
+
+        page = measure('page', lambda: reservations_page(page_request(user)), max(requests // 10, 1), results)
+        build = measure('build', lambda: render_reservations_calendar(user.id), max(requests // 10, 1), results)
+
+        # The first request of a version renders the calendar
+        caches['calendars'].delete(feed_key(user.id))
+        response = feed()
+        etag, size = response['ETag'], len(response.content)
+        cached = measure('cached', feed, requests, results)
+        not_modified = measure('not modified', lambda: feed(HTTP_IF_NONE_MATCH=etag), requests, results)
+        assert feed(HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+        report(f"Reservations calendar ({reservations} reservations, {requests} requests)", [
+            ("reservations page", f"{page:.2f} ms, {count_queries(lambda: reservations_page(page_request(user)))} queries"),
+            ("feed rendered", f"{build:.2f} ms, "
+                              f"{count_queries(lambda: render_reservations_calendar(user.id))} queries, {size} bytes"),
+            ("feed cached", f"{cached:.2f} ms, {count_queries(feed)} queries"),
+            ("not modified", f"{not_modified:.2f} ms, "
+                             f"{count_queries(lambda: feed(HTTP_IF_NONE_MATCH=etag))} queries"),
+        ])
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
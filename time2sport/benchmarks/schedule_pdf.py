@@ -0,0 +1,88 @@
+'''
+Benchmark of the download of the activities schedules PDF.
+
+Compares the previous query and render of the PDF on every request with the
+snapshot kept in the cache for the version of the schedules, and with the
+304 answered to the browsers that already have the PDF.
+
+    python -m benchmarks.schedule_pdf [requests] [activities]
+'''
+import sys
+from datetime import time
+
+from benchmarks.utils import benchmark_database, timer, report
+
+from django.core.cache import caches
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+from sbai.models import Activity, DayOfWeek, Schedule
+from sbai.schedules import group_schedules, render_schedules_pdf
+from sbai.views import download_activities_schedule
+from sgu.models import User
+
+SCHEDULES_PER_ACTIVITY = 6
+
+
+def legacy_download(request):
+    ''' Previous implementation: query the schedules and render the PDF on every request '''
+    grouped = group_schedules(Activity.objects.order_by('id'))
+    return render_schedules_pdf("Horarios de Actividades", "Actividad", grouped)
+
+
+def create_fixture(activities):
+    ''' Activities with schedules on several days of the week '''
+    schedules = Schedule.objects.bulk_create([
+        Schedule(day_of_week=day, hour_begin=time(hour, 0), hour_end=time(hour + 1, 0))
+        for day in DayOfWeek.values for hour in range(8, 22)])
+    created = Activity.objects.bulk_create([
+        Activity(name=f"Actividad {i}", location="Pabellón", description="Actividad", activity_type="terrestre")
+        for i in range(activities)])
+    through = Activity.schedules.through
+    through.objects.bulk_create([
+        through(activity_id=activity.id, schedule_id=schedules[(i * 7 + j * 15) % len(schedules)].id)
+        for i, activity in enumerate(created) for j in range(SCHEDULES_PER_ACTIVITY)])
+    return User.objects.create_user(username="bench", password="bench")
+
+
+def download_request(user, **headers):
+    url = reverse('download_activities_schedule')
+    request = RequestFactory().get(url, **headers)
+    request.user = user
+    request.resolver_match = resolve(url)
+    return request
+
+
+def measure(label, function, requests, results):
+    with timer(label, results):
+        for _ in range(requests):
+            function()
+    return requests / results[label]
+
+
+def run(requests=200, activities=40):
+    with benchmark_database():
+        caches['schedules'].clear()
+        user = create_fixture(activities)
+        results = {}
+
+        legacy = measure('legacy', lambda: legacy_download(download_request(user)), requests, results)
+
+        # The first request builds the snapshot of the current version
+        etag = download_activities_schedule(download_request(user))['ETag']
+        cached = measure('cached', lambda: download_activities_schedule(download_request(user)), requests, results)
+        not_modified = measure(
+            'not modified',
+            lambda: download_activities_schedule(download_request(user, HTTP_IF_NONE_MATCH=etag)),
+            requests, results)
+        assert download_activities_schedule(download_request(user, HTTP_IF_NONE_MATCH=etag)).status_code == 304
+
+        report(f"Activities schedules PDF ({activities} activities, {requests} requests)", [
+            ("legacy", f"{legacy:.0f} requests/s"),
+            ("cached", f"{cached:.0f} requests/s"),
+            ("not modified", f"{not_modified:.0f} requests/s"),
+            ("speed-up", f"{cached / legacy:.1f}x"),
+        ])
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
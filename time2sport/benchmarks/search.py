@@ -0,0 +1,89 @@
+'''
+Benchmark of the search of activities and facilities over 100k synthetic rows.
+
+Compares the previous search, a case-insensitive substring of the names that
+scans the tables and returns every match, with the full-text search of the
+names, locations and descriptions in the GIN indexes of the search documents,
+ranked and cut to the first page.
+
+    python -m benchmarks.search [rows]
+'''
+import random
+import sys
+import timeit
+
+from benchmarks.utils import benchmark_database, report
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connection
+from sbai.models import Activity, SportFacility
+from sbai.search import search
+
+SPORTS = ["Natación", "Pádel", "Tenis", "Fútbol", "Baloncesto", "Yoga", "Pilates", "Zumba", "Escalada",
+          "Atletismo", "Voleibol", "Balonmano", "Esgrima", "Judo", "Kárate", "Ciclismo"]
+LEVELS = ["Iniciación", "Avanzado", "Competición", "Libre", "Infantil", "Máster"]
+PLACES = ["Pabellón", "Piscina cubierta", "Piscina exterior", "Sala", "Pista", "Campo", "Rocódromo"]
+WORDS = ["clases", "entrenamiento", "técnica", "grupo", "monitor", "sesiones", "nivel", "material",
+         "incluido", "reducido", "equipo", "mañana", "tarde", "resistencia", "coordinación", "fuerza"]
+
+SEARCHES = ["natacion", "Natación", "pista tenis", "escalada avanzado", "monitor", "ciclimso"]
+
+
+def description(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(12))
+
+
+def create_fixture(rows, batch_size=5000):
+    ''' Half activities and half facilities with names, places and descriptions combining the words '''
+    rng = random.Random(0)
+    Activity.objects.bulk_create([
+        Activity(name=f"{rng.choice(SPORTS)} {rng.choice(LEVELS)} {i}", location=f"{rng.choice(PLACES)} {i % 40}",
+                 description=description(rng), activity_type=rng.choice(["terrestre", "acuática"]))
+        for i in range(rows // 2)], batch_size=batch_size)
+    SportFacility.objects.bulk_create([
+        SportFacility(name=f"{rng.choice(PLACES)} de {rng.choice(SPORTS)} {i}", number_of_facilities=1,
+                      description=description(rng), hour_price=10, facility_type=rng.choice(["interior", "exterior"]))
+        for i in range(rows - rows // 2)], batch_size=batch_size)
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+
+def legacy_search(text):
+    ''' Previous implementation: every facility and activity containing the text in its name '''
+    facilities = list(SportFacility.objects.filter(name__icontains=text))
+    activities = list(Activity.objects.filter(name__icontains=text))
+    return len(facilities) + len(activities)
+
+
+def full_text_search(text):
+    ''' First page of every list and the number of results '''
+    found = 0
+    for model in (SportFacility, Activity):
+        page = Paginator(search(model.objects.all(), text), settings.SEARCH_RESULTS_PER_PAGE).get_page(1)
+        list(page)
+        found += page.paginator.count
+    return found
+
+
+def best_of(function, number=5):
+    ''' Best time of a call in milliseconds '''
+    return min(timeit.repeat(function, number=1, repeat=number)) * 1000
+
+
+def run(rows=100000):
+    with benchmark_database():
+        create_fixture(rows)
+
+        results = []
+        for text in SEARCHES:
+            legacy = best_of(lambda: legacy_search(text))
+            full_text = best_of(lambda: full_text_search(text))
+            results.append((f'"{text}"', f"icontains {legacy:7.1f} ms ({legacy_search(text):6d} found)   "
+                                        f"full-text {full_text:7.1f} ms ({full_text_search(text):6d} found)"))
+
+        report(f"Search ({rows} activities and facilities)", results)
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,90 @@
+'''
+Benchmark of the cancellation of every session of an activity for a day.
+
+Compares cancelling the reservations one at a time with Reservation.cancel
+with the set based Session.cancel_sessions.
+
+    python -m benchmarks.session_cancellation [sessions] [reservations_per_session]
+'''
+import sys
+from datetime import date, time, timedelta
+
+from benchmarks.utils import benchmark_database, timer, report
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from sbai.models import Activity, Bonus, DayOfWeek, Schedule
+from sgu.models import User
+from slegpn.models import Notification, ProductBonus
+from src.models import Reservation, Session
+
+
+def legacy_cancel(sessions):
+    ''' Previous implementation: one cancellation and notification per reservation '''
+    for reservation in Reservation.objects.filter(session__in=sessions).select_related('session__activity', 'bonus__bonus'):
+        reservation.cancel()
+        Notification.objects.create(
+            user_id=reservation.user_id, title="Sesión cancelada",
+            content=f"Se ha cancelado la sesión de {reservation.session.activity.name}.")
+    sessions.delete()
+
+
+def create_fixture(sessions, reservations_per_session):
+    ''' Create an activity with full sessions on the same day booked with single-use bonuses '''
+    schedule = Schedule.objects.create(
+        day_of_week=DayOfWeek.LUNES, hour_begin=time(8, 0), hour_end=time(9, 0))
+    activity = Activity.objects.create(
+        name="Benchmark", location="Pabellón", description="Benchmark", activity_type="terrestre")
+    bonus = Bonus.objects.create(activity=activity, bonus_type='single', price=5)
+    users = User.objects.bulk_create(
+        [User(username=f"bench{i}", password="!") for i in range(reservations_per_session)])
+    product_bonuses = ProductBonus.objects.bulk_create([
+        ProductBonus(user=user, bonus=bonus, one_use_available=False)
+        for _ in range(sessions) for user in users
+    ])
+
+    day = date.today() + timedelta(days=7)
+    created = Session.objects.bulk_create([
+        Session(activity=activity, schedule=schedule, capacity=reservations_per_session, free_places=0,
+                date=day, start_time=time(i // 60 % 24, i % 60), end_time=time(23, 59))
+        for i in range(sessions)
+    ])
+    Reservation.objects.bulk_create([
+        Reservation(user=product_bonus.user, session=session, bonus=product_bonus)
+        for session, start in zip(created, range(0, len(product_bonuses), reservations_per_session))
+        for product_bonus in product_bonuses[start:start + reservations_per_session]
+    ])
+    return Session.objects.filter(date=day)
+
+
+def measure(label, function, sessions, results):
+    # The query log keeps at most 9000 queries
+    connection.queries_log.clear()
+    with CaptureQueriesContext(connection) as queries:
+        with timer(label, results):
+            outcome = function(sessions)
+    return len(queries), outcome
+
+
+def run(sessions=50, reservations_per_session=100):
+    with benchmark_database():
+        results = {}
+        legacy_queries, _ = measure(
+            'legacy', legacy_cancel, create_fixture(sessions, reservations_per_session), results)
+
+        Notification.objects.all().delete()
+        Activity.objects.all().delete()
+        User.objects.all().delete()
+        bulk_queries, counts = measure(
+            'bulk', Session.cancel_sessions, create_fixture(sessions, reservations_per_session), results)
+
+        report(f"Session cancellation ({sessions} sessions, {sessions * reservations_per_session} reservations)", [
+            ("legacy", f"{results['legacy'] * 1000:.0f} ms, {legacy_queries}{'+' if legacy_queries >= 9000 else ''} queries"),
+            ("bulk", f"{results['bulk'] * 1000:.0f} ms, {bulk_queries} queries"),
+            ("speed-up", f"{results['legacy'] / results['bulk']:.1f}x"),
+            ("counts", counts),
+        ])
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
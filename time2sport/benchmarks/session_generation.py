@@ -0,0 +1,97 @@
+'''
+Benchmark of Session.create_sessions against the previous per-row implementation.
+
+Generates a 16-week horizon of facility slots for every court and compares
+the rows inserted per second.
+
+    python -m benchmarks.session_generation [weeks] [courts]
+'''
+import sys
+from datetime import datetime, date, time, timedelta
+
+from benchmarks.utils import benchmark_database, timer, report
+
+from sbai.models import DayOfWeek, Schedule, SportFacility
+from src.models import Session
+
+
+def legacy_create_sessions(schedules, facility, weeks):
+    ''' Previous implementation: one INSERT per slot, re-parsing the hours every time '''
+    instances = SportFacility.objects.filter(
+        name__regex=f"^{facility.name}( [0-9]+)?$")
+    facility_schedules = facility.schedules.all()
+    today = datetime.today()
+    count = 0
+
+    for week in range(weeks):
+        for schedule in schedules:
+            if schedule in facility_schedules:
+                sch = facility_schedules.get(
+                    day_of_week=schedule.day_of_week, hour_begin=schedule.hour_begin, hour_end=schedule.hour_end)
+                days_diff = int(schedule.day_of_week) - today.weekday()
+                if days_diff <= 0:
+                    days_diff += 7
+                session_date = today + timedelta(days=days_diff, weeks=week)
+
+                start_time = datetime.strptime(
+                    str(schedule.hour_begin), "%H:%M:%S").time()
+                end_time = datetime.strptime(
+                    str(schedule.hour_end), "%H:%M:%S").time()
+                current_time = datetime.combine(today, start_time)
+
+                while current_time.time() < end_time:
+                    next_time = current_time + timedelta(hours=1)
+                    for instance in instances:
+                        Session.objects.create(
+                            facility=instance,
+                            schedule=sch,
+                            date=session_date,
+                            capacity=1,
+                            free_places=1,
+                            start_time=current_time.time(),
+                            end_time=next_time.time()
+                        )
+                        count += 1
+                    current_time = next_time
+    return count
+
+
+def create_fixture(courts):
+    ''' Create a facility with several courts open every day from 08:00 to 22:00 '''
+    schedules = [Schedule.objects.create(day_of_week=day, hour_begin=time(8, 0), hour_end=time(22, 0))
+                 for day in DayOfWeek.values]
+    facility = SportFacility.objects.create(
+        name="Pista de Pádel", number_of_facilities=courts, description="Benchmark",
+        hour_price=10, facility_type="exterior", schedules=schedules)
+    return schedules, facility
+
+
+def run(weeks=16, courts=8):
+    with benchmark_database():
+        schedules, facility = create_fixture(courts)
+        results = {}
+
+        with timer('legacy', results):
+            legacy_rows = legacy_create_sessions(schedules, facility, weeks)
+        Session.objects.all().delete()
+
+        with timer('bulk', results):
+            Session.create_sessions(schedules, facility=facility, weeks=weeks)
+        bulk_rows = Session.objects.count()
+
+        # Second run only skips existing rows
+        with timer('bulk (already generated)', results):
+            Session.create_sessions(schedules, facility=facility, weeks=weeks)
+        assert Session.objects.count() == bulk_rows
+
+        report(f"Session generation ({weeks} weeks, {courts} courts)", [
+            ("rows", f"{legacy_rows} legacy / {bulk_rows} bulk"),
+            ("legacy", f"{results['legacy']:.3f} s ({legacy_rows / results['legacy']:.0f} rows/s)"),
+            ("bulk", f"{results['bulk']:.3f} s ({bulk_rows / results['bulk']:.0f} rows/s)"),
+            ("bulk (already generated)", f"{results['bulk (already generated)']:.3f} s"),
+            ("speed-up", f"{results['legacy'] / results['bulk']:.1f}x"),
+        ])
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
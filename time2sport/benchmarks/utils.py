@@ -0,0 +1,49 @@
+import os
+import time
+from contextlib import contextmanager
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'time2sport.settings')
+django.setup()
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import override_settings
+
+# Redis database of the caches of the benchmarks, which they can flush
+BENCHMARK_CACHE_LOCATION = 'redis://localhost:6379/15'
+
+
+@contextmanager
+def benchmark_database():
+    ''' Create a throwaway test database for the benchmark and destroy it afterwards.
+    The Redis caches are moved to a database of their own, so the ones of the application are not flushed '''
+    caches = {
+        alias: {**config, 'LOCATION': BENCHMARK_CACHE_LOCATION} if 'redis' in config['BACKEND'].lower() else config
+        for alias, config in settings.CACHES.items()
+    }
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with override_settings(CACHES=caches):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+@contextmanager
+def timer(label, results):
+    ''' Measure the wall time of a block and store it in results[label] '''
+    start = time.perf_counter()
+    yield
+    results[label] = time.perf_counter() - start
+
+
+def report(title, rows):
+    ''' Print the benchmark results as a simple table '''
+    print(f"\n{title}")
+    print("-" * len(title))
+    width = max(len(label) for label, _ in rows)
+    for label, value in rows:
+        print(f"{label.ljust(width)}  {value}")
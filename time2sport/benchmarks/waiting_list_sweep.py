@@ -0,0 +1,122 @@
+'''
+Benchmark of the expiry of waiting list notifications with many notified entries.
+
+Compares the previous countdown task per freed place with the periodic sweep
+of expire_waiting_list_notifications: the broker memory taken by the pending
+tasks and the time to promote the next users once the notifications expire.
+Needs Redis running, the countdown tasks are sent to the database 15.
+
+    python -m benchmarks.waiting_list_sweep [entries]
+'''
+import sys
+from datetime import date, time, timedelta
+
+import redis
+from benchmarks.utils import benchmark_database, timer, report
+
+from celery import Celery
+from django.conf import settings
+from django.utils import timezone
+from sbai.models import Activity, DayOfWeek, Schedule
+from sgu.models import User
+from slegpn.models import Notification, WaitingList
+from slegpn.tasks import expire_waiting_list_notifications
+from src.models import Reservation, Session
+
+BENCHMARK_BROKER = 'redis://localhost:6379/15'
+
+
+def legacy_check_waiting_list_timeout(session_id):
+    ''' Previous implementation: the countdown task run for every freed place '''
+    session = Session.objects.get(id=session_id)
+    waiting_list = session.waiting_list.order_by('join_date')
+    current_entry = waiting_list.filter(notified_at__isnull=False).first()
+
+    if current_entry:
+        time_limit = current_entry.notified_at + \
+            timedelta(minutes=settings.WAITING_LIST_NOTIFICATION_MINS)
+        if timezone.now() > time_limit:
+            if Reservation.objects.filter(user=current_entry.user, session=session).exists():
+                current_entry.delete()
+            else:
+                Notification.objects.create(
+                    user=current_entry.user, title="Tiempo para reservar a expirado",
+                    content=f"No has confirmado tu plaza de {session.activity.name} a tiempo.")
+                current_entry.delete()
+
+                next_entry = session.waiting_list.filter(notified_at__isnull=True).first()
+                if next_entry:
+                    next_entry.notified_at = timezone.now()
+                    next_entry.save()
+                    Notification.objects.create(
+                        user=next_entry.user, title="¡Apúntate a la sesión, se ha liberado una plaza!",
+                        content=f"Se ha liberado una plaza de {session.activity.name}.")
+
+
+def broker_memory(tasks):
+    ''' Memory taken in Redis by the given number of pending countdown tasks '''
+    client = redis.Redis.from_url(BENCHMARK_BROKER)
+    client.flushdb()
+    app = Celery(broker=BENCHMARK_BROKER)
+    before = client.info('memory')['used_memory']
+    with app.connection_for_write() as connection:
+        for session_id in range(tasks):
+            app.send_task('slegpn.tasks.check_waiting_list_timeout', (session_id,),
+                          countdown=settings.WAITING_LIST_NOTIFICATION_MINS * 60,
+                          connection=connection)
+    used = client.info('memory')['used_memory'] - before
+    client.flushdb()
+    return used
+
+
+def create_fixture(entries):
+    ''' Create full sessions with an expired notified user and a waiting user each '''
+    schedule = Schedule.objects.create(
+        day_of_week=DayOfWeek.LUNES, hour_begin=time(8, 0), hour_end=time(9, 0))
+    activity = Activity.objects.create(
+        name="Benchmark", location="Pabellón", description="Benchmark", activity_type="terrestre")
+    notified, waiting = User.objects.bulk_create(
+        [User(username="notified", password="!"), User(username="waiting", password="!")])
+
+    day = date.today() + timedelta(days=7)
+    sessions = Session.objects.bulk_create([
+        Session(activity=activity, schedule=schedule, capacity=1, free_places=0,
+                date=day + timedelta(days=i // 1440), start_time=time(i // 60 % 24, i % 60),
+                end_time=time(23, 59))
+        for i in range(entries)
+    ])
+    expired = timezone.now() - timedelta(minutes=settings.WAITING_LIST_NOTIFICATION_MINS + 1)
+    WaitingList.objects.bulk_create([
+        WaitingList(user=user, session=session, join_date=expired - timedelta(minutes=minutes),
+                    notified_at=expired if user == notified else None)
+        for session in sessions for user, minutes in ((notified, 2), (waiting, 1))
+    ], batch_size=5000)
+    return [session.id for session in sessions]
+
+
+def run(entries=5000):
+    with benchmark_database():
+        results = {}
+
+        session_ids = create_fixture(entries)
+        with timer('legacy', results):
+            for session_id in session_ids:
+                legacy_check_waiting_list_timeout(session_id)
+
+        Activity.objects.all().delete()
+        User.objects.all().delete()
+        create_fixture(entries)
+        with timer('sweep', results):
+            promoted = expire_waiting_list_notifications()
+
+        report(f"Waiting list expiry ({entries} notified entries)", [
+            ("legacy broker memory", f"{broker_memory(entries) / 1024:.0f} KiB in {entries} countdown tasks"),
+            ("sweep broker memory", f"{broker_memory(1) / 1024:.1f} KiB in 1 periodic task"),
+            ("legacy promotion", f"{results['legacy'] * 1000:.0f} ms for the last session"),
+            ("sweep promotion", f"{results['sweep'] * 1000:.0f} ms for {promoted} sessions "
+                                f"(+ up to {settings.WAITING_LIST_SWEEP_SECONDS} s until the next sweep)"),
+        ])
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,126 @@
+'''
+Benchmark of the PDF export of the sessions of a week with 10,000 sessions.
+
+Compares the previous approach, one Table with every session rendered into
+the response buffer, with the export that reads the sessions in chunks and
+feeds the document one LongTable at a time into a spooled temporary file.
+Every export runs in a forked process to measure its own peak RSS.
+
+    python -m benchmarks.week_sessions_export [facilities]
+'''
+import json
+import os
+import sys
+import tempfile
+import time as clock
+from datetime import date, time, timedelta
+
+from benchmarks.utils import benchmark_database, report
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Table, Paragraph, Spacer
+from sbai.exports import WEEK_SESSIONS_HEADER, week_bounds, write_week_sessions_pdf
+from sbai.models import DayOfWeek, Schedule, SportFacility
+from sbai.schedules import TABLE_STYLE
+from sgu.models import User
+from src.models import Session
+
+HOURS = range(9, 21)
+
+
+def legacy_export(user, monday):
+    ''' Previous approach: the sessions as model instances in one Table built into the response '''
+    response = HttpResponse(content_type='application/pdf')
+    doc = SimpleDocTemplate(response, pagesize=letter)
+    styles = getSampleStyleSheet()
+
+    data = [WEEK_SESSIONS_HEADER]
+    sessions = Session.objects.filter(date__range=week_bounds(monday)).select_related(
+        'activity', 'facility').order_by('date', 'start_time')
+    for session in sessions:
+        data.append([
+            session.date.strftime('%d/%m/%Y'),
+            f"{session.start_time.strftime('%H:%M')} - {session.end_time.strftime('%H:%M')}",
+            session.activity.name if session.activity else session.facility.name,
+            f"{session.free_places} / {session.capacity}",
+        ])
+
+    table = Table(data, colWidths=[90, 90, 200, 90], repeatRows=1)
+    table.setStyle(TABLE_STYLE)
+    doc.build([Paragraph("Sesiones", styles["Title"]), Spacer(1, 12), table])
+    return len(response.content)
+
+
+def streaming_export(user, monday):
+    ''' The export: sessions read in chunks, one LongTable at a time into a spooled temporary file '''
+    with tempfile.SpooledTemporaryFile(max_size=settings.EXPORT_SPOOL_MAX_SIZE) as output:
+        write_week_sessions_pdf(output, monday)
+        return output.tell()
+
+
+def memory_kb(field):
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field):
+                return int(line.split()[1])
+
+
+def in_child(function, *args):
+    ''' Runs the export in a forked process and returns its time, the growth of its peak RSS and the PDF size '''
+    connections.close_all()
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        start_rss = memory_kb('VmRSS')
+        start = clock.perf_counter()
+        size = function(*args)
+        result = {'seconds': clock.perf_counter() - start, 'size': size,
+                  'peak_mb': (memory_kb('VmHWM') - start_rss) / 1024}
+        os.write(write, json.dumps(result).encode())
+        os._exit(0)
+
+    os.close(write)
+    with os.fdopen(read) as pipe:
+        result = json.loads(pipe.read())
+    os.waitpid(pid, 0)
+    return result
+
+
+def create_fixture(facilities):
+    ''' Sessions every hour of a week for many facility instances '''
+    schedule = Schedule.objects.create(
+        day_of_week=DayOfWeek.LUNES, hour_begin=time(HOURS[0], 0), hour_end=time(HOURS[-1] + 1, 0))
+    SportFacility.objects.create(
+        name="Pista", number_of_facilities=facilities, description="Pista", hour_price=10, facility_type="Exterior")
+    monday, _ = week_bounds(date.today())
+    Session.objects.bulk_create([
+        Session(facility=facility, schedule=schedule, capacity=1, free_places=1,
+                date=monday + timedelta(days=day), start_time=time(hour, 0), end_time=time(hour + 1, 0))
+        for facility in SportFacility.objects.all() for day in range(7) for hour in HOURS
+    ], batch_size=5000)
+    return User.objects.create_user(username="bench", password="bench"), monday
+
+
+def run(facilities=120):
+    with benchmark_database():
+        user, monday = create_fixture(facilities)
+        rows = Session.objects.count()
+
+        legacy = in_child(legacy_export, user, monday)
+        streaming = in_child(streaming_export, user, monday)
+
+        report(f"Week sessions PDF export ({rows} rows)", [
+            ("legacy", f"{legacy['seconds']:.1f} s, peak RSS +{legacy['peak_mb']:.0f} MB, "
+                       f"{legacy['size'] / 1024:.0f} KB"),
+            ("streaming", f"{streaming['seconds']:.1f} s, peak RSS +{streaming['peak_mb']:.0f} MB, "
+                          f"{streaming['size'] / 1024:.0f} KB"),
+        ])
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
@@ -10,3 +10,4 @@ psql -U alumnodb -h localhost -d postgres -c "CREATE DATABASE time2sport OWNER a
 python3 manage.py makemigrations
 python3 manage.py migrate
 python3 populate.py
+python3 manage.py reconcile_unread_notifications
@@ -1,8 +1,10 @@
 from django.contrib import admin
-from .models import SportFacility, Activity, Schedule, Photo, Bonus
+from .models import SportFacility, FacilityGroup, Activity, Schedule, Photo, Bonus, ExportJob
 
 admin.site.register(SportFacility)
+admin.site.register(FacilityGroup)
 admin.site.register(Activity)
 admin.site.register(Schedule)
 admin.site.register(Photo)
 admin.site.register(Bonus)
+admin.site.register(ExportJob)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SbaiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sbai'
+
+    def ready(self):
+        import sbai.signals
@@ -0,0 +1,262 @@
+import csv
+import io
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, LongTable, Paragraph, Spacer
+
+from src.models import Session
+from .schedules import SCHEDULES, TABLE_STYLE, get_schedules_snapshot, get_schedules_version
+
+WEEK_SESSIONS_HEADER = ["Fecha", "Horario", "Actividad / Instalación", "Plazas libres"]
+
+
+class LazyStory(list):
+    ''' Story of a document that takes the flowables from an iterator as the previous ones are drawn.
+    ReportLab builds the document from a list, so only the flowable being drawn is kept in memory. '''
+
+    def __init__(self, flowables):
+        super().__init__()
+        self._pending = iter(flowables)
+
+    def __len__(self):
+        if not super().__len__():
+            flowable = next(self._pending, None)
+            if flowable is not None:
+                self.append(flowable)
+        return super().__len__()
+
+
+def week_bounds(day):
+    ''' Gets the monday and the sunday of the week of a day. '''
+    monday = day - timedelta(days=day.weekday())
+    return monday, monday + timedelta(days=6)
+
+
+def get_week_sessions(monday):
+    ''' Gets the sessions of a week as tuples, read from the database in chunks. '''
+    sessions = Session.objects.filter(date__range=week_bounds(monday)).order_by(
+        'date', 'start_time', 'activity__name', 'facility__name', 'id').values_list(
+        'id', 'date', 'start_time', 'end_time', 'activity__name', 'activity__location', 'facility__name',
+        'free_places', 'capacity')
+    return sessions.iterator(chunk_size=settings.EXPORT_ROWS_PER_TABLE)
+
+
+def get_week_sessions_rows(monday):
+    ''' Gets the rows of the sessions of a week shown in the exports. '''
+    for _, day, start_time, end_time, activity, _, facility, free_places, capacity in get_week_sessions(monday):
+        yield [
+            day.strftime('%d/%m/%Y'),
+            f"{start_time.strftime('%H:%M')} - {end_time.strftime('%H:%M')}",
+            activity or facility,
+            f"{free_places} / {capacity}",
+        ]
+
+
+def long_tables(header, rows, col_widths):
+    ''' Splits the rows in tables of EXPORT_ROWS_PER_TABLE rows that repeat the header on every page. '''
+    rows = iter(rows)
+    while chunk := list(islice(rows, settings.EXPORT_ROWS_PER_TABLE)):
+        table = LongTable([header] + chunk, colWidths=col_widths, repeatRows=1)
+        table.setStyle(TABLE_STYLE)
+        yield table
+
+
+def write_week_sessions_pdf(output, week):
+    ''' Writes the PDF with the sessions of the week of a day into a file, table by table. '''
+    monday, sunday = week_bounds(week)
+    doc = SimpleDocTemplate(output, pagesize=letter)
+    styles = getSampleStyleSheet()
+
+    def story():
+        yield Paragraph(
+            f"Sesiones del {monday.strftime('%d/%m/%Y')} al {sunday.strftime('%d/%m/%Y')}", styles["Title"])
+        yield Spacer(1, 12)
+        empty = True
+        for table in long_tables(WEEK_SESSIONS_HEADER, get_week_sessions_rows(monday), [90, 90, 200, 90]):
+            empty = False
+            yield table
+        if empty:
+            yield Paragraph("No hay sesiones esta semana.", styles["Normal"])
+
+    doc.build(LazyStory(story()))
+
+
+@contextmanager
+def text_output(output):
+    ''' Writes text in UTF-8 into a binary file, which is left open. '''
+    stream = io.TextIOWrapper(output, encoding='utf-8', newline='')
+    try:
+        yield stream
+    finally:
+        stream.flush()
+        stream.detach()
+
+
+def write_week_sessions_csv(output, week):
+    ''' Writes the CSV with the sessions of the week of a day into a file. '''
+    with text_output(output) as stream:
+        writer = csv.writer(stream)
+        writer.writerow(WEEK_SESSIONS_HEADER)
+        writer.writerows(get_week_sessions_rows(week_bounds(week)[0]))
+
+
+def ics_escape(text):
+    ''' Escapes a text value of an iCalendar property. '''
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def ics_line(line):
+    ''' Folds a content line of an iCalendar file in lines of at most 75 bytes. '''
+    encoded = line.encode('utf-8')
+    parts = []
+    limit = 75
+    while len(encoded) > limit:
+        # The characters are never cut
+        size = limit
+        while (encoded[size] & 0xC0) == 0x80:
+            size -= 1
+        parts.append(encoded[:size].decode('utf-8'))
+        encoded = encoded[size:]
+        # The continuation lines start with a space
+        limit = 74
+    parts.append(encoded.decode('utf-8'))
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def ics_datetime(day, hour):
+    ''' Formats a local date and time of the application as an iCalendar UTC date-time. '''
+    value = timezone.make_aware(datetime.combine(day, hour)).astimezone(dt_timezone.utc)
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+def write_ics(output, events, name):
+    ''' Writes an iCalendar file with the events, dicts of their properties, into a file. '''
+    stamp = timezone.now().astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    with text_output(output) as stream:
+        stream.write(ics_line("BEGIN:VCALENDAR"))
+        stream.write(ics_line("VERSION:2.0"))
+        stream.write(ics_line("PRODID:-//Time2Sport//ES"))
+        stream.write(ics_line("CALSCALE:GREGORIAN"))
+        stream.write(ics_line(f"X-WR-CALNAME:{ics_escape(name)}"))
+        for event in events:
+            stream.write(ics_line("BEGIN:VEVENT"))
+            stream.write(ics_line(f"DTSTAMP:{stamp}"))
+            for prop, value in event.items():
+                stream.write(ics_line(f"{prop}:{value}"))
+            stream.write(ics_line("END:VEVENT"))
+        stream.write(ics_line("END:VCALENDAR"))
+
+
+def session_event(session_id, day, start_time, end_time, name, location):
+    ''' Gets the properties of the event of a session. '''
+    event = {
+        'UID': f"session-{session_id}@time2sport",
+        'DTSTART': ics_datetime(day, start_time),
+        'DTEND': ics_datetime(day, end_time),
+        'SUMMARY': ics_escape(name),
+    }
+    if location:
+        event['LOCATION'] = ics_escape(location)
+    return event
+
+
+def write_week_sessions_ics(output, week):
+    ''' Writes the iCalendar file with the sessions of the week of a day into a file. '''
+    monday, _ = week_bounds(week)
+    events = (
+        session_event(session_id, day, start_time, end_time, activity or facility, location or facility)
+        for session_id, day, start_time, end_time, activity, location, facility, _, _ in get_week_sessions(monday)
+    )
+    write_ics(output, events, f"Sesiones del {monday.strftime('%d/%m/%Y')}")
+
+
+def write_activity_sessions_ics(output, activity):
+    ''' Writes the iCalendar file with the upcoming sessions of an activity into a file. '''
+    sessions = Session.objects.filter(activity=activity, date__gte=timezone.localdate()).order_by(
+        'date', 'start_time').values_list('id', 'date', 'start_time', 'end_time')
+    events = (
+        session_event(session_id, day, start_time, end_time, activity.name, activity.location)
+        for session_id, day, start_time, end_time in sessions
+    )
+    write_ics(output, events, activity.name)
+
+
+def schedules_writers(kind):
+    ''' Gets the writers of the PDF and the CSV of the schedules of the activities or facilities. '''
+    def write_pdf(output):
+        output.write(get_schedules_snapshot(kind)['pdf'])
+
+    def write_csv(output):
+        _, _, header = SCHEDULES[kind]
+        with text_output(output) as stream:
+            writer = csv.writer(stream)
+            writer.writerow([header, "Día", "Horario"])
+            for item in get_schedules_snapshot(kind)['schedules']:
+                for schedule in item['schedules']:
+                    writer.writerow([item['name'], schedule['day'], schedule['times'].replace("\n", ", ")])
+
+    return {'pdf': write_pdf, 'csv': write_csv}
+
+
+# Name and writers by format of every export
+EXPORTS = {
+    'activities_schedule': ("Horarios de Actividades", schedules_writers('activities')),
+    'facilities_schedule': ("Horarios de Instalaciones", schedules_writers('facilities')),
+    'week_sessions': ("Sesiones de la semana", {
+        'pdf': write_week_sessions_pdf,
+        'csv': write_week_sessions_csv,
+        'ics': write_week_sessions_ics,
+    }),
+}
+
+
+def export_parameters(kind, export_format, data):
+    ''' Gets the parameters of an export from the data of a request. Raises ValueError if the export doesn't exist. '''
+    if kind not in EXPORTS or export_format not in EXPORTS[kind][1]:
+        raise ValueError(f"Unknown export {kind} in {export_format}")
+    if kind != 'week_sessions':
+        return {}
+
+    # The current week if the day is missing or not valid
+    try:
+        day = parse_date(data.get('week', '')) or timezone.localdate()
+    except ValueError:
+        day = timezone.localdate()
+    monday, _ = week_bounds(day)
+    return {'week': monday.isoformat()}
+
+
+def export_key(kind, export_format, parameters):
+    ''' Gets the key of an export, the same for all the requests of the same file. '''
+    values = [kind, export_format] + [f"{name}={value}" for name, value in sorted(parameters.items())]
+    # The schedules files are the same until the schedules change
+    if kind != 'week_sessions':
+        values.append(f"{get_schedules_version():.6f}")
+    return ":".join(values)
+
+
+def export_name(kind, parameters):
+    ''' Gets the name of an export shown to the users. '''
+    name, _ = EXPORTS[kind]
+    if 'week' in parameters:
+        name += f" del {datetime.fromisoformat(parameters['week']).strftime('%d/%m/%Y')}"
+    return name
+
+
+def export_filename(kind, export_format, parameters):
+    ''' Gets the name of the downloaded file of an export. '''
+    return "_".join([kind] + [value for _, value in sorted(parameters.items())]) + f".{export_format}"
+
+
+def write_export(output, kind, export_format, parameters):
+    ''' Writes an export into a binary file. '''
+    _, writers = EXPORTS[kind]
+    arguments = {name: datetime.fromisoformat(value).date() for name, value in parameters.items()}
+    writers[export_format](output, **arguments)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from sbai.models import SportFacility
+
+
+class Command(BaseCommand):
+    help = 'Groups the existing facility instances ("Name", "Name 2", ...) under a FacilityGroup'
+
+    def handle(self, *args, **options):
+        updated = SportFacility.objects.assign_groups()
+        self.stdout.write(self.style.SUCCESS(
+            f"{updated} instalaciones agrupadas."))
@@ -1,4 +1,10 @@
-from django.db import models
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import IntegrityError, models, transaction
+from django.db.models import Q
+from django.utils import timezone
+from datetime import timedelta
 import os
 from enum import Enum
 
@@ -18,6 +24,19 @@ def photo_upload_path(instance, filename):
     return f"photos/{filename}"
 
 
+# Spanish text search configuration that ignores the accents, created before migrating sbai
+SEARCH_CONFIG = 'spanish_unaccent'
+
+
+def search_vector(**weights):
+    ''' Function to get the text search document of the fields, weighted from A (most important) to D. '''
+    vectors = [SearchVector(field, weight=weight, config=SEARCH_CONFIG) for field, weight in weights.items()]
+    document = vectors[0]
+    for vector in vectors[1:]:
+        document = document + vector
+    return document
+
+
 class DayOfWeek(models.IntegerChoices):
     """ Class to represent the days of the week. """
     LUNES = 0, "Lunes"
@@ -39,13 +58,23 @@ class Schedule(models.Model):
         return f"{self.get_day_of_week_display()}: {self.hour_begin} - {self.hour_end}"
 
 
+class FacilityGroup(models.Model):
+    """ Class to represent a group of instances of the same sport facility. """
+    name = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
 class SportFacilityManager(models.Manager):
     ''' Custom manager for the SportFacility model used for overriding the create method. '''
 
     def create(self, name, number_of_facilities, description, hour_price, facility_type, schedules=None, **kwargs):
         instances = []
-        # If the number of facilities is greater than 1, create a list of names
+        group = None
+        # If the number of facilities is greater than 1, create a list of names under a group
         if number_of_facilities > 1:
+            group, _ = FacilityGroup.objects.get_or_create(name=name)
             original_name = name
             for i in range(1, number_of_facilities + 1):
                 if i == 1:
@@ -56,31 +85,57 @@ class SportFacilityManager(models.Manager):
         else:
             instances.append(name)
 
-        created_facilities = []
-        count = 0
-        # Iterate through the list of names and create a facility for each
-        for i in instances:
-            # If a facility with the same name does not exist, create it
-            if not self.model.objects.filter(name=i).exists():
-                facility = self.model(
-                    name=i,
-                    number_of_facilities=number_of_facilities,
-                    description=description,
-                    hour_price=hour_price,
-                    facility_type=facility_type
-                )
-                facility.save()
-
-                # If schedules are provided, set them for the facility
-                if schedules:
-                    facility.schedules.set(schedules)
-                    facility.save()
-
-                created_facilities.append(facility)
-                count += 1
+        # Only create the facilities with a name that does not exist
+        existing = set(self.model.objects.filter(
+            name__in=instances).values_list('name', flat=True))
+
+        created_facilities = self.model.objects.bulk_create([
+            self.model(
+                name=i,
+                group=group,
+                number_of_facilities=number_of_facilities,
+                description=description,
+                hour_price=hour_price,
+                facility_type=facility_type
+            )
+            for i in instances if i not in existing
+        ])
+
+        # If schedules are provided, set them for every facility at once
+        if schedules and created_facilities:
+            through = self.model.schedules.through
+            through.objects.bulk_create([
+                through(sportfacility_id=facility.id, schedule_id=schedule.id)
+                for facility in created_facilities for schedule in schedules
+            ])
+
+        # The bulk inserts don't send signals, so the schedules snapshots are renewed here
+        from .schedules import bump_schedules_version
+        bump_schedules_version()
 
         return created_facilities[0]
 
+    def assign_groups(self):
+        ''' Groups the facilities with several instances by their name ("Name", "Name 2", ...). Returns the number of facilities updated. '''
+        facilities = list(self.filter(group__isnull=True, number_of_facilities__gt=1).only(
+            'id', 'name', 'number_of_facilities'))
+        existing = set(self.filter(number_of_facilities__gt=1).values_list('name', flat=True))
+
+        names = {}
+        for facility in facilities:
+            # The first instance has the group name, the rest end with their number. A name that ends
+            # in a number out of the instances, or without a first instance, is the group name
+            name, _, number = facility.name.rpartition(" ")
+            if not (number.isdigit() and 2 <= int(number) <= facility.number_of_facilities and name in existing):
+                name = facility.name
+            names.setdefault(name, []).append(facility.id)
+
+        updated = 0
+        for name, ids in names.items():
+            group, _ = FacilityGroup.objects.get_or_create(name=name)
+            updated += self.filter(id__in=ids).update(group=group)
+        return updated
+
 
 class SportFacility(models.Model):
     """ Class to represent a sport facility. """
@@ -92,6 +147,9 @@ class SportFacility(models.Model):
     ]
 
     name = models.CharField(max_length=255)
+    # Deleting a group only ungroups its facilities
+    group = models.ForeignKey(
+        FacilityGroup, on_delete=models.SET_NULL, related_name="facilities", null=True, blank=True)
     number_of_facilities = models.IntegerField()
     description = models.TextField()
     hour_price = models.DecimalField(max_digits=6, decimal_places=2)
@@ -100,9 +158,29 @@ class SportFacility(models.Model):
     schedules = models.ManyToManyField(
         Schedule, related_name="sport_facilities", blank=True)
 
+    # Text search document kept up to date by the database
+    search_document = models.GeneratedField(
+        expression=search_vector(name='A', description='C'), output_field=SearchVectorField(), db_persist=True)
+
     # Use the custom manager
     objects = SportFacilityManager()
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_document'], name='facility_search_idx'),
+        ]
+
+    @property
+    def group_name(self):
+        """ Name shared by all the instances of the facility. """
+        return self.group.name if self.group_id else self.name
+
+    def get_instances(self):
+        """ Gets all the instances of the facility, including itself. """
+        if self.group_id is None:
+            return [self]
+        return SportFacility.objects.filter(group_id=self.group_id).order_by('id')
+
     def __str__(self):
         return self.name
 
@@ -123,6 +201,15 @@ class Activity(models.Model):
         max_length=15, choices=ACTIVITY_TYPE_CHOICES)
     schedules = models.ManyToManyField(
         Schedule, related_name="activities", blank=True)
+    # Text search document kept up to date by the database
+    search_document = models.GeneratedField(
+        expression=search_vector(name='A', location='B', description='C'), output_field=SearchVectorField(),
+        db_persist=True)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_document'], name='activity_search_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -158,3 +245,94 @@ class Bonus(models.Model):
 
     def __str__(self):
         return f"{self.get_bonus_type_display()} - {self.activity.name}"
+
+
+class ExportStatus(models.TextChoices):
+    """ Class to represent the status of an export job. """
+    PENDING = 'pending', "Pendiente"
+    RUNNING = 'running', "Generando"
+    DONE = 'done', "Lista"
+    FAILED = 'failed', "Error"
+
+
+class ExportJob(models.Model):
+    """ Class to represent the render of an export file by a Celery worker, shared by the users that request it. """
+
+    # Define the choices for the export format
+    FORMAT_CHOICES = [
+        ('pdf', 'PDF'),
+        ('csv', 'CSV'),
+        ('ics', 'ICS'),
+    ]
+
+    # Same for all the requests of the same file
+    key = models.CharField(max_length=255)
+    kind = models.CharField(max_length=30)
+    export_format = models.CharField(max_length=3, choices=FORMAT_CHOICES)
+    parameters = models.JSONField(default=dict, blank=True)
+    status = models.CharField(
+        max_length=10, choices=ExportStatus.choices, default=ExportStatus.PENDING)
+    file = models.FileField(upload_to='exports/', blank=True)
+    users = models.ManyToManyField(
+        settings.AUTH_USER_MODEL, related_name="exports")
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # A single job renders a file at a time
+            models.UniqueConstraint(
+                fields=['key'], condition=Q(status__in=[ExportStatus.PENDING, ExportStatus.RUNNING]),
+                name='unique_active_export_job'),
+        ]
+
+    @classmethod
+    def fail_stale(cls, **filters):
+        """ Marks as failed the jobs waiting or rendering for more than EXPORTS_STALE_MINUTES, left by a stopped worker
+        or a lost task, so they don't block the new requests of their file. Returns the number of jobs failed """
+        now = timezone.now()
+        limit = now - timedelta(minutes=settings.EXPORTS_STALE_MINUTES)
+        return cls.objects.filter(**filters).filter(
+            Q(status=ExportStatus.PENDING, created_at__lt=limit) |
+            Q(status=ExportStatus.RUNNING, started_at__lt=limit)).update(status=ExportStatus.FAILED, finished_at=now)
+
+    @classmethod
+    def request(cls, user, kind, export_format, parameters):
+        """ Adds the user to the job rendering the same file or that rendered it recently, or creates a new one.
+        Returns the job and whether it was created, then it has to be queued """
+        from .exports import export_key
+        key = export_key(kind, export_format, parameters)
+        recent = timezone.now() - timedelta(seconds=settings.EXPORTS_REUSE_SECONDS)
+        cls.fail_stale(key=key)
+
+        while True:
+            job = cls.objects.filter(key=key).filter(
+                Q(status__in=[ExportStatus.PENDING, ExportStatus.RUNNING]) |
+                Q(status=ExportStatus.DONE, finished_at__gte=recent)).order_by('-created_at').first()
+            created = job is None
+            if created:
+                try:
+                    with transaction.atomic():
+                        job = cls.objects.create(
+                            key=key, kind=kind, export_format=export_format, parameters=parameters)
+                except IntegrityError:
+                    # Another request created the same job at the same time
+                    continue
+            job.users.add(user)
+            return job, created
+
+    @property
+    def name(self):
+        """ Name of the export shown to the users. """
+        from .exports import export_name
+        return export_name(self.kind, self.parameters)
+
+    @property
+    def filename(self):
+        """ Name of the downloaded file. """
+        from .exports import export_filename
+        return export_filename(self.kind, self.export_format, self.parameters)
+
+    def __str__(self):
+        return f"{self.name} ({self.get_export_format_display()}) - {self.get_status_display()}"
@@ -0,0 +1,111 @@
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Prefetch
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, LongTable, TableStyle, Paragraph, Spacer
+
+from .models import Activity, Schedule, SportFacility
+
+VERSION_KEY = 'schedules:version'
+
+TABLE_STYLE = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+])
+
+# Model, title and header of the first column of every schedule
+SCHEDULES = {
+    'activities': (Activity, "Horarios de Actividades", "Actividad"),
+    'facilities': (SportFacility, "Horarios de Instalaciones", "Instalación"),
+}
+
+
+def get_schedules_version():
+    ''' Gets the version stamp of the schedules, the time of their last change. '''
+    # If the cache was flushed a new stamp is started, so the old snapshots are not used
+    return caches['schedules'].get_or_set(VERSION_KEY, time.time, timeout=None)
+
+
+def bump_schedules_version():
+    ''' Starts a new version of the schedules once the current transaction is committed. '''
+    transaction.on_commit(
+        lambda: caches['schedules'].set(VERSION_KEY, time.time(), timeout=None))
+
+
+def group_schedules(queryset):
+    ''' Groups the schedules of every activity or facility by day, reading all the schedules in one query. '''
+    grouped = []
+    ordered_schedules = Schedule.objects.order_by('day_of_week', 'hour_begin')
+    for item in queryset.prefetch_related(Prefetch('schedules', queryset=ordered_schedules)):
+        schedules_by_day = {}
+        for schedule in item.schedules.all():
+            schedules_by_day.setdefault(schedule.get_day_of_week_display(), []).append(
+                f"{schedule.hour_begin.strftime('%H:%M')} - {schedule.hour_end.strftime('%H:%M')}")
+
+        grouped.append({
+            "name": item.name,
+            "schedules": [
+                {"day": day, "times": "\n".join(times)}
+                for day, times in schedules_by_day.items()
+            ]
+        })
+    return grouped
+
+
+def render_schedules_pdf(title, header, grouped):
+    ''' Renders the grouped schedules as a PDF table, merging the cells of the items with several days. '''
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    styles = getSampleStyleSheet()
+
+    data = [[header, "Día", "Horario"]]
+    merge_styles = []
+    for item in grouped:
+        rows = [["", schedule["day"], schedule["times"]] for schedule in item["schedules"]]
+        if not rows:
+            continue
+
+        # Put the name in the first row and group the cells of the column if there are more rows
+        rows[0][0] = item["name"]
+        data.extend(rows)
+        if len(rows) > 1:
+            merge_styles.append(('SPAN', (0, len(data) - len(rows)), (0, len(data) - 1)))
+
+    # The header is repeated on every page of the long schedules
+    table = LongTable(data, colWidths=[150, 100, 150], repeatRows=1)
+    table.setStyle(TableStyle(TABLE_STYLE.getCommands() + merge_styles))
+
+    doc.build([Paragraph(title, styles["Title"]), Spacer(1, 12), table])
+    return buffer.getvalue()
+
+
+def get_schedules_snapshot(kind, version=None):
+    ''' Gets the grouped schedules and the PDF of the activities or facilities, built once per version. '''
+    cache = caches['schedules']
+    # The version is read before the data, so a snapshot is never older than its version
+    if version is None:
+        version = get_schedules_version()
+    key = f'schedules:{kind}:{version}'
+
+    snapshot = cache.get(key)
+    if snapshot is None:
+        model, title, header = SCHEDULES[kind]
+        grouped = group_schedules(model.objects.order_by('id'))
+        snapshot = {
+            'version': version,
+            'schedules': grouped,
+            'pdf': render_schedules_pdf(title, header, grouped),
+        }
+        cache.set(key, snapshot, settings.SCHEDULES_CACHE_TIMEOUT)
+    return snapshot
@@ -0,0 +1,48 @@
+import re
+from functools import cache
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import F
+
+from .models import SEARCH_CONFIG
+
+
+def extension_installed(cursor, extension):
+    ''' Checks if a PostgreSQL extension is installed in the database of a cursor. '''
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = %s", [extension])
+    return cursor.fetchone() is not None
+
+
+@cache
+def trigram_search_enabled():
+    ''' Whether the typos can be searched by trigrams, it needs the pg_trgm extension. '''
+    with connection.cursor() as cursor:
+        return extension_installed(cursor, 'pg_trgm')
+
+
+def search_query(text):
+    ''' Gets the text search query of the words of a text, every word matching as a prefix. '''
+    words = re.findall(r'[^\W_]+', text)
+    if not words:
+        return None
+    return SearchQuery(' & '.join(f"{word}:*" for word in words), config=SEARCH_CONFIG, search_type='raw')
+
+
+def search(queryset, text):
+    ''' Searches the activities or facilities of a queryset in their names, descriptions and locations,
+    the best ranked first. If no document matches, the names that look like the text are searched. '''
+    query = search_query(text)
+    if query is None:
+        return queryset.order_by('id')
+
+    results = queryset.filter(search_document=query).annotate(
+        rank=SearchRank(F('search_document'), query)).order_by('-rank', 'id')
+    if results.exists():
+        return results
+
+    # Typos
+    if trigram_search_enabled():
+        return queryset.filter(name__trigram_word_similar=text).annotate(
+            rank=TrigramWordSimilarity(text, 'name')).order_by('-rank', 'id')
+    return queryset.filter(name__icontains=text).order_by('id')
@@ -0,0 +1,66 @@
+import warnings
+
+from django.db import DatabaseError, connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_migrate
+from django.dispatch import receiver
+
+from sbai.models import SEARCH_CONFIG, Activity, Schedule, SportFacility
+from sbai.schedules import bump_schedules_version
+from sbai.search import extension_installed
+
+
+@receiver([post_save, post_delete], sender=Schedule)
+@receiver([post_save, post_delete], sender=Activity)
+@receiver([post_save, post_delete], sender=SportFacility)
+def schedules_changed(sender, **kwargs):
+    ''' Renews the schedules snapshots when a schedule, activity or facility changes. '''
+    bump_schedules_version()
+
+
+@receiver(m2m_changed, sender=Activity.schedules.through)
+@receiver(m2m_changed, sender=SportFacility.schedules.through)
+def schedules_assigned(sender, action, **kwargs):
+    ''' Renews the schedules snapshots when the schedules of an activity or facility change. '''
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_schedules_version()
+
+
+@receiver(pre_migrate)
+def create_search_configuration(sender, app_config, using, **kwargs):
+    ''' Creates the unaccent and pg_trgm extensions and the text search configuration of the search documents
+    before migrating sbai. Without unaccent the configuration is the Spanish one, whose stemmer only removes
+    the acute accents. Without pg_trgm the typos are not searched. '''
+    connection = connections[using]
+    if app_config.label != 'sbai' or connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for extension in ('unaccent', 'pg_trgm'):
+            try:
+                with transaction.atomic(using=using):
+                    cursor.execute(f"CREATE EXTENSION IF NOT EXISTS {extension}")
+            except DatabaseError as error:
+                warnings.warn(f"The {extension} extension can't be created: {error}")
+
+        cursor.execute("SELECT 1 FROM pg_ts_config WHERE cfgname = %s", [SEARCH_CONFIG])
+        if cursor.fetchone() is None:
+            cursor.execute(f"CREATE TEXT SEARCH CONFIGURATION {SEARCH_CONFIG} (COPY = spanish)")
+        if extension_installed(cursor, 'unaccent'):
+            cursor.execute(
+                f"ALTER TEXT SEARCH CONFIGURATION {SEARCH_CONFIG} "
+                "ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem")
+
+
+@receiver(post_migrate)
+def create_trigram_indexes(sender, app_config, using, **kwargs):
+    ''' Creates the trigram indexes of the names searched with typos if pg_trgm is installed.
+    They are not in the models because the index can't be created without the extension. '''
+    connection = connections[using]
+    if app_config.label != 'sbai' or connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        if not extension_installed(cursor, 'pg_trgm'):
+            return
+        for model in (Activity, SportFacility):
+            table = model._meta.db_table
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_name_trgm_idx ON {table} USING gin (name gin_trgm_ops)")
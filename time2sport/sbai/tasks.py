@@ -0,0 +1,57 @@
+import tempfile
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from sbai.exports import write_export
+from sbai.models import ExportJob, ExportStatus
+from slegpn.notifier import notify
+
+
+@shared_task
+def render_export(job_id):
+    """Renders the file of a pending export job into the media storage and notifies its users.
+    The job is taken with a locked update, so a job queued twice is rendered once"""
+    with transaction.atomic():
+        job = ExportJob.objects.select_for_update(skip_locked=True).filter(
+            id=job_id, status=ExportStatus.PENDING).first()
+        if job is None:
+            return None
+        job.status = ExportStatus.RUNNING
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=settings.EXPORT_SPOOL_MAX_SIZE) as output:
+            write_export(output, job.kind, job.export_format, job.parameters)
+            output.seek(0)
+            job.file.save(job.filename, File(output), save=False)
+    except Exception:
+        job.status = ExportStatus.FAILED
+        raise
+    else:
+        job.status = ExportStatus.DONE
+    finally:
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'file', 'finished_at'])
+        notify(list(job.users.values_list('id', flat=True)),
+               'export_ready' if job.status == ExportStatus.DONE else 'export_failed', name=job.name)
+    return job.status
+
+
+@shared_task
+def delete_old_exports():
+    """Periodic cleanup of the export jobs older than EXPORTS_KEEP_HOURS and their files,
+    including the ones left unfinished by a stopped worker. The stale jobs still recent are marked as failed"""
+    ExportJob.fail_stale()
+    limit = timezone.now() - timedelta(hours=settings.EXPORTS_KEEP_HOURS)
+    old_jobs = list(ExportJob.objects.filter(created_at__lt=limit))
+    for job in old_jobs:
+        if job.file:
+            job.file.delete(save=False)
+    ExportJob.objects.filter(id__in=[job.id for job in old_jobs]).delete()
+    return len(old_jobs)
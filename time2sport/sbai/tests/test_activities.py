@@ -1,7 +1,14 @@
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.urls import reverse
+from django.utils import timezone
+from datetime import time, timedelta
 from sbai.models import Activity, Schedule, Bonus, DayOfWeek
+from sbai.views import get_activity_sessions
 from sgu.models import User
+from slegpn.models import Notification, ProductBonus, WaitingList
+from src.models import Session, Reservation
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 
@@ -338,3 +345,98 @@ class ActivityDetailViewTestCase(TestCase):
             response, f'{self.bonus1.get_bonus_type_display()} - {self.bonus1.price:.2f}€')
         self.assertContains(
             response, f'{self.bonus2.get_bonus_type_display()} - {self.bonus2.price:.2f}€')
+
+
+class ActivitySessionsWaitingListTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.schedule = Schedule.objects.create(
+            day_of_week=DayOfWeek.MARTES,
+            hour_begin=time(8, 0),
+            hour_end=time(9, 0)
+        )
+        cls.activity = Activity.objects.create(
+            name="Zumba",
+            location="Sala 4",
+            description="Zumba coreografiada para jóvenes",
+            activity_type="Terrestre",
+        )
+        cls.activity.schedules.add(cls.schedule)
+
+        cls.user = User.objects.create_user(
+            username="username", password="password")
+        cls.other_user = User.objects.create_user(
+            username="other", password="password")
+
+        # The user has a valid bonus to see the sessions
+        bonus = Bonus.objects.create(
+            activity=cls.activity, bonus_type="semester", price=30)
+        ProductBonus.objects.create(
+            user=cls.user, bonus=bonus, date_begin=timezone.now().date(),
+            date_end=timezone.now().date() + timedelta(days=30))
+
+    def create_session(self, days, free_places, waiting_users=(), reserved_by=None):
+        session = Session.objects.create(
+            activity=self.activity, schedule=self.schedule, capacity=5, free_places=free_places,
+            date=timezone.now().date() + timedelta(days=days), start_time=time(8, 0), end_time=time(9, 0))
+        for i, user in enumerate(waiting_users):
+            WaitingList.objects.create(
+                user=user, session=session, join_date=timezone.now() + timedelta(seconds=i))
+        if reserved_by:
+            Reservation.objects.create(user=reserved_by, session=session)
+        return session
+
+    def test_sessions_waiting_list_annotations(self):
+        """Verifies the waiting list data of every session for the user"""
+        free = self.create_session(1, 5)
+        full = self.create_session(2, 0, [self.other_user, self.user])
+        freed_for_user = self.create_session(3, 1, [self.user, self.other_user])
+        freed_for_other = self.create_session(4, 1, [self.other_user])
+        freed_for_both = self.create_session(6, 2, [self.other_user, self.user])
+        WaitingList.objects.filter(session=freed_for_both).update(notified_at=timezone.now())
+        reserved = self.create_session(5, 4, reserved_by=self.user)
+
+        with self.assertNumQueries(1):
+            sessions = {s.id: s for s in get_activity_sessions(self.activity.id, self.user)}
+
+        self.assertTrue(sessions[free.id].is_first_user)
+        self.assertEqual(sessions[free.id].waiting_list_length, 0)
+        self.assertIsNone(sessions[free.id].first_waiting_user_id)
+
+        self.assertFalse(sessions[full.id].is_first_user)
+        self.assertTrue(sessions[full.id].is_queued)
+        self.assertEqual(sessions[full.id].waiting_list_length, 2)
+        self.assertEqual(sessions[full.id].first_waiting_user_id, self.other_user.id)
+
+        self.assertTrue(sessions[freed_for_user.id].is_first_user)
+        self.assertFalse(sessions[freed_for_other.id].is_first_user)
+        self.assertFalse(sessions[freed_for_other.id].is_queued)
+        # Every user notified of a freed place can reserve it, not only the first one
+        self.assertTrue(sessions[freed_for_both.id].is_first_user)
+
+        self.assertTrue(sessions[reserved.id].is_reserved)
+        self.assertFalse(sessions[free.id].is_reserved)
+
+    def test_activity_detail_constant_queries(self):
+        """Verifies that the number of queries does not depend on the number of sessions"""
+        self.client.force_login(self.user)
+        self.create_session(1, 0, [self.other_user, self.user])
+        # The unread notifications counter is cached after the first page
+        Notification.get_unread_count(self.user.id)
+
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(
+                reverse('activity_detail', args=[self.activity.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "En lista de espera")
+
+        for days in range(2, 40):
+            self.create_session(days, days % 2, [self.other_user])
+
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(
+                reverse('activity_detail', args=[self.activity.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['sessions']), 39)
+
+        self.assertEqual(len(many), len(few))
@@ -0,0 +1,313 @@
+import io
+import shutil
+import tempfile
+from datetime import date, time, timedelta
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from sbai.exports import (WEEK_SESSIONS_HEADER, export_parameters, get_week_sessions_rows, ics_line,
+                          long_tables, week_bounds, write_week_sessions_csv, write_week_sessions_ics,
+                          write_week_sessions_pdf)
+from sbai.models import Activity, DayOfWeek, ExportJob, ExportStatus, Schedule, SportFacility
+from sbai.tasks import delete_old_exports, render_export
+from sgu.models import User
+from slegpn.models import Notification
+from src.models import Session
+
+
+class WeekSessionsExportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.monday = date(2025, 3, 3)
+        schedule = Schedule.objects.create(
+            day_of_week=DayOfWeek.LUNES,
+            hour_begin="08:00:00",
+            hour_end="10:00:00"
+        )
+        activity = Activity.objects.create(
+            name="Zumba",
+            location="Sala 4",
+            description="Zumba coreografiada para jóvenes",
+            activity_type="terrestre",
+        )
+        facility = SportFacility.objects.create(
+            name="Pista de Tenis",
+            number_of_facilities=1,
+            description="Pista de tenis",
+            hour_price=10.0,
+            facility_type="exterior"
+        )
+
+        # Sessions of the week, and of the weeks before and after it
+        for day in [-1, 0, 2, 6, 7]:
+            Session.objects.create(
+                activity=activity, schedule=schedule, capacity=20, free_places=5,
+                date=cls.monday + timedelta(days=day), start_time=time(9, 0), end_time=time(10, 0))
+        cls.facility_session = Session.objects.create(
+            facility=facility, schedule=schedule, capacity=1, free_places=1,
+            date=cls.monday, start_time=time(8, 0), end_time=time(9, 0))
+
+    def test_week_bounds(self):
+        """Any day of the week gives its monday and sunday"""
+        self.assertEqual(week_bounds(self.monday + timedelta(days=3)),
+                         (self.monday, self.monday + timedelta(days=6)))
+
+    def test_week_sessions_rows(self):
+        """Only the sessions of the week are exported, in order"""
+        self.assertEqual(list(get_week_sessions_rows(self.monday)), [
+            ["03/03/2025", "08:00 - 09:00", "Pista de Tenis", "1 / 1"],
+            ["03/03/2025", "09:00 - 10:00", "Zumba", "5 / 20"],
+            ["05/03/2025", "09:00 - 10:00", "Zumba", "5 / 20"],
+            ["09/03/2025", "09:00 - 10:00", "Zumba", "5 / 20"],
+        ])
+
+    @override_settings(EXPORT_ROWS_PER_TABLE=3)
+    def test_long_tables(self):
+        """The rows are split in tables with the header repeated on every page"""
+        tables = list(long_tables(WEEK_SESSIONS_HEADER, get_week_sessions_rows(self.monday), None))
+        self.assertEqual([len(table._cellvalues) for table in tables], [4, 2])
+        for table in tables:
+            self.assertEqual(table._cellvalues[0], WEEK_SESSIONS_HEADER)
+            self.assertEqual(table.repeatRows, 1)
+
+    @override_settings(EXPORT_ROWS_PER_TABLE=3)
+    def test_week_sessions_pdf(self):
+        """The PDF of the week is built table by table"""
+        output = io.BytesIO()
+        write_week_sessions_pdf(output, self.monday + timedelta(days=2))
+        self.assertTrue(output.getvalue().startswith(b'%PDF'))
+
+    def test_week_sessions_csv(self):
+        """The CSV has the header and a row for every session of the week"""
+        output = io.BytesIO()
+        write_week_sessions_csv(output, self.monday)
+        lines = output.getvalue().decode('utf-8').splitlines()
+        self.assertEqual(lines[0], ",".join(WEEK_SESSIONS_HEADER))
+        self.assertEqual(lines[1], "03/03/2025,08:00 - 09:00,Pista de Tenis,1 / 1")
+        self.assertEqual(len(lines), 5)
+
+    def test_week_sessions_ics(self):
+        """The calendar has an event in UTC for every session of the week"""
+        output = io.BytesIO()
+        write_week_sessions_ics(output, self.monday)
+        content = output.getvalue().decode('utf-8')
+
+        self.assertTrue(content.startswith("BEGIN:VCALENDAR\r\n"))
+        self.assertTrue(content.endswith("END:VCALENDAR\r\n"))
+        self.assertEqual(content.count("BEGIN:VEVENT"), 4)
+        # 08:00 in Madrid is 07:00 UTC in winter
+        self.assertIn(f"UID:session-{self.facility_session.id}@time2sport\r\n"
+                      "DTSTART:20250303T070000Z\r\nDTEND:20250303T080000Z\r\n"
+                      "SUMMARY:Pista de Tenis\r\nLOCATION:Pista de Tenis\r\n", content)
+        self.assertIn("SUMMARY:Zumba\r\nLOCATION:Sala 4\r\n", content)
+
+    def test_ics_line_folding(self):
+        """The long lines are folded at 75 bytes without cutting characters"""
+        line = "SUMMARY:" + "á" * 80
+        folded = ics_line(line)
+
+        parts = folded[:-2].split("\r\n")
+        self.assertTrue(all(len(part.encode('utf-8')) <= 75 for part in parts))
+        self.assertTrue(all(part.startswith(" ") for part in parts[1:]))
+        self.assertEqual("".join(part[1:] if i else part for i, part in enumerate(parts)), line)
+        self.assertEqual(ics_line("VERSION:2.0"), "VERSION:2.0\r\n")
+
+    def test_export_parameters(self):
+        """The week is stored as its monday and the unknown exports are rejected"""
+        self.assertEqual(export_parameters('week_sessions', 'ics', {'week': '2025-03-05'}),
+                         {'week': '2025-03-03'})
+        monday, _ = week_bounds(timezone.localdate())
+        self.assertEqual(export_parameters('week_sessions', 'pdf', {'week': '2025-02-31'}),
+                         {'week': monday.isoformat()})
+        self.assertEqual(export_parameters('activities_schedule', 'csv', {}), {})
+
+        with self.assertRaises(ValueError):
+            export_parameters('activities_schedule', 'ics', {})
+        with self.assertRaises(ValueError):
+            export_parameters('users', 'csv', {})
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), NOTIFICATIONS_SYNC_DELIVERY=True)
+class ExportJobTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        schedule = Schedule.objects.create(
+            day_of_week=DayOfWeek.MARTES,
+            hour_begin="08:00:00",
+            hour_end="10:00:00"
+        )
+        activity = Activity.objects.create(
+            name="Zumba",
+            location="Sala 4",
+            description="Zumba coreografiada para jóvenes",
+            activity_type="terrestre",
+        )
+        activity.schedules.add(schedule)
+        Session.objects.create(
+            activity=activity, schedule=schedule, capacity=20, free_places=5,
+            date=date(2025, 3, 4), start_time=time(8, 0), end_time=time(10, 0))
+
+        cls.user = User.objects.create_user(username="user", password="password")
+        cls.other_user = User.objects.create_user(username="other", password="password")
+
+    def setUp(self):
+        caches['schedules'].clear()
+        caches['notifications'].clear()
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def request_export(self, client=None, **data):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = (client or self.client).post(reverse('request_export'), data)
+        self.assertRedirects(response, reverse('exports'))
+        return callbacks
+
+    def test_request_export(self):
+        """The request queues a job and the user is sent to the exports page"""
+        callbacks = self.request_export(kind='week_sessions', format='csv', week='2025-03-06')
+
+        job = ExportJob.objects.get()
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(job.status, ExportStatus.PENDING)
+        self.assertEqual(job.parameters, {'week': '2025-03-03'})
+        self.assertEqual(list(job.users.all()), [self.user])
+
+        response = self.client.get(reverse('exports'))
+        self.assertContains(response, "Sesiones de la semana del 03/03/2025")
+        self.assertContains(response, reverse('export_status', args=[job.id]))
+
+    def test_invalid_export(self):
+        """An unknown export is rejected without creating a job"""
+        response = self.client.post(reverse('request_export'), {'kind': 'activities_schedule', 'format': 'ics'})
+        self.assertRedirects(response, reverse('schedules'))
+        self.assertFalse(ExportJob.objects.exists())
+
+    def test_identical_requests_share_job(self):
+        """The users requesting the same file while it is rendered share the job and its render"""
+        self.request_export(kind='week_sessions', format='pdf', week='2025-03-03')
+        other_client = self.client_class()
+        other_client.force_login(self.other_user)
+        callbacks = self.request_export(other_client, kind='week_sessions', format='pdf', week='2025-03-05')
+
+        job = ExportJob.objects.get()
+        self.assertEqual(callbacks, [])
+        self.assertCountEqual(job.users.all(), [self.user, self.other_user])
+
+        # A job queued twice is rendered once
+        self.assertEqual(render_export(job.id), ExportStatus.DONE)
+        self.assertIsNone(render_export(job.id))
+        self.assertEqual(Notification.objects.filter(title="Exportación lista").count(), 2)
+
+    def test_single_active_job(self):
+        """The database rejects a second job rendering the same file"""
+        job, created = ExportJob.request(self.user, 'week_sessions', 'pdf', {'week': '2025-03-03'})
+        self.assertTrue(created)
+        with self.assertRaises(IntegrityError):
+            ExportJob.objects.create(key=job.key, kind=job.kind, export_format='pdf', parameters=job.parameters)
+
+    def test_render_and_download(self):
+        """The worker saves the file in the media storage and the users download it"""
+        job, _ = ExportJob.request(self.user, 'activities_schedule', 'csv', {})
+        render_export(job.id)
+        job.refresh_from_db()
+
+        self.assertEqual(job.status, ExportStatus.DONE)
+        self.assertIsNotNone(job.finished_at)
+        response = self.client.get(reverse('export_status', args=[job.id]))
+        self.assertEqual(response.json(), {
+            'id': job.id, 'status': 'done', 'url': reverse('download_export', args=[job.id])})
+
+        response = self.client.get(reverse('download_export', args=[job.id]))
+        self.assertIn('attachment; filename="activities_schedule.csv"', response['Content-Disposition'])
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(content.splitlines(), ["Actividad,Día,Horario", "Zumba,Martes,08:00 - 10:00"])
+
+    def test_other_users_exports(self):
+        """The users only see and download their exports"""
+        job, _ = ExportJob.request(self.other_user, 'activities_schedule', 'pdf', {})
+        render_export(job.id)
+
+        self.assertEqual(self.client.get(reverse('export_status', args=[job.id])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('download_export', args=[job.id])).status_code, 404)
+        self.assertNotContains(self.client.get(reverse('exports')), "Horarios de Actividades")
+
+    def test_finished_job_reused(self):
+        """A recent file is given to the new requests, until it is old or the schedules change"""
+        job, _ = ExportJob.request(self.user, 'activities_schedule', 'pdf', {})
+        render_export(job.id)
+
+        self.assertEqual(ExportJob.request(self.other_user, 'activities_schedule', 'pdf', {}), (job, False))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Schedule.objects.create(day_of_week=DayOfWeek.JUEVES, hour_begin="08:00:00", hour_end="09:00:00")
+        new_job, created = ExportJob.request(self.user, 'activities_schedule', 'pdf', {})
+        self.assertTrue(created)
+
+        render_export(new_job.id)
+        ExportJob.objects.filter(id=new_job.id).update(
+            finished_at=timezone.now() - timedelta(seconds=settings.EXPORTS_REUSE_SECONDS + 1))
+        self.assertTrue(ExportJob.request(self.user, 'activities_schedule', 'pdf', {})[1])
+
+    def test_failed_render(self):
+        """A failed render is marked and its users notified"""
+        job, _ = ExportJob.request(self.user, 'week_sessions', 'pdf', {'week': '2025-03-03'})
+
+        with patch('sbai.tasks.write_export', side_effect=OSError("Disk full")):
+            with self.assertRaises(OSError):
+                render_export(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportStatus.FAILED)
+        self.assertTrue(Notification.objects.filter(user=self.user, title="Error en la exportación").exists())
+
+    def test_delete_old_exports(self):
+        """The old jobs are deleted with their files"""
+        old_job, _ = ExportJob.request(self.user, 'activities_schedule', 'pdf', {})
+        render_export(old_job.id)
+        old_job.refresh_from_db()
+        ExportJob.objects.filter(id=old_job.id).update(
+            created_at=timezone.now() - timedelta(hours=settings.EXPORTS_KEEP_HOURS + 1))
+        new_job, _ = ExportJob.request(self.user, 'week_sessions', 'csv', {'week': '2025-03-03'})
+
+        self.assertEqual(delete_old_exports(), 1)
+        self.assertEqual(list(ExportJob.objects.all()), [new_job])
+        self.assertFalse(old_job.file.storage.exists(old_job.file.name))
+
+    def test_stale_jobs_fail(self):
+        """A job left waiting or rendering by a lost task doesn't block the new requests of its file"""
+        stale = timezone.now() - timedelta(minutes=settings.EXPORTS_STALE_MINUTES + 1)
+        pending_job, _ = ExportJob.request(self.user, 'activities_schedule', 'pdf', {})
+        ExportJob.objects.filter(id=pending_job.id).update(created_at=stale)
+
+        job, created = ExportJob.request(self.other_user, 'activities_schedule', 'pdf', {})
+        self.assertTrue(created)
+        pending_job.refresh_from_db()
+        self.assertEqual(pending_job.status, ExportStatus.FAILED)
+        self.assertIsNone(render_export(pending_job.id))
+
+        # A job being rendered is only stale once it has been running for too long
+        ExportJob.objects.filter(id=job.id).update(status=ExportStatus.RUNNING, created_at=stale, started_at=timezone.now())
+        self.assertEqual(ExportJob.request(self.user, 'activities_schedule', 'pdf', {}), (job, False))
+        ExportJob.objects.filter(id=job.id).update(started_at=stale)
+        self.assertTrue(ExportJob.request(self.user, 'activities_schedule', 'pdf', {})[1])
+
+    def test_sweep_fails_stale_jobs(self):
+        """The periodic cleanup marks the stale jobs as failed and keeps the recent ones"""
+        stale = timezone.now() - timedelta(minutes=settings.EXPORTS_STALE_MINUTES + 1)
+        stale_job, _ = ExportJob.request(self.user, 'activities_schedule', 'pdf', {})
+        ExportJob.objects.filter(id=stale_job.id).update(status=ExportStatus.RUNNING, started_at=stale)
+        recent_job, _ = ExportJob.request(self.user, 'week_sessions', 'csv', {'week': '2025-03-03'})
+
+        self.assertEqual(delete_old_exports(), 0)
+        stale_job.refresh_from_db()
+        recent_job.refresh_from_db()
+        self.assertEqual(stale_job.status, ExportStatus.FAILED)
+        self.assertIsNotNone(stale_job.finished_at)
+        self.assertEqual(recent_job.status, ExportStatus.PENDING)
@@ -1,7 +1,14 @@
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.urls import reverse
+from django.utils import timezone
+from datetime import time, timedelta
 from sbai.models import SportFacility, Schedule, DayOfWeek
+from sbai.utils import get_availability_grid
 from sgu.models import User
+from slegpn.models import Notification
+from src.models import Session
 
 
 class AllFacilitiesViewTestCase(TestCase):
@@ -315,3 +322,99 @@ class FacilityDetailViewTestCase(TestCase):
                 self.assertContains(response, photo.image.url)
         else:
             self.assertNotContains(response, '<img src="', html=True)
+
+
+class FacilityAvailabilityTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Create a schedule open every day
+        cls.schedules = [
+            Schedule.objects.create(
+                day_of_week=day, hour_begin=time(9, 0), hour_end=time(12, 0))
+            for day in DayOfWeek.values
+        ]
+
+        # Create a facility with one instance and a facility with four instances
+        cls.single_facility = SportFacility.objects.create(
+            name="Campo de Fútbol",
+            number_of_facilities=1,
+            description="Campo de fútbol sala para fútbol 5",
+            hour_price=25.0,
+            facility_type="Exterior",
+            schedules=cls.schedules
+        )
+        cls.multiple_facility = SportFacility.objects.create(
+            name="Pista de Pádel",
+            number_of_facilities=4,
+            description="Pistas de pádel",
+            hour_price=10.0,
+            facility_type="Exterior",
+            schedules=cls.schedules
+        )
+
+        # Create the sessions of today and the next week
+        today = timezone.now().date()
+        for facility in (cls.single_facility, cls.multiple_facility):
+            Session.objects.bulk_create(Session.build_sessions(
+                cls.schedules, facility=facility, first_date=today, weeks=1))
+
+        cls.user = User.objects.create_user(
+            username="username",
+            password="password",
+            is_uam=True,
+            user_type="student"
+        )
+
+    def test_availability_grid_uses_one_query(self):
+        """Verifies that the sessions of every day and instance are fetched in one query"""
+        facilities = list(SportFacility.objects.filter(name__startswith="Pista de Pádel"))
+        today = timezone.now().date()
+
+        with self.assertNumQueries(1):
+            grid = get_availability_grid(facilities, today, days=7)
+
+        self.assertEqual(len(grid), 7)
+        for i, day in enumerate(grid):
+            self.assertEqual(day['date'], today + timedelta(days=i))
+            self.assertEqual([cell['facility'] for cell in day['sessions']], facilities)
+            for cell in day['sessions']:
+                # 3 hour blocks per day, ordered by start time
+                self.assertEqual([session.start_time for session in cell['sessions']],
+                                 [time(9, 0), time(10, 0), time(11, 0)])
+
+    def test_facility_detail_constant_queries(self):
+        """Verifies that the number of queries does not depend on the number of instances"""
+        self.client.force_login(self.user)
+        # The unread notifications counter is cached after the first page
+        Notification.get_unread_count(self.user.id)
+
+        with CaptureQueriesContext(connection) as single:
+            response = self.client.get(
+                reverse('facility_detail', args=[self.single_facility.id]))
+        self.assertEqual(response.status_code, 200)
+
+        with CaptureQueriesContext(connection) as multiple:
+            response = self.client.get(
+                reverse('facility_detail', args=[self.multiple_facility.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Pista de Pádel 4")
+
+        # The single facility doesn't need the query to get the instances
+        self.assertEqual(len(multiple), len(single) + 1)
+
+    def test_facility_availability_json(self):
+        """Verifies that the availability endpoint returns the grid as JSON"""
+        self.client.force_login(self.user)
+
+        response = self.client.get(
+            reverse('facility_availability', args=[self.multiple_facility.id]))
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['name'], "Pista de Pádel")
+        self.assertEqual(len(data['days']), 7)
+        day = data['days'][0]
+        self.assertEqual(day['date'], timezone.now().date().isoformat())
+        self.assertEqual(len(day['facilities']), 4)
+        self.assertEqual(day['facilities'][0]['sessions'][0]['start_time'], '09:00')
+        self.assertEqual(day['facilities'][0]['sessions'][0]['free_places'], 1)
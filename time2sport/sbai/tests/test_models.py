@@ -1,7 +1,7 @@
 import os
 from django.test import TestCase
 from django.core.files.uploadedfile import SimpleUploadedFile
-from sbai.models import Schedule, SportFacility, Activity, Photo, Bonus, DayOfWeek
+from sbai.models import Schedule, SportFacility, FacilityGroup, Activity, Photo, Bonus, DayOfWeek
 
 
 class ScheduleModelTest(TestCase):
@@ -85,6 +85,82 @@ class SportFacilityModelTest(TestCase):
         self.assertEqual(str(self.sport_facility), "Campo de Fútbol")
 
 
+    def test_sport_facility_instances_group(self):
+        """Verify that the instances of a facility are created under the same group"""
+        group = self.sport_facility.group
+        self.assertEqual(group.name, "Campo de Fútbol")
+        self.assertEqual([f.name for f in self.sport_facility.get_instances()],
+                         ["Campo de Fútbol", "Campo de Fútbol 2"])
+        self.assertEqual(SportFacility.objects.get(
+            name="Campo de Fútbol 2").group_name, "Campo de Fútbol")
+
+    def test_sport_facility_instances_with_schedules(self):
+        """Verify that every instance gets the schedules"""
+        facility = SportFacility.objects.create(
+            name="Pista 5",
+            number_of_facilities=3,
+            description="Pista con nombre acabado en número",
+            hour_price=10.0,
+            facility_type="Interior",
+            schedules=[self.sport_facility_schedule]
+        )
+
+        instances = list(facility.get_instances())
+        self.assertEqual([f.name for f in instances],
+                         ["Pista 5", "Pista 5 2", "Pista 5 3"])
+        for instance in instances:
+            self.assertEqual(instance.group_name, "Pista 5")
+            self.assertIn(self.sport_facility_schedule,
+                          instance.schedules.all())
+
+    def test_single_sport_facility_has_no_group(self):
+        """Verify that a facility with only one instance is not grouped"""
+        facility = SportFacility.objects.create(
+            name="Piscina",
+            number_of_facilities=1,
+            description="Piscina cubierta",
+            hour_price=5.0,
+            facility_type="Interior"
+        )
+        self.assertIsNone(facility.group)
+        self.assertEqual(facility.get_instances(), [facility])
+        self.assertEqual(facility.group_name, "Piscina")
+
+    def test_assign_groups_from_names(self):
+        """Verify that ungrouped facilities are grouped by their names"""
+        SportFacility.objects.update(group=None)
+        FacilityGroup.objects.all().delete()
+
+        self.assertEqual(SportFacility.objects.assign_groups(), 2)
+        group = FacilityGroup.objects.get(name="Campo de Fútbol")
+        self.assertEqual(group.facilities.count(), 2)
+        self.assertEqual(SportFacility.objects.assign_groups(), 0)
+
+    def test_assign_groups_names_ending_in_number(self):
+        """Verify that a name ending in a number is only split for the numbers of the instances"""
+        for name in ("Pista 1", "Frontón 3"):
+            SportFacility.objects.create(
+                name=name, number_of_facilities=2, description="Pista", hour_price=10.0, facility_type="Interior")
+        SportFacility.objects.update(group=None)
+        FacilityGroup.objects.all().delete()
+
+        SportFacility.objects.assign_groups()
+        group = FacilityGroup.objects.get(name="Pista 1")
+        self.assertEqual(sorted(group.facilities.values_list('name', flat=True)), ["Pista 1", "Pista 1 2"])
+        group = FacilityGroup.objects.get(name="Frontón 3")
+        self.assertEqual(sorted(group.facilities.values_list('name', flat=True)), ["Frontón 3", "Frontón 3 2"])
+        self.assertFalse(FacilityGroup.objects.filter(name__in=["Pista", "Frontón"]).exists())
+
+    def test_delete_group_keeps_facilities(self):
+        """Verify that deleting a group only ungroups its facilities"""
+        group = FacilityGroup.objects.get(name="Campo de Fútbol")
+        facility_ids = list(group.facilities.values_list('id', flat=True))
+        group.delete()
+
+        self.assertEqual(SportFacility.objects.filter(id__in=facility_ids, group__isnull=True).count(),
+                         len(facility_ids))
+
+
 class ActivityModelTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -1,6 +1,8 @@
+from django.core.cache import caches
 from django.test import TestCase
 from django.urls import reverse
 from sbai.models import Activity, SportFacility, Schedule, DayOfWeek
+from sbai.schedules import get_schedules_snapshot
 from sgu.models import User
 
 
@@ -107,6 +109,9 @@ class FacilitiesScheduleViewTestCase(TestCase):
             user_type="student"
         )
 
+    def setUp(self):
+        caches['schedules'].clear()
+
     def test_redirect_for_unauthenticated_users(self):
         """Verifies that the user is logged in if it is not, redirects to login"""
         response = self.client.get(reverse('facilities_schedule'))
@@ -126,7 +131,8 @@ class FacilitiesScheduleViewTestCase(TestCase):
         self.assertTemplateUsed(response, 'schedules/facilities_schedule.html')
 
         # Check the facility is sent to the template
-        self.assertIn(self.sport_facility, response.context['facilities'])
+        self.assertIn(self.sport_facility.name,
+                      [facility['name'] for facility in response.context['facilities']])
 
         # -- Template verification --
         # Descargar button exists and redirects to download_facilities_schedule
@@ -175,6 +181,9 @@ class ActivitiesScheduleViewTestCase(TestCase):
             user_type="student"
         )
 
+    def setUp(self):
+        caches['schedules'].clear()
+
     def test_redirect_for_unauthenticated_users(self):
         """Verifies that the user is logged in if it is not, redirects to login"""
         response = self.client.get(reverse('schedules'))
@@ -275,6 +284,9 @@ class DownloadsViewTestCase(TestCase):
             user_type="student"
         )
 
+    def setUp(self):
+        caches['schedules'].clear()
+
     def test_download_facilities_schedule_view(self):
         """Ensures that the facilities schedules pdf is generated"""
         self.client.force_login(self.user)
@@ -299,3 +311,87 @@ class DownloadsViewTestCase(TestCase):
         self.assertEqual(response['Content-Type'], 'application/pdf')
         self.assertIn('attachment; filename="activities_schedule.pdf"',
                       response['Content-Disposition'])
+
+
+class SchedulesSnapshotTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.schedule = Schedule.objects.create(
+            day_of_week=DayOfWeek.MARTES,
+            hour_begin="08:00:00",
+            hour_end="10:00:00"
+        )
+        cls.activity = Activity.objects.create(
+            name="Zumba",
+            location="Sala 4",
+            description="Zumba coreografiada para jóvenes",
+            activity_type="terrestre",
+        )
+        cls.activity.schedules.add(cls.schedule)
+        cls.user = User.objects.create_user(
+            username="username",
+            password="password",
+            is_uam=True,
+            user_type="student"
+        )
+
+    def setUp(self):
+        caches['schedules'].clear()
+        self.client.force_login(self.user)
+
+    def test_snapshot_built_once(self):
+        """The grouped schedules and the PDF are read from the cache until the schedules change"""
+        snapshot = get_schedules_snapshot('activities')
+        self.assertTrue(snapshot['pdf'].startswith(b'%PDF'))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_schedules_snapshot('activities'), snapshot)
+
+    def test_not_modified_pdf(self):
+        """The PDF is answered with 304 while its version doesn't change"""
+        response = self.client.get(reverse('download_activities_schedule'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        self.assertIn('private', response['Cache-Control'])
+
+        response = self.client.get(reverse('download_activities_schedule'),
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_changes_renew_snapshot(self):
+        """Changing a schedule, an activity or the schedules of an activity renews the pages and PDFs"""
+        response = self.client.get(reverse('download_activities_schedule'))
+        etag = response['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.schedule.hour_end = "11:00:00"
+            self.schedule.save()
+
+        response = self.client.get(reverse('download_activities_schedule'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(self.client.get(reverse('activities_schedule')), "08:00 - 11:00")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.activity.name = "Pilates"
+            self.activity.save()
+        self.assertContains(self.client.get(reverse('activities_schedule')), "Pilates")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.activity.schedules.remove(self.schedule)
+        self.assertEqual(get_schedules_snapshot('activities')['schedules'],
+                         [{"name": "Pilates", "schedules": []}])
+
+    def test_created_facilities_renew_snapshot(self):
+        """The facilities created in bulk by the manager are shown in the schedules"""
+        get_schedules_snapshot('facilities')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            SportFacility.objects.create(
+                name="Pista de Pádel", number_of_facilities=2, description="Pista de pádel",
+                hour_price=10.0, facility_type="exterior", schedules=[self.schedule])
+
+        self.assertEqual([facility['name'] for facility in get_schedules_snapshot('facilities')['schedules']],
+                         ["Pista de Pádel", "Pista de Pádel 2"])
+
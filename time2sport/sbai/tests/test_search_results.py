@@ -1,6 +1,7 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from sbai.models import Activity, SportFacility, Schedule, Bonus, DayOfWeek
+from sbai.search import trigram_search_enabled
 from sgu.models import User
 
 
@@ -207,3 +208,88 @@ class SearchResultsViewTestCase(TestCase):
 
         self.assertIn(self.activity, response.context['activities'])
         self.assertIsNone(response.context['facilities'])
+
+
+class FullTextSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.swimming = Activity.objects.create(
+            name="Natación", location="Piscina cubierta",
+            description="Clases de natación para todos los niveles", activity_type="Acuática")
+        cls.zumba = Activity.objects.create(
+            name="Zumba", location="Sala 4",
+            description="Zumba coreografiada, ideal después de la natación", activity_type="Terrestre")
+        cls.penguins = Activity.objects.create(
+            name="Pingüinos", location="Piscina de natación exterior",
+            description="Para los más pequeños", activity_type="Acuática")
+        cls.court = SportFacility.objects.create(
+            name="Pista de Pádel", number_of_facilities=1,
+            description="Pista de pádel con cristal", hour_price=10.0, facility_type="Exterior")
+
+        cls.user = User.objects.create_user(username="username", password="password")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def search(self, **params):
+        response = self.client.get(reverse('search_results'), params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_accent_insensitive(self):
+        """Words are found with or without accents"""
+        response = self.search(q="natacion")
+        self.assertIn(self.swimming, response.context['activities'])
+
+        response = self.search(q="PADEL")
+        self.assertEqual(list(response.context['facilities']), [self.court])
+
+    def test_search_descriptions_and_locations(self):
+        """The descriptions and the locations are searched"""
+        response = self.search(q="coreografiada")
+        self.assertEqual(list(response.context['activities']), [self.zumba])
+
+        response = self.search(q="piscina")
+        self.assertEqual(set(response.context['activities']), {self.swimming, self.penguins})
+
+    def test_ranking(self):
+        """The activities with the words in their name come first, then in their location and description"""
+        response = self.search(q="natación")
+        self.assertEqual(list(response.context['activities']), [self.swimming, self.penguins, self.zumba])
+
+    def test_prefix_and_all_words(self):
+        """Every word must match, the last ones can be unfinished"""
+        response = self.search(q="clases nat")
+        self.assertEqual(list(response.context['activities']), [self.swimming])
+
+        response = self.search(q="natación cristal")
+        self.assertFalse(response.context['activities'])
+        self.assertContains(response, "Búsqueda sin éxito")
+
+    def test_typos(self):
+        """The names are found with typos"""
+        if not trigram_search_enabled():
+            self.skipTest("The pg_trgm extension is not installed")
+        response = self.search(q="natacoin")
+        self.assertEqual(response.context['activities'][0], self.swimming)
+
+    def test_substring_without_trigrams(self):
+        """Without trigrams the names containing the text are found"""
+        if trigram_search_enabled():
+            self.skipTest("The pg_trgm extension is installed")
+        response = self.search(q="umb")
+        self.assertEqual(list(response.context['activities']), [self.zumba])
+
+    @override_settings(SEARCH_RESULTS_PER_PAGE=2)
+    def test_pagination(self):
+        """Every list is paginated on its own and the links keep the search"""
+        response = self.search(q="natación")
+        activities = response.context['activities']
+        self.assertEqual(list(activities), [self.swimming, self.penguins])
+        self.assertEqual(activities.paginator.num_pages, 2)
+        self.assertEqual(response.context['pages']['activities']['next'], "?q=nataci%C3%B3n&activities_page=2")
+        self.assertIsNone(response.context['pages']['activities']['previous'])
+
+        response = self.search(q="natación", activities_page=2)
+        self.assertEqual(list(response.context['activities']), [self.zumba])
+        self.assertContains(response, "Página 2 de 2")
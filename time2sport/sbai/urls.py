@@ -1,7 +1,9 @@
 from django.urls import path
-from .views import all_activities, activity_detail, all_facilities, facility_detail
+from .views import all_activities, activity_detail, download_activity_calendar, all_facilities, facility_detail
+from .views import facility_availability
 from .views import schedules, facilities_schedule, download_facilities_schedule
 from .views import activities_schedule, download_activities_schedule
+from .views import request_export, exports, export_status, download_export
 from .views import search_results
 from django.contrib import admin
 from django.conf import settings
@@ -10,9 +12,13 @@ urlpatterns = [
     path('activities/', all_activities, name='all_activities'),
     path('activities/<int:activity_id>/',
          activity_detail, name='activity_detail'),
+    path('activities/<int:activity_id>/calendar.ics',
+         download_activity_calendar, name='download_activity_calendar'),
     path('facilities/', all_facilities, name='all_facilities'),
     path('facilities/<int:facility_id>/',
          facility_detail, name='facility_detail'),
+    path('facilities/<int:facility_id>/availability/',
+         facility_availability, name='facility_availability'),
 
     path('schedules/', schedules, name='schedules'),
     path('schedules/facilities/', facilities_schedule, name='facilities_schedule'),
@@ -23,5 +29,10 @@ urlpatterns = [
     path('schedules/activities/download/', download_activities_schedule,
          name='download_activities_schedule'),
 
+    path('exports/', exports, name='exports'),
+    path('exports/request/', request_export, name='request_export'),
+    path('exports/<int:job_id>/', export_status, name='export_status'),
+    path('exports/<int:job_id>/download/', download_export, name='download_export'),
+
     path('search/', search_results, name='search_results'),
 ]
@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+from src.models import Session
+
+
+def get_availability_grid(facilities, first_date, days=7):
+    """Gets the sessions of the facilities for the next days grouped by day and facility, using one query"""
+    facilities = list(facilities)
+    dates = [first_date + timedelta(days=i) for i in range(days)]
+
+    # Bucket for every day and facility instance, so empty cells are also shown
+    buckets = {(day, facility.id): [] for day in dates for facility in facilities}
+
+    sessions = Session.objects.filter(
+        facility__in=facilities, date__range=(dates[0], dates[-1])).order_by('date', 'start_time')
+    for session in sessions:
+        buckets[(session.date, session.facility_id)].append(session)
+
+    return [
+        {
+            'date': day,
+            'sessions': [
+                {'facility': facility, 'sessions': buckets[(day, facility.id)]}
+                for facility in facilities
+            ]
+        }
+        for day in dates
+    ]
+
+
+def availability_grid_to_json(grid):
+    """Converts an availability grid into a JSON serializable structure"""
+    return [
+        {
+            'date': day['date'].isoformat(),
+            'facilities': [
+                {
+                    'id': cell['facility'].id,
+                    'name': cell['facility'].name,
+                    'sessions': [
+                        {
+                            'id': session.id,
+                            'start_time': session.start_time.strftime('%H:%M'),
+                            'end_time': session.end_time.strftime('%H:%M'),
+                            'free_places': session.free_places,
+                        }
+                        for session in cell['sessions']
+                    ]
+                }
+                for cell in day['sessions']
+            ]
+        }
+        for day in grid
+    ]
@@ -1,15 +1,17 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-from .models import Activity, SportFacility, DayOfWeek, Schedule
+from django.http import FileResponse, HttpResponse, JsonResponse
+from .models import Activity, SportFacility, DayOfWeek, Schedule, ExportJob, ExportStatus
+from .schedules import get_schedules_snapshot, get_schedules_version
+from .search import search
+from .exports import export_parameters, write_activity_sessions_ics
+from .tasks import render_export
+from .utils import get_availability_grid, availability_grid_to_json
 
 import random
 import string
 import time
 
+import io
 import os
 import json
 
@@ -18,15 +20,23 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth import login, logout
 from django.contrib import messages
 from django.core.files.storage import default_storage
+from django.core.paginator import Paginator
 from django.contrib.auth.decorators import login_required
-from datetime import datetime, timedelta
+from django.urls import reverse
+from urllib.parse import urlencode
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from datetime import datetime, timedelta, timezone as dt_timezone
 from django.utils.timezone import now
 from django.utils import timezone
 
 from django.core.mail import EmailMessage
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Exists, Count, Case, When, Value, BooleanField
+from django.db.models.functions import Coalesce
 
-from src.models import Session
+from src.models import Session, Reservation
+from slegpn.models import WaitingList
 
 
 @login_required
@@ -36,6 +46,35 @@ def all_activities(request):
     return render(request, 'activities/all_activities.html', {'activities': activities})
 
 
+def get_activity_sessions(activity_id, user):
+    ''' Function to get the sessions of an activity annotated with their waiting list data for the user in one query. '''
+    waiting_list = WaitingList.objects.filter(session=OuterRef('pk'))
+
+    sessions = Session.objects.filter(activity_id=activity_id).select_related('schedule').annotate(
+        first_waiting_user_id=Subquery(
+            waiting_list.order_by('join_date').values('user_id')[:1]),
+        waiting_list_length=Coalesce(Subquery(
+            waiting_list.order_by().values('session').annotate(count=Count('id')).values('count')), 0),
+        is_queued=Exists(waiting_list.filter(user=user)),
+        is_notified=Exists(waiting_list.filter(user=user, notified_at__isnull=False)),
+        is_reserved=Exists(Reservation.objects.filter(
+            session=OuterRef('pk'), user=user)),
+    ).annotate(
+        # Only the users notified of a place freed by a cancellation, or the first one of the
+        # waiting list, can reserve it
+        is_first_user=Case(
+            When(waiting_list_length=0, then=Value(True)),
+            When(is_notified=True, free_places__gt=0, then=Value(True)),
+            When(first_waiting_user_id=user.id,
+                 free_places__gt=0, then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField(),
+        )
+    )
+
+    return sessions.order_by("date", "schedule__hour_begin")
+
+
 @login_required
 def activity_detail(request, activity_id):
     ''' Function to get the details of an activity. '''
@@ -51,26 +90,8 @@ def activity_detail(request, activity_id):
             'bonuses': activity.bonuses.all()
         })
 
-    # Get the sessions for the activity (the user has a valid bonus)
-    sessions = Session.objects.filter(activity_id=activity_id)
-
-    ordered_sessions = sessions.order_by("date", "schedule__hour_begin")
-
-    # Get the first user in the waiting list of each session, if any
-    # To show only the reservation button to the first one if the session is not full due to a cancellation
-    for session in ordered_sessions:
-        waiting_list = session.waiting_list.all()
-        if waiting_list.exists():
-            is_first_user = waiting_list.first()
-            if is_first_user.user == request.user:
-                if not session.is_full():
-                    session.is_first_user = True
-                else:
-                    session.is_first_user = False
-            else:
-                session.is_first_user = False
-        else:
-            session.is_first_user = True
+    # Get the sessions for the activity (the user has a valid bonus) with their waiting list data
+    ordered_sessions = get_activity_sessions(activity_id, request.user)
 
     return render(request, 'activities/activity_detail.html', {
         'activity': activity,
@@ -79,19 +100,31 @@ def activity_detail(request, activity_id):
     })
 
 
+@login_required
+def download_activity_calendar(request, activity_id):
+    ''' Function to download the upcoming sessions of an activity as an iCalendar file. '''
+    activity = get_object_or_404(Activity, pk=activity_id)
+
+    buffer = io.BytesIO()
+    write_activity_sessions_ics(buffer, activity)
+    response = HttpResponse(buffer.getvalue(), content_type='text/calendar; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="activity_{activity.id}.ics"'
+    return response
+
+
 @login_required
 def all_facilities(request):
     ''' Function to get all sport facilities. '''
-    all_facilities = SportFacility.objects.prefetch_related('photos')
+    all_facilities = SportFacility.objects.prefetch_related(
+        'photos').order_by('id')
     facilities = []
-    # If a facility has more than one instance, show only one
+    groups = set()
+    # If a facility has more than one instance, show only the first one of the group
     for f in all_facilities:
-        if f.number_of_facilities > 1:
-            # Get the first instance
-            if not f.name.split(" ")[-1].isdigit():
-                name = f.name
-                facilities.append(f)
-        else:
+        if f.group_id is None:
+            facilities.append(f)
+        elif f.group_id not in groups:
+            groups.add(f.group_id)
             facilities.append(f)
 
     return render(request, 'facilities/all_facilities.html', {'facilities': facilities})
@@ -110,48 +143,25 @@ def divide_hours_into_blocks(schedule):
     return blocks
 
 
+def get_facility_instances(facility):
+    ''' Function to get the common name and all the instances of a sport facility. '''
+    return facility.group_name, facility.get_instances()
+
+
 @login_required
 def facility_detail(request, facility_id):
     ''' Function to get the details of a sport facility. '''
     # Get the facility by id
-    facility = get_object_or_404(SportFacility, pk=facility_id)
-
-    # Check if the facility has multiple instances
-    if facility.number_of_facilities == 1:
-        facilities = [facility]
-        name = facility.name
-    else:
-        if facility.name.split(" ")[-1].isdigit():
-            name = ' '.join(facility.name.split(" ")[:-1])
-        else:
-            name = facility.name
-        facilities = SportFacility.objects.filter(
-            name__regex=f"^{name}( [0-9]+)?$").prefetch_related('photos')
+    facility = get_object_or_404(
+        SportFacility.objects.select_related('group'), pk=facility_id)
+    name, facilities = get_facility_instances(facility)
 
     # Get the next 7 days
     today = timezone.now().date()
     next_7_days = [today + timedelta(days=i) for i in range(7)]
 
-    # Get the schedules for the next 7 days
-    sessions_next_7_days = []
-    for day in next_7_days:
-        day_of_week = day.weekday()  # Get the day of the week (0 is Monday ... 6 is Sunday)
-
-        # Sessions for each facility on the current day
-        all_sessions_of_the_day = []
-
-        for f in facilities:
-            # Get the daily schedules matching the day of the week for this facility
-            session_of_the_day = f.sessions.filter(date=day)
-            all_sessions_of_the_day.append({
-                'facility': f,
-                'sessions': session_of_the_day
-            })
-
-        sessions_next_7_days.append({
-            'date': day,
-            'sessions': all_sessions_of_the_day
-        })
+    # Get the sessions of every facility instance for the next 7 days
+    sessions_next_7_days = get_availability_grid(facilities, today, days=7)
 
     return render(request, 'facilities/facility_detail.html', {
         'facility': facility,
@@ -161,203 +171,187 @@ def facility_detail(request, facility_id):
     })
 
 
+@login_required
+def facility_availability(request, facility_id):
+    ''' Function to get the availability of a sport facility for the next 7 days as JSON. '''
+    facility = get_object_or_404(
+        SportFacility.objects.select_related('group'), pk=facility_id)
+    name, facilities = get_facility_instances(facility)
+
+    grid = get_availability_grid(facilities, timezone.now().date(), days=7)
+
+    return JsonResponse({
+        'facility': facility.id,
+        'name': name,
+        'days': availability_grid_to_json(grid)
+    })
+
+
 @login_required
 def schedules(request):
     ''' Function to get the main schedules page. '''
     return render(request, 'schedules/schedules.html')
 
 
+def schedules_version(request):
+    ''' Gets the version of the schedules once per request. '''
+    if not hasattr(request, '_schedules_version'):
+        request._schedules_version = get_schedules_version()
+    return request._schedules_version
+
+
+def schedules_etag(request):
+    ''' ETag of a schedules PDF, which changes with the version of the schedules. '''
+    return f"{request.resolver_match.url_name}-{schedules_version(request):.6f}"
+
+
+def schedules_last_modified(request):
+    ''' Last change of the schedules, the time stored in their version. '''
+    return datetime.fromtimestamp(schedules_version(request), tz=dt_timezone.utc)
+
+
+def schedules_pdf_response(request, kind, filename):
+    ''' Returns the PDF of the schedules of the current version. '''
+    snapshot = get_schedules_snapshot(kind, schedules_version(request))
+    response = HttpResponse(snapshot['pdf'], content_type='application/pdf')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
 @login_required
 def facilities_schedule(request):
     ''' Function to get the schedules of all sport facilities. '''
-    facilities = SportFacility.objects.prefetch_related('schedules').all()
-    return render(request, 'schedules/facilities_schedule.html', {'facilities': facilities})
+    snapshot = get_schedules_snapshot('facilities')
+    return render(request, 'schedules/facilities_schedule.html', {'facilities': snapshot['schedules']})
 
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=schedules_etag, last_modified_func=schedules_last_modified)
 def download_facilities_schedule(request):
     ''' Function to download the schedules of all sport facilities as a PDF. '''
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename="facilities_schedule.pdf"'
+    return schedules_pdf_response(request, 'facilities', 'facilities_schedule.pdf')
 
-    # Create the document
-    doc = SimpleDocTemplate(response, pagesize=letter)
-    elements = []
-    styles = getSampleStyleSheet()
 
-    # Document title
-    elements.append(Paragraph("Horarios de Instalaciones", styles["Title"]))
-    elements.append(Spacer(1, 12))
+@login_required
+def activities_schedule(request):
+    ''' Function to get the schedules of all activities. '''
+    snapshot = get_schedules_snapshot('activities')
+    return render(request, "schedules/activities_schedule.html", {"activities": snapshot['schedules']})
 
-    # Table headers
-    data = [["Instalación", "Horario"]]
 
-    facilities = SportFacility.objects.prefetch_related('schedules').all()
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=schedules_etag, last_modified_func=schedules_last_modified)
+def download_activities_schedule(request):
+    ''' Function to download the schedules of all activities as a PDF. '''
+    return schedules_pdf_response(request, 'activities', 'activities_schedule.pdf')
 
-    # Get the schedules for each facility
-    for facility in facilities:
-        horarios = "\n".join(
-            [f"{schedule.get_day_of_week_display()}: {schedule.hour_begin} - {schedule.hour_end}" for schedule in facility.schedules.all()]
-        )
-        data.append([facility.name, horarios])
-
-    # Create the table
-    table = Table(data, colWidths=[200, 250])
-    # Table style
-    table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
-    ]))
-
-    # Add the table to the document
-    elements.append(table)
-    doc.build(elements)
-    # Return the PDF
-    return response
+
+@login_required
+def request_export(request):
+    ''' Function to request an export of the schedules or the sessions of a week, rendered by a Celery worker. '''
+    if request.method != 'POST':
+        return redirect('exports')
+
+    kind = request.POST.get('kind', '')
+    export_format = request.POST.get('format', 'pdf')
+    try:
+        parameters = export_parameters(kind, export_format, request.POST)
+    except ValueError:
+        messages.error(request, "Exportación no válida.")
+        return redirect('schedules')
+
+    # The users requesting the same file share the job
+    job, created = ExportJob.request(request.user, kind, export_format, parameters)
+    if created:
+        transaction.on_commit(lambda: render_export.delay(job.id))
+
+    if job.status == ExportStatus.DONE:
+        messages.success(request, "La exportación ya está lista.")
+    else:
+        messages.info(request, "Estamos generando la exportación, te avisaremos cuando esté lista.")
+    return redirect('exports')
 
 
 @login_required
-def activities_schedule(request):
-    ''' Function to get the schedules of all activities. '''
-    activities = Activity.objects.all()
+def exports(request):
+    ''' Function to get the recent exports of the user. '''
+    limit = timezone.now() - timedelta(hours=settings.EXPORTS_KEEP_HOURS)
+    jobs = request.user.exports.filter(created_at__gte=limit).order_by('-created_at')
+    return render(request, 'exports/exports.html', {'jobs': jobs})
 
-    # If there are activities with several schedules, group them
-    grouped_schedules = []
-    for activity in activities:
-        schedule_dict = {}
 
-        for schedule in activity.schedules.all():
-            day = schedule.get_day_of_week_display()
-            time_range = f"{schedule.hour_begin.strftime('%H:%M')} - {schedule.hour_end.strftime('%H:%M')}"
+@login_required
+def export_status(request, job_id):
+    ''' Function to get the status of an export of the user as JSON, polled by the exports page. '''
+    job = get_object_or_404(ExportJob, id=job_id, users=request.user)
+    return JsonResponse({
+        'id': job.id,
+        'status': job.status,
+        'url': reverse('download_export', args=[job.id]) if job.status == ExportStatus.DONE else None,
+    })
 
-            if day not in schedule_dict:
-                schedule_dict[day] = []
 
-            # Update the list of schedules for the day
-            schedule_dict[day].append(time_range)
+@login_required
+def download_export(request, job_id):
+    ''' Function to download the file of a finished export of the user. '''
+    job = get_object_or_404(ExportJob, id=job_id, users=request.user, status=ExportStatus.DONE)
+    return FileResponse(job.file.open('rb'), as_attachment=True, filename=job.filename)
 
-        # Save the schedules formatted for the template
-        formatted_schedules = [
-            {"day": day, "times": "\n".join(times)}
-            for day, times in schedule_dict.items()
-        ]
 
-        # Save the activity with its schedules
-        grouped_schedules.append({
-            "name": activity.name,
-            "schedules": formatted_schedules
-        })
+SEARCH_PAGE_PARAMS = ('facilities_page', 'activities_page')
 
-    return render(request, "schedules/activities_schedule.html", {"activities": grouped_schedules})
 
+def search_page(results, data, page_param):
+    ''' Function to get a page of search results and the links to the previous and next pages.
+    The links keep the search and the page of the other list. '''
+    page = Paginator(results, settings.SEARCH_RESULTS_PER_PAGE).get_page(data.get(page_param))
+    params = {name: data[name] for name in ('q', 'category') + SEARCH_PAGE_PARAMS if data.get(name)}
 
-@login_required
-def download_activities_schedule(request):
-    ''' Function to download the schedules of all activities as a PDF. '''
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename="activities_schedule.pdf"'
-
-    # Create the document
-    doc = SimpleDocTemplate(response, pagesize=letter)
-    elements = []
-    styles = getSampleStyleSheet()
-
-    # Document title
-    elements.append(Paragraph("Horarios de Actividades", styles["Title"]))
-    elements.append(Spacer(1, 12))
-
-    # Table headers
-    data = [["Actividad", "Día", "Horario"]]
-    # Here the activities with multiple schedules are stored to later merge the cells
-    merge_styles = []
-
-    activities = Activity.objects.prefetch_related('schedules').all()
-
-    for activity in activities:
-        schedules_by_day = {}
-
-        # Group schedules by day of the week
-        for schedule in activity.schedules.all():
-            day = schedule.get_day_of_week_display()
-            if day not in schedules_by_day:
-                schedules_by_day[day] = []
-            schedules_by_day[day].append(
-                f"{schedule.hour_begin.strftime('%I:%M')} - {schedule.hour_end.strftime('%I:%M')}")
-
-        activity_rows = []  # Rows for the same activity
-        for day, hours in schedules_by_day.items():
-            grouped_hours = "\n".join(hours)
-            activity_rows.append(["", day, grouped_hours])
-
-        if activity_rows:
-            # Put the name of the activity in the first row
-            activity_rows[0][0] = activity.name
-            data.extend(activity_rows)
-
-            # Group the cells of the activity column if there are more than one row
-            if len(activity_rows) > 1:
-                merge_styles.append(
-                    ('SPAN', (0, len(data) - len(activity_rows)), (0, len(data) - 1)))
-
-    # Put the styles to the table
-    table = Table(data, colWidths=[150, 100, 150])
-    table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-    ] + merge_styles))
-
-    # Add the table to the document
-    elements.append(table)
-    # Return the PDF
-    doc.build(elements)
-    return response
+    def link(number):
+        return '?' + urlencode({**params, page_param: number})
+
+    return page, {
+        'previous': link(page.previous_page_number()) if page.has_previous() else None,
+        'next': link(page.next_page_number()) if page.has_next() else None,
+    }
 
 
 @login_required
 def search_results(request):
-    ''' Function to search for sport facilities and activities. '''
+    ''' Function to search for sport facilities and activities, the results are paginated. '''
     facilities = SportFacility.objects.all()
     activities = Activity.objects.all()
-    category = None
-    query = None
-
-    if request.method == "POST":
-        # Get the search query and category from the form
-        category = request.POST.get('category', '').strip()
-        query = request.POST.get('q', '').strip()
-
-        # If the query is empty, show all facilities and activities
-        # Else filter the facilities and activities based on the query
-        if query:
-            facilities = facilities.filter(
-                Q(name__icontains=query)
-            )
-            activities = activities.filter(
-                Q(name__icontains=query)
-            )
-
-        # If the category is selected, filter the facilities and activities based on the category
-        if category:
-            category = category.capitalize()
-            if category in ['Interior', 'Exterior']:
-                facilities = facilities.filter(facility_type=category)
-                activities = None
-            elif category in ['Terrestre', 'Acuática']:
-                activities = activities.filter(activity_type=category)
-                facilities = None
+    data = request.POST if request.method == "POST" else request.GET
+    category = data.get('category')
+    query = data.get('q')
+
+    # If the category is selected, filter the facilities and activities based on the category
+    if category:
+        category = category.strip().capitalize()
+        if category in ['Interior', 'Exterior']:
+            facilities = facilities.filter(facility_type=category)
+            activities = None
+        elif category in ['Terrestre', 'Acuática']:
+            activities = activities.filter(activity_type=category)
+            facilities = None
+
+    # If the query is empty, show all facilities and activities
+    # Else search the facilities and activities, the best ranked first
+    if query is not None:
+        query = query.strip()
+
+    pages = {}
+    if facilities is not None:
+        facilities, pages['facilities'] = search_page(search(facilities, query or ''), data, 'facilities_page')
+    if activities is not None:
+        activities, pages['activities'] = search_page(search(activities, query or ''), data, 'activities_page')
 
     return render(request, 'search_results.html', {
         'facilities': facilities,
         'activities': activities,
+        'pages': pages,
         'query': query,
         'category': category
     })
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 import uuid
 import os
@@ -28,6 +30,8 @@ class User(AbstractUser):
     is_uam = models.BooleanField(null=True, blank=True)
     user_type = models.CharField(
         null=True, max_length=30, choices=USER_TYPE_CHOICES)
+    calendar_token = models.UUIDField(default=uuid.uuid4, editable=False,
+                                      help_text="Secret token of the URL of the reservations calendar")
 
     def save(self, *args, **kwargs):
         if not self.password:
@@ -55,16 +59,23 @@ class User(AbstractUser):
 
     def has_valid_bono_for_activity(self, activity):
         """Verifies if the bono is valid valid for an activity"""
-        for bonus in self.bonuses.all():
-            if bonus.belongs_to_activity(activity):
-                if bonus.is_valid:
-                    return True
-        return False
+        return self.get_valid_bono_for_activity(activity) is not None
 
     def get_valid_bono_for_activity(self, activity):
-        """Gets a valid bono for an activity"""
-        for bonus in self.bonuses.all():
-            if bonus.belongs_to_activity(activity):
-                if bonus.is_valid:
-                    return bonus
-        return None
+        """Gets a valid bono for an activity, the result is remembered for the lifetime of the user instance (one request)"""
+        valid_bonos = self.__dict__.setdefault('_valid_bonos', {})
+
+        if activity.pk not in valid_bonos:
+            date_now = timezone.now().date()
+            valid_bonos[activity.pk] = self.bonuses.select_related('bonus').filter(
+                Q(bonus__bonus_type='single', one_use_available=True) |
+                Q(bonus__bonus_type__in=['annual', 'semester'],
+                  date_begin__lte=date_now, date_end__gte=date_now),
+                bonus__activity_id=activity.pk
+            ).order_by('id').first()
+
+        return valid_bonos[activity.pk]
+
+    def forget_valid_bonos(self):
+        """Forgets the remembered valid bonos, used when a bono is bought or used"""
+        self.__dict__.pop('_valid_bonos', None)
@@ -0,0 +1,97 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from datetime import timedelta, time
+
+from sbai.models import Activity, Bonus, Schedule, DayOfWeek
+from slegpn.models import ProductBonus
+from src.models import Session
+
+User = get_user_model()
+
+"""
+ValidBonusTestCase class which contains the tests for the valid bonus lookup of a user
+"""
+
+
+class ValidBonusTestCase(TestCase):
+    def setUp(self):
+        """ Create a user, two activities and their bonuses """
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword")
+        self.today = timezone.now().date()
+
+        self.activity = Activity.objects.create(
+            name="Clases de Natación", description="Clases de natación")
+        self.other_activity = Activity.objects.create(
+            name="Entrenamiento de Tenis", description="Tenis")
+
+        self.single = Bonus.objects.create(
+            activity=self.activity, bonus_type='single', price=5.0)
+        self.semester = Bonus.objects.create(
+            activity=self.activity, bonus_type='semester', price=25.0)
+        self.other_semester = Bonus.objects.create(
+            activity=self.other_activity, bonus_type='semester', price=25.0)
+
+    def test_no_bonus(self):
+        """ A user without bonuses has no valid bonus """
+        self.assertFalse(self.user.has_valid_bono_for_activity(self.activity))
+        self.assertIsNone(
+            self.user.get_valid_bono_for_activity(self.activity))
+
+    def test_valid_semester_bonus(self):
+        """ A semester bonus is valid only between its dates and for its activity """
+        ProductBonus.objects.create(
+            user=self.user, bonus=self.semester,
+            date_begin=self.today - timedelta(days=200), date_end=self.today - timedelta(days=1))
+        valid = ProductBonus.objects.create(
+            user=self.user, bonus=self.semester,
+            date_begin=self.today, date_end=self.today + timedelta(days=30))
+        ProductBonus.objects.create(
+            user=self.user, bonus=self.other_semester,
+            date_begin=self.today, date_end=self.today + timedelta(days=30))
+
+        self.assertEqual(
+            self.user.get_valid_bono_for_activity(self.activity), valid)
+
+    def test_used_single_bonus_is_not_valid(self):
+        """ A single use bonus is only valid while it has not been used """
+        ProductBonus.objects.create(
+            user=self.user, bonus=self.single, one_use_available=False)
+        self.assertFalse(self.user.has_valid_bono_for_activity(self.activity))
+
+        self.user.forget_valid_bonos()
+        valid = ProductBonus.objects.create(
+            user=self.user, bonus=self.single, one_use_available=True)
+        self.assertEqual(
+            self.user.get_valid_bono_for_activity(self.activity), valid)
+
+    def test_valid_bonus_single_query(self):
+        """ The valid bonus is found with one query and remembered for the next checks """
+        for _ in range(5):
+            ProductBonus.objects.create(
+                user=self.user, bonus=self.other_semester,
+                date_begin=self.today, date_end=self.today + timedelta(days=30))
+        ProductBonus.objects.create(
+            user=self.user, bonus=self.single, one_use_available=True)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(
+                self.user.has_valid_bono_for_activity(self.activity))
+            bonus = self.user.get_valid_bono_for_activity(self.activity)
+            # The bonus type is loaded in the same query
+            self.assertEqual(bonus.bonus.bonus_type, 'single')
+
+    def test_used_bonus_is_forgotten_after_reservation(self):
+        """ After a reservation consumes a single use bonus, it is no longer valid """
+        ProductBonus.objects.create(
+            user=self.user, bonus=self.single, one_use_available=True)
+        schedule = Schedule.objects.create(
+            day_of_week=DayOfWeek.LUNES, hour_begin=time(8, 0), hour_end=time(9, 0))
+        session = Session.objects.create(
+            activity=self.activity, schedule=schedule, capacity=5, free_places=5,
+            date=self.today + timedelta(days=1), start_time=time(8, 0), end_time=time(9, 0))
+
+        self.assertTrue(self.user.has_valid_bono_for_activity(self.activity))
+        self.assertIsNotNone(session.add_reservation_activity(self.user))
+        self.assertFalse(self.user.has_valid_bono_for_activity(self.activity))
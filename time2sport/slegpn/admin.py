@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import ProductBonus
+from .models import ProductBonus, ArchivedNotification
 
 admin.site.register(ProductBonus)
+admin.site.register(ArchivedNotification)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SlegpnConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'slegpn'
+
+    def ready(self):
+        import slegpn.signals
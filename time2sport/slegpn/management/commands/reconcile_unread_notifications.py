@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from slegpn.models import Notification
+
+
+class Command(BaseCommand):
+    help = 'Recounts the unread notifications of every user and repairs the cached counters'
+
+    def handle(self, *args, **options):
+        checked, repaired = Notification.reconcile_unread_counts()
+        self.stdout.write(self.style.SUCCESS(
+            f"{checked} contadores comprobados, {repaired} reparados."))
@@ -1,7 +1,12 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Func, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.conf import settings
+from django.core.cache import caches
 from sgu.models import User
 from sbai.models import Bonus
 from django.utils import timezone
+from slegpn.push import publish_unread_count, publish_unread_counts
 
 # Create your models here.
 
@@ -12,8 +17,126 @@ class Notification(models.Model):
     content = models.TextField()
     timestamp = models.DateTimeField(default=timezone.now)
     read = models.BooleanField(default=False)
+    # Indexed by the inbox index
     user = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name='notifications', null=True)
+        User, on_delete=models.CASCADE, related_name='notifications', null=True, db_index=False)
+
+    class Meta:
+        indexes = [
+            # Inbox order, also used by the keyset pagination
+            models.Index(fields=['user', 'read', '-timestamp', '-id'],
+                         name='notification_inbox_idx'),
+            # Unread counters
+            models.Index(fields=['user'], condition=Q(read=False),
+                         name='notification_unread_idx'),
+            # Archive of the old read notifications
+            models.Index(fields=['timestamp'], condition=Q(read=True),
+                         name='notification_archive_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.timestamp} : {self.title} - {self.content}'
+
+    @classmethod
+    def mark_all_as_read(cls, user_id, notification_ids=None):
+        """Marks the unread notifications of a user as read with a single update.
+        If notification_ids is given only those notifications are marked"""
+        notifications = cls.objects.filter(user_id=user_id, read=False)
+        if notification_ids is not None:
+            notifications = notifications.filter(id__in=notification_ids)
+        updated = notifications.update(read=True)
+        if updated:
+            cls.unread_count_changed(user_id, -updated)
+        return updated
+
+    @staticmethod
+    def _unread_count_key(user_id):
+        """Gets the cache key of the unread notifications counter of a user"""
+        return f"notifications:unread:{user_id}"
+
+    @classmethod
+    def get_unread_count(cls, user_id):
+        """Gets the unread notifications count of a user from the cache, counting them on a miss.
+        A change committed between the count and the add is lost, so the counted value is kept
+        only for a short time"""
+        cache = caches['notifications']
+        count = cache.get(cls._unread_count_key(user_id))
+        if count is None:
+            count = cls.objects.filter(user_id=user_id, read=False).count()
+            cache.add(cls._unread_count_key(user_id), count,
+                      settings.NOTIFICATIONS_UNREAD_RECOUNT_TIMEOUT)
+        return count
+
+    @classmethod
+    def update_unread_count(cls, user_id, delta):
+        """Adds delta to the cached unread count of a user, returns None if there was no counter"""
+        cache = caches['notifications']
+        key = cls._unread_count_key(user_id)
+        try:
+            count = cache.incr(key, delta)
+        except ValueError:
+            # Not cached, it will be counted on the next read
+            return None
+        if count < 0:
+            cache.delete(key)
+            return None
+        return count
+
+    @classmethod
+    def unread_count_changed(cls, user_id, delta):
+        """Updates the cached unread count and sends it to the user's open pages once committed,
+        so a rolled back change never reaches the counter"""
+        def changed():
+            count = cls.update_unread_count(user_id, delta)
+            publish_unread_count(
+                user_id, count if count is not None else cls.get_unread_count(user_id))
+
+        transaction.on_commit(changed)
+
+    @classmethod
+    def refresh_unread_counts(cls, user_ids):
+        """Recounts the unread notifications of several users with one query,
+        caches the counts and sends them to the users' open pages once committed"""
+        counts = dict.fromkeys(user_ids, 0)
+        counts.update(cls.objects.filter(user_id__in=user_ids, read=False).values(
+            'user_id').annotate(unread=Count('id')).values_list('user_id', 'unread'))
+
+        def refreshed():
+            caches['notifications'].set_many(
+                {cls._unread_count_key(user_id): count for user_id, count in counts.items()},
+                settings.NOTIFICATIONS_UNREAD_CACHE_TIMEOUT)
+            publish_unread_counts(counts)
+
+        transaction.on_commit(refreshed)
+
+    @classmethod
+    def reconcile_unread_counts(cls):
+        """Recounts the unread notifications of every user and repairs the cached counters.
+        Returns the number of counters checked and the number of counters repaired"""
+        cache = caches['notifications']
+        counts = {
+            cls._unread_count_key(user_id): count
+            for user_id, count in User.objects.annotate(
+                unread=Count('notifications', filter=Q(notifications__read=False))
+            ).values_list('id', 'unread')
+        }
+        cached = cache.get_many(counts.keys())
+        repaired = {
+            key: count for key, count in counts.items()
+            if key in cached and cached[key] != count
+        }
+        cache.set_many(counts, settings.NOTIFICATIONS_UNREAD_CACHE_TIMEOUT)
+        return len(counts), len(repaired)
+
+
+class ArchivedNotification(models.Model):
+    """Class representing an old read notification moved out of the inbox"""
+    title = models.CharField(max_length=80)
+    content = models.TextField()
+    timestamp = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='archived_notifications', null=True)
 
     def __str__(self):
         return f'{self.timestamp} : {self.title} - {self.content}'
@@ -30,6 +153,12 @@ class ProductBonus(models.Model):
     date_end = models.DateField(null=True, blank=True)
     one_use_available = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'bonus']),
+            models.Index(fields=['date_begin', 'date_end']),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.bonus.get_bonus_type_display()} {self.bonus.activity} ({'Válido' if self.is_valid else 'No válido'})"
 
@@ -65,14 +194,40 @@ class WaitingList(models.Model):
     """Class representing the waiting list for a full session"""
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name='waiting_lists')
+    # Indexed by the session and join date index
     session = models.ForeignKey(
-        'src.Session', on_delete=models.CASCADE, related_name='waiting_list')
+        'src.Session', on_delete=models.CASCADE, related_name='waiting_list', db_index=False)
     join_date = models.DateTimeField(default=timezone.now)
     notified_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         unique_together = ('user', 'session')
         ordering = ['join_date']
+        indexes = [
+            # Queue of every session, also read by the promotions for the users still waiting
+            models.Index(fields=['session', 'join_date'], name='waitinglist_session_idx'),
+            # Only the notified entries, used by the periodic sweep
+            models.Index(fields=['notified_at'], condition=Q(notified_at__isnull=False),
+                         name='waitinglist_notified_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} se encuentra en la lista de espera para la sesión {self.session}"
+
+    @staticmethod
+    def _ahead_of(join_date, entry_id):
+        """Entries that joined before the given one, the id breaks ties in the join date"""
+        return Q(join_date__lt=join_date) | Q(join_date=join_date, id__lt=entry_id)
+
+    def get_position(self):
+        """Position of the entry in the waiting list of its session, counted in a single query"""
+        return WaitingList.objects.filter(
+            self._ahead_of(self.join_date, self.id), session_id=self.session_id).count() + 1
+
+    @classmethod
+    def with_positions(cls, queryset):
+        """Annotates the position of every entry of the queryset in its waiting list"""
+        ahead = cls.objects.filter(
+            cls._ahead_of(OuterRef('join_date'), OuterRef('id')), session_id=OuterRef('session_id'),
+        ).order_by().annotate(count=Func('id', function='COUNT')).values('count')
+        return queryset.annotate(position=Coalesce(Subquery(ahead), 0) + Value(1))
@@ -0,0 +1,132 @@
+from datetime import date, time
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+
+from slegpn.models import Notification
+
+# Title and content of every notification sent by the application
+NOTIFICATION_TEMPLATES = {
+    'reservation_done': (
+        "Reserva realizada con éxito",
+        "Has realizado una reserva de {activity} para el día {date}."),
+    'reservation_cancelled': (
+        "Reserva cancelada con éxito",
+        "Has cancelado tu reserva de {name} correctamente."),
+    'facility_reservation_done': (
+        "Reserva realizada correctamente",
+        "Has reservado la instalación {facility} el día {date}"),
+    'facility_reservation_failed': (
+        "Error en la reserva",
+        "Se ha producido un error. Intentelo más tarde"),
+    'payment_done': (
+        "Pago realizado correctamente",
+        "Gracias por inscribirte a {activity}. Has pagado {total}€ en un bono de tipo {bonus_name}. {validity}"),
+    'waiting_list_joined': (
+        "Añadido a la lista de espera",
+        "Te has apuntado a la lista de espera de {activity}. Te encuentras en la posición {position}, en caso de que se produzca una cancelación se te notificará para proceder con la reserva."),
+    'waiting_list_left': (
+        "Has sido eliminado de la lista de espera",
+        "Te has borrado de la lista de espera de {activity}."),
+    'waiting_list_place': (
+        "¡Apúntate a la sesión, se ha liberado una plaza!",
+        "Se ha liberado una plaza en {activity} para el día {date} a las {time}. Tienes {minutes} minutos para confirmar."),
+    'waiting_list_expired': (
+        "Tiempo para reservar a expirado",
+        "No has confirmado tu plaza de {activity} a tiempo."),
+    'session_cancelled': (
+        "Sesión cancelada",
+        "Se ha cancelado la sesión de {name} del día {date} a las {time}. Tu reserva ha sido anulada y, si usaste un bono de sesión única, vuelve a estar disponible."),
+    'waiting_list_session_cancelled': (
+        "Sesión cancelada",
+        "Se ha cancelado la sesión de {name} del día {date} a las {time} en la que estabas en lista de espera."),
+    'export_ready': (
+        "Exportación lista",
+        "Tu exportación {name} está lista. Puedes descargarla desde la página de exportaciones."),
+    'export_failed': (
+        "Error en la exportación",
+        "No se ha podido generar tu exportación {name}. Inténtalo más tarde."),
+}
+
+
+def _format_value(value):
+    """Formats the dates and times of the context as the notifications show them"""
+    if isinstance(value, date):
+        return value.strftime('%d/%m/%Y')
+    if isinstance(value, time):
+        return value.strftime('%H:%M')
+    return value
+
+
+def render_notification(template, **context):
+    """Renders the title and content of a notification template"""
+    title, content = NOTIFICATION_TEMPLATES[template]
+    context = {key: _format_value(value) for key, value in context.items()}
+    return title.format(**context), content.format(**context)
+
+
+def notify(users, template, **context):
+    """Sends a notification to a user or to several users (users or ids).
+    The template is rendered once and the notifications are written by a Celery worker
+    after the current transaction commits, or right away with NOTIFICATIONS_SYNC_DELIVERY"""
+    if isinstance(users, (list, tuple, set, QuerySet)):
+        user_ids = [getattr(user, 'id', user) for user in users]
+    else:
+        user_ids = [getattr(users, 'id', users)]
+    if not user_ids:
+        return
+
+    title, content = render_notification(template, **context)
+    if settings.NOTIFICATIONS_SYNC_DELIVERY:
+        deliver_notifications(user_ids, title, content)
+    else:
+        transaction.on_commit(
+            lambda: deliver_notifications.delay(user_ids, title, content))
+
+
+def notify_each(recipients):
+    """Sends a different notification to several users, e.g. one per session.
+    recipients is a list of (user or id, template, context) triples, every template and
+    context is rendered once and all the notifications are written together"""
+    rendered = {}
+    rows = []
+    for user, template, context in recipients:
+        key = (template, *sorted(context.items()))
+        if key not in rendered:
+            rendered[key] = render_notification(template, **context)
+        rows.append((getattr(user, 'id', user), *rendered[key]))
+    if not rows:
+        return
+
+    if settings.NOTIFICATIONS_SYNC_DELIVERY:
+        deliver_notification_rows(rows)
+    else:
+        transaction.on_commit(lambda: deliver_notification_rows.delay(rows))
+
+
+def _write_notifications(rows):
+    """Inserts the (user id, title, content) rows in batches"""
+    batch_size = settings.NOTIFICATIONS_BATCH_SIZE
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        Notification.objects.bulk_create([
+            Notification(user_id=user_id, title=title, content=content)
+            for user_id, title, content in batch
+        ])
+        # bulk_create sends no signals, refresh the unread counters of the batch
+        Notification.refresh_unread_counts({row[0] for row in batch})
+    return len(rows)
+
+
+@shared_task
+def deliver_notifications(user_ids, title, content):
+    """Writes the same notification for every user in batches"""
+    return _write_notifications([(user_id, title, content) for user_id in user_ids])
+
+
+@shared_task
+def deliver_notification_rows(rows):
+    """Writes a notification for every (user id, title, content) row in batches"""
+    return _write_notifications(rows)
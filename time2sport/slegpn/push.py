@@ -0,0 +1,73 @@
+import json
+import time
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+
+_client = None
+
+
+def _channel(user_id):
+    """Gets the Redis channel where the unread count changes of a user are published"""
+    return f"notifications:{user_id}"
+
+
+def publish_unread_count(user_id, count):
+    """Publishes the unread notifications count of a user to the open push connections"""
+    publish_unread_counts({user_id: count})
+
+
+def publish_unread_counts(counts):
+    """Publishes the unread notifications count of several users in one round trip"""
+    global _client
+    try:
+        if _client is None:
+            _client = redis.Redis.from_url(settings.NOTIFICATIONS_REDIS_URL)
+        pipeline = _client.pipeline(transaction=False)
+        for user_id, count in counts.items():
+            pipeline.publish(_channel(user_id), json.dumps({'unread_count': count}))
+        pipeline.execute()
+    except redis.RedisError:
+        # Push is best effort, the clients fall back to polling
+        pass
+
+
+def push_available(request):
+    """Whether the request is served over ASGI, the only server where an open stream doesn't hold a worker.
+    Under WSGI (runserver) the pages use long polling"""
+    return isinstance(request, ASGIRequest)
+
+
+class UnreadCountListener:
+    """Subscription to the unread notifications count changes of a user"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.client = None
+        self.pubsub = None
+
+    async def __aenter__(self):
+        self.client = aioredis.Redis.from_url(settings.NOTIFICATIONS_REDIS_URL)
+        self.pubsub = self.client.pubsub()
+        try:
+            await self.pubsub.subscribe(_channel(self.user_id))
+        except redis.RedisError:
+            await self.client.aclose()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.pubsub.aclose()
+        await self.client.aclose()
+
+    async def wait(self, timeout):
+        """Waits for the next published count, returns None if nothing is published before the timeout"""
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            # The subscription confirmation is skipped without waiting, so it is read again until the deadline
+            message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+            if message is not None:
+                return json.loads(message['data'])['unread_count']
+        return None
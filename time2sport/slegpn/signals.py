@@ -0,0 +1,28 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from slegpn.models import Notification
+
+
+@receiver(post_init, sender=Notification)
+def remember_read(sender, instance, **kwargs):
+    """Keeps the stored read state to know when it changes"""
+    instance._stored_read = instance.read
+
+
+@receiver(post_save, sender=Notification)
+def count_saved_notification(sender, instance, created, **kwargs):
+    """Adds new unread notifications to the counter and subtracts the ones marked as read"""
+    was_unread = not created and not instance._stored_read
+    is_unread = not instance.read
+    instance._stored_read = instance.read
+    if instance.user_id is None or was_unread == is_unread:
+        return
+    Notification.unread_count_changed(instance.user_id, 1 if is_unread else -1)
+
+
+@receiver(post_delete, sender=Notification)
+def count_deleted_notification(sender, instance, **kwargs):
+    """Subtracts deleted unread notifications from the counter"""
+    if instance.user_id is not None and not instance._stored_read:
+        Notification.unread_count_changed(instance.user_id, -1)
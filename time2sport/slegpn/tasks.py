@@ -1,48 +1,190 @@
 from celery import shared_task
 from django.conf import settings
 from django.utils import timezone
+from django.db import transaction
+from django.db.models import Max
 from datetime import timedelta
-from slegpn.models import WaitingList, Notification
+from slegpn.models import WaitingList, Notification, ArchivedNotification
+from slegpn.notifier import notify_each
+from sbai.models import Activity, SportFacility
 from src.models import Session, Reservation
 
 
+def place_notification(entry):
+    """Gets the notification of a freed place for a promoted waiting list entry"""
+    session = entry.session
+    return (entry.user_id, 'waiting_list_place', {
+        'activity': session.activity.name, 'date': session.date, 'time': session.start_time,
+        'minutes': settings.WAITING_LIST_NOTIFICATION_MINS})
+
+
+def promote_waiting_users(free_places):
+    """Marks as notified the next users waiting for the freed places ({session id: places}).
+    Must run inside a transaction. The sessions are locked first, in id order, so the promotions
+    of a session run one at a time: a concurrent one waits and then sees the users already
+    promoted, never picks the same user and keeps the order of the waiting list.
+    Returns the promoted entries"""
+    if not free_places:
+        return []
+
+    list(Session.objects.select_for_update().filter(
+        id__in=free_places).order_by('id').values_list('id', flat=True))
+    candidates = WaitingList.objects.select_for_update(of=('self',)).filter(
+        session_id__in=free_places, notified_at__isnull=True).select_related(
+            'session__activity').order_by('session_id', 'join_date')
+
+    promoted = []
+    places = dict(free_places)
+    for entry in candidates:
+        if places[entry.session_id] > 0:
+            places[entry.session_id] -= 1
+            promoted.append(entry)
+
+    now = timezone.now()
+    WaitingList.objects.filter(
+        id__in=[entry.id for entry in promoted]).update(notified_at=now)
+    for entry in promoted:
+        entry.notified_at = now
+    return promoted
+
+
+@shared_task
+def expire_waiting_list_notifications(session_ids=None):
+    """Periodic sweep of the waiting lists: removes the notified users whose time to reserve
+    has expired and notifies the next users of those sessions, all the sessions in one pass.
+    Expiring an entry and promoting the next users is one transaction over locked rows, so
+    overlapping or repeated executions never handle the same entry twice"""
+    limit = timezone.now() - timedelta(minutes=settings.WAITING_LIST_NOTIFICATION_MINS)
+
+    with transaction.atomic():
+        expired = WaitingList.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+            notified_at__lte=limit)
+        if session_ids is not None:
+            expired = expired.filter(session_id__in=session_ids)
+        expired = list(expired.select_related('session__activity'))
+        if not expired:
+            return 0
+
+        # Users that reserved in time free no place
+        reserved = set(Reservation.objects.filter(
+            session_id__in={entry.session_id for entry in expired},
+            user_id__in={entry.user_id for entry in expired}).values_list('user_id', 'session_id'))
+        not_reserved = [entry for entry in expired
+                        if (entry.user_id, entry.session_id) not in reserved]
+
+        WaitingList.objects.filter(id__in=[entry.id for entry in expired]).delete()
+
+        # Every place not taken goes to the next user of the session
+        free_places = {}
+        for entry in not_reserved:
+            free_places[entry.session_id] = free_places.get(entry.session_id, 0) + 1
+        promoted = promote_waiting_users(free_places)
+
+        notify_each(
+            [(entry.user_id, 'waiting_list_expired', {'activity': entry.session.activity.name})
+             for entry in not_reserved] +
+            [place_notification(entry) for entry in promoted])
+
+    return len(expired)
+
+
 @shared_task
 def check_waiting_list_timeout(session_id):
-    """Verifies if the first user in the waiting list has made a reservation if not, notifies the next"""
-    session = Session.objects.get(id=session_id)
-    waiting_list = session.waiting_list.order_by('join_date')
-    current_entry = waiting_list.filter(notified_at__isnull=False).first()
-
-    if current_entry:
-        time_limit = current_entry.notified_at + \
-            timedelta(minutes=settings.WAITING_LIST_NOTIFICATION_MINS)
-        user = current_entry.user
-
-        if timezone.now() > time_limit:
-
-            # Checks if the user notified made a reservation
-            if Reservation.objects.filter(user=user, session=session).exists():
-                current_entry.delete()
-            else:
-                Notification.objects.create(
-                    user=current_entry.user,
-                    title="Tiempo para reservar a expirado",
-                    content=f"No has confirmado tu plaza de {session.activity.name} a tiempo."
-                )
-                current_entry.delete()
-
-                # Notify next user
-                next_entry = session.waiting_list.filter(
-                    notified_at__isnull=True).first()
-                if next_entry:
-                    next_entry.notified_at = timezone.now()
-                    next_entry.save()
-
-                    Notification.objects.create(
-                        user=next_entry.user,
-                        title="¡Apúntate a la sesión, se ha liberado una plaza!",
-                        content=f"Se ha liberado una plaza de {session.activity.name} para el día {session.date.strftime('%d/%m/%Y')} a las {session.start_time.strftime('%H:%M')}. Tienes {settings.WAITING_LIST_NOTIFICATION_MINS} minutos para realizar la reserva."
-                    )
-
-                    check_waiting_list_timeout.apply_async(
-                        (session.id,), countdown=settings.WAITING_LIST_NOTIFICATION_MINS*60)
+    """Verifies the waiting list of a session, kept for the countdown tasks queued before the
+    periodic sweep replaced them"""
+    return expire_waiting_list_notifications(session_ids=[session_id])
+
+
+def _first_missing_date(last_dates, key, today):
+    """Gets the first date without sessions for a schedule, never before tomorrow"""
+    last_date = last_dates.get(key)
+    if last_date is None or last_date < today:
+        return today + timedelta(days=1)
+    return last_date + timedelta(days=1)
+
+
+@shared_task
+def extend_sessions_horizon(days=None):
+    """Creates the missing sessions of every activity and facility schedule up to the horizon"""
+    today = timezone.localdate()
+    horizon = today + timedelta(days=days or settings.SESSIONS_HORIZON_DAYS)
+
+    # Last generated date of every schedule, including the cancelled sessions, so only the new days are
+    # built. The past sessions are not read, the days before today are never built
+    activity_dates = {(row['activity'], row['schedule']): row['last_date']
+                      for row in Session.all_objects.filter(activity__isnull=False, date__gte=today).values(
+                          'activity', 'schedule').annotate(last_date=Max('date'))}
+    facility_dates = {(row['facility'], row['schedule']): row['last_date']
+                      for row in Session.all_objects.filter(facility__isnull=False, date__gte=today).values(
+                          'facility', 'schedule').annotate(last_date=Max('date'))}
+
+    # Capacity of the latest session of every activity, kept by its new sessions
+    activity_capacities = dict(Session.objects.filter(activity__isnull=False).order_by(
+        'activity', '-date', '-start_time').distinct('activity').values_list('activity', 'capacity'))
+
+    sessions = []
+    for activity in Activity.objects.prefetch_related('schedules'):
+        capacity = activity_capacities.get(activity.id)
+        for schedule in activity.schedules.all():
+            first_date = _first_missing_date(
+                activity_dates, (activity.id, schedule.id), today)
+            if first_date > horizon:
+                continue
+            kwargs = {'capacity': capacity} if capacity else {}
+            sessions += Session.build_sessions(
+                [schedule], activity=activity, first_date=first_date, last_date=horizon, **kwargs)
+
+    groups = set()
+    for facility in SportFacility.objects.prefetch_related('schedules').order_by('id'):
+        # Sessions of all the instances are built from the first facility of the group
+        if facility.group_id is not None:
+            if facility.group_id in groups:
+                continue
+            groups.add(facility.group_id)
+        for schedule in facility.schedules.all():
+            first_date = _first_missing_date(
+                facility_dates, (facility.id, schedule.id), today)
+            if first_date > horizon:
+                continue
+            sessions += Session.build_sessions(
+                [schedule], facility=facility, first_date=first_date, last_date=horizon)
+
+    Session.objects.bulk_create(
+        sessions, batch_size=settings.SESSIONS_BATCH_SIZE, ignore_conflicts=True)
+    return len(sessions)
+
+
+@shared_task
+def purge_old_sessions(days=None):
+    """Deletes the sessions without reservations older than the retention window"""
+    limit = timezone.localdate() - \
+        timedelta(days=days or settings.SESSIONS_RETENTION_DAYS)
+
+    # Sessions with reservations are kept for the users reservation history
+    deleted, _ = Session.all_objects.filter(
+        date__lt=limit, reservations__isnull=True).delete()
+    return deleted
+
+
+@shared_task
+def archive_read_notifications(days=None, batch_size=1000):
+    """Moves the read notifications older than the archive age out of the inbox"""
+    limit = timezone.now() - \
+        timedelta(days=days or settings.NOTIFICATIONS_ARCHIVE_DAYS)
+    old_notifications = Notification.objects.filter(
+        read=True, timestamp__lt=limit).values('id', 'title', 'content', 'timestamp', 'user_id')
+
+    archived = 0
+    while True:
+        with transaction.atomic():
+            batch = list(old_notifications[:batch_size])
+            if not batch:
+                return archived
+            ArchivedNotification.objects.bulk_create([
+                ArchivedNotification(title=row['title'], content=row['content'],
+                                     timestamp=row['timestamp'], user_id=row['user_id'])
+                for row in batch
+            ])
+            Notification.objects.filter(
+                id__in=[row['id'] for row in batch]).delete()
+        archived += len(batch)
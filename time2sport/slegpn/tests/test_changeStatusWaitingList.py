@@ -7,7 +7,7 @@ from django.urls import reverse
 from django.utils.timezone import now
 from unittest.mock import patch
 from freezegun import freeze_time
-from slegpn.tasks import check_waiting_list_timeout
+from slegpn.tasks import check_waiting_list_timeout, expire_waiting_list_notifications
 from django.conf import settings
 
 from slegpn.models import WaitingList, ProductBonus, Notification
@@ -21,6 +21,7 @@ Test cases for the Waiting List notification functionality.
 '''
 
 
+@override_settings(NOTIFICATIONS_SYNC_DELIVERY=True)
 class WaitingListNotificationTestCase(TestCase):
     def setUp(self):
         # Create users
@@ -111,6 +112,7 @@ Test cases for the Waiting List change status functionality.
 '''
 
 
+@override_settings(NOTIFICATIONS_SYNC_DELIVERY=True)
 class ChangeWaitingListStatusTestCase(TestCase):
     def setUp(self):
         # Create users
@@ -381,3 +383,87 @@ class ChangeWaitingListStatusTestCase(TestCase):
         waiting_list = WaitingList.objects.filter(
             session=self.session_available)
         self.assertEqual(waiting_list.count(), 0)
+
+
+@override_settings(NOTIFICATIONS_SYNC_DELIVERY=True)
+class WaitingListSweepTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f"user{i}", password="testpassword")
+                      for i in range(6)]
+        schedule = Schedule.objects.create(
+            day_of_week=DayOfWeek.LUNES, hour_begin='08:00:00', hour_end='12:00:00')
+        self.activity = Activity.objects.create(
+            name="Example Activity", description="Example activity for a test")
+        self.sessions = [
+            Session.objects.create(
+                activity=self.activity, schedule=schedule, capacity=2, free_places=0,
+                date=timezone.now().date() + timedelta(days=1),
+                start_time=time(hour, 0), end_time=time(hour + 1, 0))
+            for hour in (8, 9, 10)
+        ]
+        self.expired = timezone.now() - timedelta(minutes=settings.WAITING_LIST_NOTIFICATION_MINS + 1)
+
+    def add_entry(self, user, session, minutes_ago, notified_at=None):
+        return WaitingList.objects.create(
+            user=user, session=session, notified_at=notified_at,
+            join_date=timezone.now() - timedelta(minutes=minutes_ago))
+
+    def test_sweep_promotes_next_users_of_every_session(self):
+        """ A single sweep expires the notified users of every session and notifies the next ones. """
+        # Session 0: two expired users and two waiting users, both places go to the next users
+        self.add_entry(self.users[0], self.sessions[0], 50, self.expired)
+        self.add_entry(self.users[1], self.sessions[0], 40, self.expired)
+        self.add_entry(self.users[2], self.sessions[0], 30)
+        self.add_entry(self.users[3], self.sessions[0], 20)
+        # Session 1: the expired user reserved in time, nobody else is notified
+        self.add_entry(self.users[4], self.sessions[1], 50, self.expired)
+        Reservation.objects.create(user=self.users[4], session=self.sessions[1])
+        self.add_entry(self.users[5], self.sessions[1], 40)
+        # Session 2: the notified user still has time
+        self.add_entry(self.users[0], self.sessions[2], 50, timezone.now())
+        self.add_entry(self.users[1], self.sessions[2], 40)
+
+        self.assertEqual(expire_waiting_list_notifications(), 3)
+
+        notified = WaitingList.objects.filter(notified_at__isnull=False)
+        self.assertEqual(
+            {(entry.user, entry.session) for entry in notified},
+            {(self.users[2], self.sessions[0]), (self.users[3], self.sessions[0]),
+             (self.users[0], self.sessions[2])})
+        self.assertTrue(WaitingList.objects.filter(
+            user=self.users[5], session=self.sessions[1], notified_at__isnull=True).exists())
+
+        self.assertEqual(Notification.objects.filter(title="Tiempo para reservar a expirado").count(), 2)
+        self.assertEqual(set(Notification.objects.filter(
+            title="¡Apúntate a la sesión, se ha liberado una plaza!").values_list('user', flat=True)),
+            {self.users[2].id, self.users[3].id})
+        self.assertFalse(Notification.objects.filter(user=self.users[4]).exists())
+
+    def test_sweep_queries_do_not_depend_on_sessions(self):
+        """ The number of queries of a sweep does not depend on the number of sessions. """
+        for session in self.sessions:
+            self.add_entry(self.users[0], session, 50, self.expired)
+            self.add_entry(self.users[1], session, 40)
+
+        # The sessions of the freed places are locked with one query
+        with self.assertNumQueries(10):
+            self.assertEqual(expire_waiting_list_notifications(), 3)
+
+    @patch('slegpn.tasks.check_waiting_list_timeout.apply_async')
+    def test_cancel_reservation_does_not_queue_timer(self, apply_async):
+        """ Cancelling a reservation notifies the next user without queuing a countdown task. """
+        session = self.sessions[0]
+        session.date = timezone.now().date() + timedelta(days=2)
+        session.save()
+        bonus = Bonus.objects.create(activity=self.activity, bonus_type='single', price=5.0)
+        product_bonus = ProductBonus.objects.create(
+            user=self.users[0], bonus=bonus, one_use_available=False)
+        reservation = Reservation.objects.create(
+            user=self.users[0], session=session, bonus=product_bonus)
+        self.add_entry(self.users[1], session, 10)
+
+        self.client.login(username="user0", password="testpassword")
+        self.client.get(reverse('cancel_reservation', args=[reservation.id]))
+
+        apply_async.assert_not_called()
+        self.assertIsNotNone(WaitingList.objects.get(user=self.users[1]).notified_at)
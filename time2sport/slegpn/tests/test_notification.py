@@ -1,7 +1,18 @@
-from django.test import TestCase
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.test import TestCase, override_settings
+from django.core.cache import caches
+from django.core.management import call_command
+from io import StringIO
+from unittest.mock import patch
 from django.contrib.auth import get_user_model
-from slegpn.models import Notification
+from slegpn.models import Notification, ArchivedNotification
+from slegpn.tasks import archive_read_notifications
+from django.utils import timezone
+from datetime import timedelta
 from django.urls import reverse
+import redis
+import time
 
 User = get_user_model()
 
@@ -11,6 +22,9 @@ Test cases for the Notification functionality.
 
 
 class NotificationTestCase(TestCase):
+    def setUp(self):
+        caches['notifications'].clear()
+
     def test_user_cannot_see_notifications_if_not_logged_in(self):
         """ Test that a user cannot see notifications if not logged in. """
 
@@ -63,9 +77,10 @@ class NotificationTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json()['unread_count'], 1)
 
-        # Create another notification
-        notification_2 = Notification.objects.create(
-            user=user, title="Test notification 2", content="This is another test notification.", read=False)
+        # Create another notification, the cached count changes once committed
+        with self.captureOnCommitCallbacks(execute=True):
+            notification_2 = Notification.objects.create(
+                user=user, title="Test notification 2", content="This is another test notification.", read=False)
 
         # Count unread notifications
         response = self.client.get(reverse('unread_notifications_count'))
@@ -75,10 +90,269 @@ class NotificationTestCase(TestCase):
         self.assertEqual(response.json()['unread_count'], 2)
 
         # Read one notification
-        self.client.post(reverse('mark_as_read', args=[
-                         notification_2.id]), follow=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('mark_as_read', args=[
+                             notification_2.id]), follow=True)
 
         # Check if the count is correct
         response = self.client.get(reverse('unread_notifications_count'))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json()['unread_count'], 1)
+
+
+class NotificationPushTestCase(TestCase):
+    def setUp(self):
+        caches['notifications'].clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+
+    def test_unread_count_etag(self):
+        """ The unread count is answered with an ETag and 304 when the client is up to date. """
+        Notification.objects.create(
+            user=self.user, title="Test notification", content="This is a test notification.")
+
+        response = self.client.get(reverse('unread_notifications_count'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"1"')
+
+        response = self.client.get(
+            reverse('unread_notifications_count'), HTTP_IF_NONE_MATCH='"1"')
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(
+            reverse('unread_notifications_count'), HTTP_IF_NONE_MATCH='"0"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['unread_count'], 1)
+
+    @override_settings(NOTIFICATIONS_LONG_POLL_SECONDS=0.2)
+    def test_unread_count_long_poll_timeout(self):
+        """ A long poll without changes answers 304 after the timeout. """
+        started = time.monotonic()
+        response = self.client.get(
+            reverse('unread_notifications_count') + '?wait=1', HTTP_IF_NONE_MATCH='"0"')
+        self.assertEqual(response.status_code, 304)
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+    @override_settings(NOTIFICATIONS_LONG_POLL_SECONDS=0.2)
+    @patch('slegpn.views.UnreadCountListener.__aenter__', side_effect=redis.ConnectionError)
+    def test_unread_count_long_poll_without_redis(self, subscribe):
+        """ Without Redis the long poll still waits before answering 304, so the client doesn't loop. """
+        started = time.monotonic()
+        response = self.client.get(
+            reverse('unread_notifications_count') + '?wait=1', HTTP_IF_NONE_MATCH='"0"')
+        self.assertEqual(response.status_code, 304)
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+    @patch('slegpn.models.publish_unread_count')
+    def test_unread_count_is_pushed(self, publish):
+        """ The new unread count is pushed when a notification is created or read. """
+        with self.captureOnCommitCallbacks(execute=True):
+            notification = Notification.objects.create(
+                user=self.user, title="Test notification", content="This is a test notification.")
+        publish.assert_called_with(self.user.id, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('mark_as_read', args=[notification.id]), follow=True)
+        publish.assert_called_with(self.user.id, 0)
+
+    async def test_notifications_stream(self):
+        """ The stream starts with the current unread count. """
+        await Notification.objects.acreate(
+            user=self.user, title="Test notification", content="This is a test notification.")
+        await self.async_client.aforce_login(self.user)
+
+        response = await self.async_client.get(reverse('notifications_stream'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        events = aiter(response.streaming_content)
+        self.assertTrue((await anext(events)).startswith(b"retry:"))
+        self.assertEqual(await anext(events), b'data: {"unread_count": 1}\n\n')
+        await events.aclose()
+
+        # The pages served over ASGI open the stream
+        response = await self.async_client.get(reverse('notifications'))
+        self.assertTrue(response.context['notifications_push'])
+
+    def test_notifications_stream_over_wsgi(self):
+        """ Under WSGI the stream ends after the current unread count and the pages use long polling. """
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(
+                user=self.user, title="Test notification", content="This is a test notification.")
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('notifications_stream'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.is_async)
+        self.assertEqual(b''.join(response.streaming_content),
+                         f"retry: {settings.NOTIFICATIONS_KEEPALIVE_SECONDS * 1000}\n\n".encode() +
+                         b'data: {"unread_count": 1}\n\n')
+
+        response = self.client.get(reverse('notifications'))
+        self.assertFalse(response.context['notifications_push'])
+        self.assertContains(response, "window.EventSource && false")
+
+
+class UnreadCounterTestCase(TestCase):
+    def setUp(self):
+        caches['notifications'].clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword")
+
+    def create_notification(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notification.objects.create(
+                user=self.user, title="Test notification", content="This is a test notification.")
+
+    def test_counter_is_kept_in_sync(self):
+        """ The counter follows the creation, reading and deletion of notifications. """
+        self.assertEqual(Notification.get_unread_count(self.user.id), 0)
+
+        first = self.create_notification()
+        second = self.create_notification()
+        self.assertEqual(Notification.get_unread_count(self.user.id), 2)
+
+        first.read = True
+        with self.captureOnCommitCallbacks(execute=True):
+            first.save()
+        self.assertEqual(Notification.get_unread_count(self.user.id), 1)
+
+        # Saving an already read notification does not change the counter
+        with self.captureOnCommitCallbacks(execute=True):
+            first.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(Notification.get_unread_count(self.user.id), 0)
+
+        # Deleting a read notification does not change the counter
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(Notification.get_unread_count(self.user.id), 0)
+
+    def test_rolled_back_change_keeps_counter(self):
+        """ A notification created in a rolled back transaction does not change the counter. """
+        self.create_notification()
+        self.assertEqual(Notification.get_unread_count(self.user.id), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                Notification.objects.create(user=self.user, title="Rolled back", content="Test")
+                raise DatabaseError
+        self.assertEqual(Notification.get_unread_count(self.user.id), 1)
+
+    def test_recounted_counter_expires(self):
+        """ A counter filled by counting the notifications is kept only for a short time. """
+        Notification.get_unread_count(self.user.id)
+        key = Notification._unread_count_key(self.user.id)
+
+        with patch.object(caches['notifications'], 'add') as add:
+            caches['notifications'].delete(key)
+            Notification.get_unread_count(self.user.id)
+        add.assert_called_once_with(key, 0, settings.NOTIFICATIONS_UNREAD_RECOUNT_TIMEOUT)
+
+    def test_counter_is_read_from_cache(self):
+        """ A cached counter is read without querying the notifications. """
+        self.create_notification()
+        Notification.get_unread_count(self.user.id)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Notification.get_unread_count(self.user.id), 1)
+
+    def test_reconcile_command(self):
+        """ The reconciliation command repairs the counters that drifted. """
+        self.create_notification()
+        self.create_notification()
+        Notification.objects.filter(user=self.user).update(read=True)
+        self.assertEqual(Notification.get_unread_count(self.user.id), 2)
+
+        out = StringIO()
+        call_command('reconcile_unread_notifications', stdout=out)
+
+        self.assertIn("1 reparados", out.getvalue())
+        self.assertEqual(Notification.get_unread_count(self.user.id), 0)
+
+
+@override_settings(NOTIFICATIONS_PAGE_SIZE=20)
+class NotificationInboxTestCase(TestCase):
+    def setUp(self):
+        caches['notifications'].clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword")
+        self.other_user = User.objects.create_user(
+            username="otheruser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+
+        # Several notifications share the timestamp so the id breaks the ties
+        now = timezone.now()
+        Notification.objects.bulk_create([
+            Notification(user=self.user, title=f"Notification {i}", content="Test",
+                         timestamp=now - timedelta(minutes=i // 3), read=i % 4 == 0)
+            for i in range(45)
+        ])
+
+    def test_pages_follow_inbox_order(self):
+        """ Walking the pages returns every notification once, unread first and newest first. """
+        seen = []
+        url = reverse('notifications')
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.context['notifications']), 20)
+            seen.extend(response.context['notifications'])
+            next_cursor = response.context['next_cursor']
+            url = f"{reverse('notifications')}?after={next_cursor}" if next_cursor else None
+
+        expected = list(self.user.notifications.order_by('read', '-timestamp', '-id'))
+        self.assertEqual([n.id for n in seen], [n.id for n in expected])
+
+    def test_invalid_cursor_shows_first_page(self):
+        """ A malformed cursor shows the first page. """
+        response = self.client.get(reverse('notifications') + '?after=invalid')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['notifications']), 20)
+
+    def test_mark_all_as_read(self):
+        """ Every unread notification is marked as read with a single update. """
+        Notification.objects.create(user=self.other_user, title="Other", content="Test")
+
+        with self.assertNumQueries(1):
+            updated = Notification.mark_all_as_read(self.user.id)
+
+        self.assertEqual(updated, 33)
+        self.assertFalse(self.user.notifications.filter(read=False).exists())
+        self.assertTrue(self.other_user.notifications.filter(read=False).exists())
+
+    def test_mark_page_as_read(self):
+        """ Only the notifications of the page are marked as read. """
+        page = list(self.user.notifications.filter(read=False).order_by('-timestamp')[:5])
+        other = Notification.objects.create(user=self.other_user, title="Other", content="Test")
+        self.assertEqual(Notification.get_unread_count(self.user.id), 33)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('mark_all_as_read'), {
+                'notification_ids': [n.id for n in page] + [other.id]})
+
+        self.assertRedirects(response, reverse('notifications'))
+        self.assertEqual(self.user.notifications.filter(read=False).count(), 28)
+        self.assertFalse(Notification.objects.get(id=other.id).read)
+        self.assertEqual(Notification.get_unread_count(self.user.id), 28)
+
+    @override_settings(NOTIFICATIONS_ARCHIVE_DAYS=30)
+    def test_archive_read_notifications(self):
+        """ Read notifications older than the archive age are moved out of the inbox. """
+        old = timezone.now() - timedelta(days=31)
+        old_read = Notification.objects.create(
+            user=self.user, title="Old read", content="Test", timestamp=old, read=True)
+        old_unread = Notification.objects.create(
+            user=self.user, title="Old unread", content="Test", timestamp=old)
+
+        archived = archive_read_notifications(batch_size=1)
+
+        self.assertEqual(archived, 1)
+        self.assertFalse(Notification.objects.filter(id=old_read.id).exists())
+        self.assertTrue(Notification.objects.filter(id=old_unread.id).exists())
+        self.assertTrue(ArchivedNotification.objects.filter(
+            user=self.user, title="Old read", timestamp=old).exists())
+        self.assertEqual(self.user.notifications.count(), 46)
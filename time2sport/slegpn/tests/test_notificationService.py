@@ -0,0 +1,70 @@
+from django.test import TestCase, override_settings
+from django.core.cache import caches
+from unittest.mock import patch
+from datetime import date, time
+from sgu.models import User
+from slegpn.models import Notification
+from slegpn.notifier import notify, render_notification
+
+'''
+Test cases for the notification service.
+'''
+
+
+@override_settings(NOTIFICATIONS_SYNC_DELIVERY=True)
+class NotificationServiceTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create(
+            [User(username=f"user{i}", password="!") for i in range(5)])
+
+    def setUp(self):
+        caches['notifications'].clear()
+
+    def test_render_notification(self):
+        """ The dates and times of the context are formatted as in the notifications. """
+        title, content = render_notification(
+            'waiting_list_place', activity="Yoga", date=date(2025, 3, 7), time=time(9, 30), minutes=20)
+
+        self.assertEqual(title, "¡Apúntate a la sesión, se ha liberado una plaza!")
+        self.assertEqual(
+            content, "Se ha liberado una plaza en Yoga para el día 07/03/2025 a las 09:30. Tienes 20 minutos para confirmar.")
+
+    def test_notify_single_user(self):
+        """ A single user, or its id, receives the notification. """
+        notify(self.users[0], 'waiting_list_left', activity="Yoga")
+        notify(self.users[0].id, 'waiting_list_expired', activity="Yoga")
+
+        self.assertEqual(
+            list(self.users[0].notifications.order_by('id').values_list('title', flat=True)),
+            ["Has sido eliminado de la lista de espera", "Tiempo para reservar a expirado"])
+
+    @override_settings(NOTIFICATIONS_BATCH_SIZE=2)
+    def test_broadcast_is_written_in_batches(self):
+        """ A broadcast inserts the notifications and recounts the counters once per batch. """
+        Notification.get_unread_count(self.users[0].id)
+
+        # 3 batches with an insert and a count each, the counters are cached once committed
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(6):
+            notify(self.users, 'facility_reservation_failed')
+
+        for user in self.users:
+            self.assertEqual(user.notifications.get().title, "Error en la reserva")
+            self.assertEqual(Notification.get_unread_count(user.id), 1)
+
+    @override_settings(NOTIFICATIONS_SYNC_DELIVERY=False)
+    @patch('slegpn.notifier.deliver_notifications.delay')
+    def test_notify_is_queued_after_commit(self, delay):
+        """ Without synchronous delivery the notifications are sent to the worker once committed. """
+        with self.captureOnCommitCallbacks() as callbacks:
+            notify(User.objects.filter(username__in=["user0", "user1"]).order_by('id'),
+                   'waiting_list_left', activity="Yoga")
+
+        delay.assert_not_called()
+        self.assertFalse(Notification.objects.exists())
+
+        for callback in callbacks:
+            callback()
+        delay.assert_called_once_with(
+            sorted([self.users[0].id, self.users[1].id]),
+            "Has sido eliminado de la lista de espera", "Te has borrado de la lista de espera de Yoga.")
@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 from datetime import timedelta, time
@@ -7,7 +7,7 @@ from django.contrib.auth import get_user_model
 from unittest.mock import patch
 
 from slegpn.models import WaitingList, ProductBonus, Notification
-from src.models import Session, Reservation
+from src.models import FacilitySlot, Session, Reservation
 from sbai.models import Activity, Schedule, DayOfWeek, Bonus, SportFacility
 
 User = get_user_model()
@@ -17,6 +17,7 @@ Test cases for the payment functionality.
 '''
 
 
+@override_settings(NOTIFICATIONS_SYNC_DELIVERY=True)
 class TestPaymentWithNotification(TestCase):
     def setUp(self):
         # Create user
@@ -283,13 +284,8 @@ class TestPaymentWithNotification(TestCase):
 
         # Reserve the session
         session = self.client.session
-        date = self.session_facility.date.strftime('%B %d %Y')
-        begin = self.session_facility.start_time.strftime('%H:%M')
-        end = self.session_facility.end_time.strftime('%H:%M')
-
-        session['selected_sessions'] = [
-            f"{self.facility.id}|{begin}|{end}|{date}"
-        ]
+        session['selected_sessions'] = [FacilitySlot.load(
+            [self.session_facility.id])[0].to_compact()]
         session.save()
         response = self.client.post(
             reverse('invoice_facility', args=[self.facility.id]))
@@ -332,13 +328,8 @@ class TestPaymentWithNotification(TestCase):
 
         # Reserve the session
         session = self.client.session
-        date = self.session_facility.date.strftime('%B %d %Y')
-        begin = self.session_facility.start_time.strftime('%H:%M')
-        end = self.session_facility.end_time.strftime('%H:%M')
-
-        session['selected_sessions'] = [
-            f"{self.facility.id}|{begin}|{end}|{date}"
-        ]
+        session['selected_sessions'] = [FacilitySlot.load(
+            [self.session_facility.id])[0].to_compact()]
         session.save()
         response = self.client.post(
             reverse('invoice_facility', args=[self.facility.id]))
@@ -383,13 +374,8 @@ class TestPaymentWithNotification(TestCase):
 
         # Reserve the session
         session = self.client.session
-        date = self.session_facility.date.strftime('%B %d %Y')
-        begin = self.session_facility.start_time.strftime('%H:%M')
-        end = self.session_facility.end_time.strftime('%H:%M')
-
-        session['selected_sessions'] = [
-            f"{self.facility.id}|{begin}|{end}|{date}"
-        ]
+        session['selected_sessions'] = [FacilitySlot.load(
+            [self.session_facility.id])[0].to_compact()]
         session.save()
         response = self.client.post(
             reverse('invoice_facility', args=[self.facility.id]))
@@ -0,0 +1,125 @@
+from django.test import TestCase
+from django.utils import timezone
+from datetime import timedelta, time
+
+from slegpn.tasks import extend_sessions_horizon, purge_old_sessions
+from src.models import Session, Reservation
+from sbai.models import Activity, SportFacility, Schedule, DayOfWeek
+from sgu.models import User
+
+'''
+Test cases for the periodic tasks that keep the sessions calendar filled.
+'''
+
+
+class SessionsHorizonTestCase(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+
+        # Create an activity with a weekly schedule
+        self.schedule_activity = Schedule.objects.create(
+            day_of_week=DayOfWeek.LUNES,
+            hour_begin=time(8, 0),
+            hour_end=time(9, 0)
+        )
+        self.activity = Activity.objects.create(
+            name="Example Activity",
+            description="Example activity for a test"
+        )
+        self.activity.schedules.add(self.schedule_activity)
+
+        # Create a facility with two instances
+        self.schedule_facility = Schedule.objects.create(
+            day_of_week=DayOfWeek.JUEVES,
+            hour_begin=time(9, 0),
+            hour_end=time(11, 0)
+        )
+        self.facility = SportFacility.objects.create(
+            name="Pista de Tenis",
+            number_of_facilities=2,
+            description="Una pista de tenis bien mantenida.",
+            hour_price=30.0,
+            facility_type="Exterior",
+            schedules=[self.schedule_facility]
+        )
+
+    def test_extend_sessions_horizon(self):
+        """ Sessions are created for every day of the horizon that matches a schedule. """
+        created = extend_sessions_horizon(days=14)
+
+        # 2 weeks x (1 activity session + 2 hour blocks x 2 instances)
+        self.assertEqual(created, 10)
+        activity_sessions = Session.objects.filter(activity=self.activity)
+        self.assertEqual(activity_sessions.count(), 2)
+        for session in activity_sessions:
+            self.assertEqual(session.date.weekday(), DayOfWeek.LUNES)
+            self.assertGreater(session.date, self.today)
+            self.assertLessEqual(session.date, self.today + timedelta(days=14))
+        self.assertEqual(Session.objects.filter(
+            facility__isnull=False).count(), 8)
+
+    def test_extend_sessions_horizon_only_adds_missing_days(self):
+        """ Running the task again only creates the sessions of the new days. """
+        extend_sessions_horizon(days=14)
+        self.assertEqual(extend_sessions_horizon(days=14), 0)
+
+        # One more week only adds one more week of sessions
+        self.assertEqual(extend_sessions_horizon(days=21), 5)
+        self.assertEqual(Session.objects.count(), 15)
+
+    def test_extend_sessions_horizon_keeps_activity_capacity(self):
+        """ New sessions of an activity keep the capacity of the existing ones. """
+        Session.create_sessions(
+            [self.schedule_activity], activity=self.activity, capacity=3, weeks=1)
+        extend_sessions_horizon(days=21)
+
+        sessions = Session.objects.filter(activity=self.activity)
+        self.assertEqual(sessions.count(), 3)
+        self.assertEqual(
+            set(sessions.values_list('capacity', flat=True)), {3})
+
+    def test_extend_sessions_horizon_keeps_latest_capacity(self):
+        """ New sessions of an activity take the capacity of its latest session, not the largest one. """
+        Session.objects.create(
+            activity=self.activity, schedule=self.schedule_activity, capacity=50,
+            date=self.today - timedelta(days=7), start_time=time(8, 0), end_time=time(9, 0))
+        Session.create_sessions(
+            [self.schedule_activity], activity=self.activity, capacity=3, weeks=1)
+        extend_sessions_horizon(days=21)
+
+        sessions = Session.objects.filter(activity=self.activity, date__gte=self.today)
+        self.assertEqual(sessions.count(), 3)
+        self.assertEqual(
+            set(sessions.values_list('capacity', flat=True)), {3})
+
+    def test_extend_sessions_horizon_skips_cancelled_sessions(self):
+        """ The cancelled sessions of the last generated day are not generated again. """
+        extend_sessions_horizon(days=14)
+        last_date = Session.objects.filter(activity=self.activity).latest('date').date
+        Session.cancel_sessions(Session.objects.filter(activity=self.activity, date=last_date))
+
+        self.assertEqual(extend_sessions_horizon(days=14), 0)
+        self.assertFalse(Session.objects.filter(activity=self.activity, date=last_date).exists())
+
+    def test_purge_old_sessions(self):
+        """ Old sessions are deleted unless they have reservations. """
+        user = User.objects.create_user(
+            username="testuser", password="testpassword")
+        old_date = self.today - timedelta(days=200)
+
+        empty_session = Session.objects.create(
+            activity=self.activity, schedule=self.schedule_activity, date=old_date,
+            start_time=time(8, 0), end_time=time(9, 0))
+        reserved_session = Session.objects.create(
+            facility=self.facility, schedule=self.schedule_facility, date=old_date,
+            start_time=time(9, 0), end_time=time(10, 0))
+        recent_session = Session.objects.create(
+            activity=self.activity, schedule=self.schedule_activity, date=self.today - timedelta(days=7),
+            start_time=time(8, 0), end_time=time(9, 0))
+        Reservation.objects.create(user=user, session=reserved_session)
+
+        self.assertEqual(purge_old_sessions(days=180), 1)
+        self.assertFalse(Session.objects.filter(id=empty_session.id).exists())
+        self.assertTrue(Session.objects.filter(
+            id=reserved_session.id).exists())
+        self.assertTrue(Session.objects.filter(id=recent_session.id).exists())
@@ -1,11 +1,11 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
 from datetime import timedelta, time
 from datetime import datetime
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
-from slegpn.models import WaitingList, ProductBonus
+from slegpn.models import WaitingList, ProductBonus, Notification
 from src.models import Session, Reservation
 from sbai.models import Activity, Schedule, DayOfWeek, Bonus
 
@@ -16,6 +16,7 @@ User = get_user_model()
 '''
 
 
+@override_settings(NOTIFICATIONS_SYNC_DELIVERY=True)
 class WaitingListTestCase(TestCase):
     def setUp(self):
         # Create users
@@ -205,3 +206,45 @@ class WaitingListTestCase(TestCase):
         # Check if the user is removed from the waiting list
         self.assertFalse(WaitingList.objects.filter(
             user=self.user1, session=self.session_full).exists())
+
+    def test_join_notification_position(self):
+        """ The join notification tells the position of the user in the waiting list. """
+        WaitingList.objects.create(user=self.user2, session=self.session_full)
+
+        # Login user
+        self.client.login(username="testuser", password="testpassword")
+        self.client.post(reverse('join_waiting_list', args=[
+                         self.session_full.id]), follow=True)
+
+        notification = Notification.objects.get(
+            user=self.user1, title="Añadido a la lista de espera")
+        self.assertIn("Te encuentras en la posición 2", notification.content)
+
+    def test_waiting_list_positions(self):
+        """ The positions of every waiting list are computed in a single query. """
+        now = timezone.now()
+        users = [User.objects.create_user(username=f"waiting{i}", password="testpassword")
+                 for i in range(3)]
+        for i, user in enumerate(users):
+            WaitingList.objects.create(
+                user=user, session=self.session_full, join_date=now - timedelta(minutes=10 - i))
+        # Same join date as the last user, the first joined is ahead
+        WaitingList.objects.create(
+            user=self.user1, session=self.session_full, join_date=now - timedelta(minutes=8))
+        WaitingList.objects.create(
+            user=self.user1, session=self.session_available, join_date=now)
+
+        self.assertEqual(
+            [entry.get_position() for entry in WaitingList.objects.filter(session=self.session_full)], [1, 2, 3, 4])
+
+        with self.assertNumQueries(1):
+            positions = {entry.session_id: entry.position
+                         for entry in WaitingList.with_positions(self.user1.waiting_lists.all())}
+        self.assertEqual(
+            positions, {self.session_full.id: 4, self.session_available.id: 1})
+
+        # Login user
+        self.client.login(username="testuser", password="testpassword")
+        response = self.client.get(reverse('waiting-list'))
+        self.assertContains(response, "Posición 4")
+        self.assertContains(response, "Posición 1")
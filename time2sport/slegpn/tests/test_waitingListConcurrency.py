@@ -0,0 +1,133 @@
+import threading
+from datetime import timedelta, time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection
+from django.test import Client, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from sbai.models import Activity, Bonus, DayOfWeek, Schedule
+from slegpn.models import Notification, ProductBonus, WaitingList
+from slegpn.tasks import expire_waiting_list_notifications
+from src.models import Reservation, Session
+
+User = get_user_model()
+
+PLACE_TITLE = "¡Apúntate a la sesión, se ha liberado una plaza!"
+
+'''
+Stress test cases for the waiting list promotion with concurrent requests and tasks.
+'''
+
+
+@override_settings(NOTIFICATIONS_SYNC_DELIVERY=True)
+class WaitingListConcurrencyTestCase(TransactionTestCase):
+    def setUp(self):
+        caches['notifications'].clear()
+        schedule = Schedule.objects.create(
+            day_of_week=DayOfWeek.LUNES, hour_begin='08:00:00', hour_end='09:00:00')
+        activity = Activity.objects.create(
+            name="Example Activity", description="Example activity for a test")
+        bonus = Bonus.objects.create(activity=activity, bonus_type='semester', price=50.0)
+        self.session = Session.objects.create(
+            activity=activity, schedule=schedule, capacity=5, free_places=0,
+            date=timezone.now().date() + timedelta(days=2), start_time=time(8, 0), end_time=time(9, 0))
+
+        self.reservations = []
+        for i in range(5):
+            user = User.objects.create_user(username=f"reserved{i}", password="testpassword")
+            product_bonus = ProductBonus.objects.create(
+                user=user, bonus=bonus, date_begin=timezone.now().date(),
+                date_end=timezone.now().date() + timedelta(days=30))
+            self.reservations.append(Reservation.objects.create(
+                user=user, session=self.session, bonus=product_bonus))
+
+        self.waiting = [User.objects.create_user(username=f"waiting{i}", password="testpassword")
+                        for i in range(10)]
+        for i, user in enumerate(self.waiting):
+            WaitingList.objects.create(
+                user=user, session=self.session, join_date=timezone.now() - timedelta(minutes=60 - i))
+
+    def run_concurrently(self, functions):
+        """Runs the functions at the same time, each one in a thread with its own connection"""
+        barrier = threading.Barrier(len(functions))
+        results = []
+
+        def run(function):
+            try:
+                barrier.wait()
+                results.append(function())
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(function,)) for function in functions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), len(functions))
+        return results
+
+    def cancel(self, reservation):
+        client = Client()
+        client.force_login(reservation.user)
+        return lambda: client.get(reverse('cancel_reservation', args=[reservation.id])).status_code
+
+    def assert_notified_once(self, users):
+        """Checks that exactly these waiting users are notified, each of them once"""
+        notified = WaitingList.objects.filter(notified_at__isnull=False)
+        self.assertEqual({entry.user_id for entry in notified}, {user.id for user in users})
+        place_notifications = list(Notification.objects.filter(
+            title=PLACE_TITLE).values_list('user_id', flat=True))
+        self.assertCountEqual(place_notifications, [user.id for user in users])
+
+    def test_concurrent_cancellations(self):
+        """ Concurrent cancellations free every place and notify different users in order. """
+        statuses = self.run_concurrently(
+            [self.cancel(reservation) for reservation in self.reservations])
+
+        self.assertEqual(statuses, [302] * 5)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.free_places, 5)
+        self.assert_notified_once(self.waiting[:5])
+
+    def test_duplicate_cancellation(self):
+        """ Cancelling the same reservation twice at once frees a single place. """
+        statuses = self.run_concurrently(
+            [self.cancel(self.reservations[0]), self.cancel(self.reservations[0])])
+
+        self.assertCountEqual(statuses, [302, 404])
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.free_places, 1)
+        self.assert_notified_once(self.waiting[:1])
+
+    def test_duplicate_sweeps(self):
+        """ Overlapping and repeated sweeps expire every entry once and promote one user per place. """
+        expired = timezone.now() - timedelta(minutes=settings.WAITING_LIST_NOTIFICATION_MINS + 1)
+        WaitingList.objects.filter(user__in=self.waiting[:5]).update(notified_at=expired)
+        self.session.free_places = 5
+        self.session.save()
+
+        results = self.run_concurrently([expire_waiting_list_notifications] * 4)
+        results.append(expire_waiting_list_notifications())
+
+        self.assertEqual(sum(results), 5)
+        self.assertFalse(WaitingList.objects.filter(user__in=self.waiting[:5]).exists())
+        self.assert_notified_once(self.waiting[5:])
+        self.assertEqual(Notification.objects.filter(
+            title="Tiempo para reservar a expirado").count(), 5)
+
+    def test_sweep_during_cancellation(self):
+        """ A sweep and a cancellation of the same session promote one user each, in order. """
+        expired = timezone.now() - timedelta(minutes=settings.WAITING_LIST_NOTIFICATION_MINS + 1)
+        WaitingList.objects.filter(user=self.waiting[0]).update(notified_at=expired)
+        self.session.free_places = 1
+        self.session.save()
+
+        self.run_concurrently([expire_waiting_list_notifications, self.cancel(self.reservations[0])])
+
+        self.assertFalse(WaitingList.objects.filter(user=self.waiting[0]).exists())
+        self.assert_notified_once(self.waiting[1:3])
@@ -8,8 +8,11 @@ urlpatterns = [
     path('notifications/', views.notifications, name='notifications'),
     path('notifications/<int:notification_id>/read/',
          views.mark_as_read, name='mark_as_read'),
+    path('notifications/read/', views.mark_all_as_read, name='mark_all_as_read'),
     path('notifications/unread-count/', views.unread_notifications_count,
          name='unread_notifications_count'),
+    path('notifications/stream/', views.notifications_stream,
+         name='notifications_stream'),
 
     path('activities/<int:activity_id>/invoice/',
          views.invoice_activity, name='invoice_activity'),
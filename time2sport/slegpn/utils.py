@@ -1,4 +1,6 @@
 from decimal import Decimal, ROUND_HALF_UP
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db.models import Q
 
 BONUS_TYPE_MAP = {
     "annual": "Bono Anual",
@@ -23,3 +25,42 @@ def get_discount(price, is_uam):
 def get_total(precio, es_uam):
     """Gets the total price"""
     return precio - get_discount(precio, es_uam)
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_inbox_cursor(notification):
+    """Encodes the (read, timestamp, id) position of a notification in the inbox"""
+    microseconds = (notification.timestamp - EPOCH) // timedelta(microseconds=1)
+    return f"{int(notification.read)}.{microseconds}.{notification.id}"
+
+
+def decode_inbox_cursor(cursor):
+    """Decodes an inbox cursor, returns None if it is not valid"""
+    try:
+        read, microseconds, notification_id = (int(part) for part in cursor.split("."))
+    except (AttributeError, ValueError):
+        return None
+    return bool(read), EPOCH + timedelta(microseconds=microseconds), notification_id
+
+
+def get_inbox_page(notifications, cursor=None, page_size=20):
+    """Gets the page of notifications that follows the cursor in (read, -timestamp, -id) order.
+    Returns the page and the cursor of the next page (None on the last page)"""
+    notifications = notifications.order_by('read', '-timestamp', '-id')
+
+    position = decode_inbox_cursor(cursor) if cursor else None
+    if position:
+        read, timestamp, notification_id = position
+        after = Q(read=read, timestamp__lt=timestamp) | Q(
+            read=read, timestamp=timestamp, id__lt=notification_id)
+        if not read:
+            after |= Q(read=True)
+        notifications = notifications.filter(after)
+
+    page = list(notifications[:page_size + 1])
+    if len(page) > page_size:
+        page = page[:page_size]
+        return page, encode_inbox_cursor(page[-1])
+    return page, None
@@ -11,11 +11,17 @@ from src.models import Session
 from paypal.standard.forms import PayPalPaymentsForm
 
 from src.views import reserve_facility_session, _is_conflict_reserved_sessions
-from .utils import get_bonus_name, get_discount, get_total
+from .notifier import notify
+from .utils import get_bonus_name, get_discount, get_total, get_inbox_page
 from django.contrib import messages
 from django.utils import timezone
 from datetime import date, datetime, timedelta
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponseNotModified
+from .push import UnreadCountListener, push_available
+from asgiref.sync import sync_to_async
+import asyncio
+import redis
+import json
 import uuid
 
 
@@ -23,9 +29,13 @@ import uuid
 
 @login_required
 def notifications(request):
-    """Loads the notification template"""
-    notifications = request.user.notifications.order_by('read', '-timestamp')
-    context = {'notifications': notifications}
+    """Loads a page of the notification template"""
+    notifications, next_cursor = get_inbox_page(
+        request.user.notifications.all(), request.GET.get('after'),
+        settings.NOTIFICATIONS_PAGE_SIZE)
+    context = {'notifications': notifications, 'next_cursor': next_cursor,
+               'is_first_page': 'after' not in request.GET,
+               'page_unread_ids': [notification.id for notification in notifications if not notification.read]}
 
     return render(request, 'notifications.html', context)
 
@@ -41,10 +51,91 @@ def mark_as_read(request, notification_id):
 
 
 @login_required
-def unread_notifications_count(request):
-    """Counts the number of unread notifications"""
-    count = request.user.notifications.filter(read=False).count()
-    return JsonResponse({'unread_count': count})
+def mark_all_as_read(request):
+    """Marks all the unread notifications, or the ones listed in the form, as read"""
+    if request.method == 'POST':
+        notification_ids = request.POST.getlist('notification_ids') or None
+        try:
+            Notification.mark_all_as_read(request.user.id, notification_ids)
+        except ValueError:
+            messages.error(request, "Notificaciones no válidas.")
+    return redirect('notifications')
+
+
+async def _unread_count(user):
+    """Gets the cached unread notifications count of a user"""
+    return await sync_to_async(Notification.get_unread_count)(user.id)
+
+
+def _sse_event(count):
+    """Formats the unread count as a server-sent event"""
+    return f"data: {json.dumps({'unread_count': count})}\n\n"
+
+
+@login_required
+async def unread_notifications_count(request):
+    """Counts the number of unread notifications.
+    With ?wait and an up to date If-None-Match, waits for a change before answering (long polling)"""
+    user = await request.auser()
+    count = await _unread_count(user)
+    client_etag = request.headers.get('If-None-Match')
+
+    if 'wait' in request.GET and client_etag == f'"{count}"':
+        try:
+            async with UnreadCountListener(user.id) as listener:
+                # Count again in case it changed before subscribing
+                count = await _unread_count(user)
+                if client_etag == f'"{count}"':
+                    published = await listener.wait(settings.NOTIFICATIONS_LONG_POLL_SECONDS)
+                    if published is not None:
+                        count = published
+        except redis.RedisError:
+            # Without push the client is answered after the same wait, so it doesn't poll in a loop
+            await asyncio.sleep(settings.NOTIFICATIONS_LONG_POLL_SECONDS)
+            count = await _unread_count(user)
+
+    etag = f'"{count}"'
+    if client_etag == etag:
+        return HttpResponseNotModified(headers={'ETag': etag})
+
+    response = JsonResponse({'unread_count': count})
+    response['ETag'] = etag
+    return response
+
+
+async def _unread_count_events(user, retry):
+    """Sends the unread count of a user and then its changes until the client disconnects"""
+    yield retry
+    try:
+        async with UnreadCountListener(user.id) as listener:
+            yield _sse_event(await _unread_count(user))
+            while True:
+                count = await listener.wait(settings.NOTIFICATIONS_KEEPALIVE_SECONDS)
+                # Comments keep the connection open through proxies
+                yield _sse_event(count) if count is not None else ": keep-alive\n\n"
+    except redis.RedisError:
+        # Closing the stream makes the client fall back to long polling
+        return
+
+
+@login_required
+async def notifications_stream(request):
+    """Streams the changes of the unread notifications count as server-sent events"""
+    user = await request.auser()
+    retry = f"retry: {settings.NOTIFICATIONS_KEEPALIVE_SECONDS * 1000}\n\n"
+
+    if push_available(request):
+        events = _unread_count_events(user, retry)
+    else:
+        # Under WSGI nothing is sent until the stream ends, so only the current count is sent
+        # and the client asks again after the retry time
+        events = iter([retry, _sse_event(await _unread_count(user))])
+
+    response = StreamingHttpResponse(
+        events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @login_required
@@ -141,15 +232,14 @@ def complete_enrollment(request, bonus_id):
     year_now = date_now.year
     month_now = date_now.month
 
-    title = "Pago realizado correctamente"
-    content = f"Gracias por inscribirte a {bonus.activity}. "
-    content += f"Has pagado {get_total(bonus.price, user.is_uam)}€ en un bono de tipo {get_bonus_name(bonus.bonus_type)}."
+    payment = {'activity': bonus.activity, 'total': get_total(bonus.price, user.is_uam),
+               'bonus_name': get_bonus_name(bonus.bonus_type)}
 
     if bonus.bonus_type == 'single':
-        content += " Válido para una única reserva de la actividad."
         product_bonus = ProductBonus.objects.create(
             user=user, bonus=bonus, one_use_available=True)
-        Notification.objects.create(user=user, title=title, content=content)
+        notify(user, 'payment_done', **payment,
+               validity="Válido para una única reserva de la actividad.")
     elif bonus.bonus_type == 'semester':
         # ENE - JUN : Second Semester
         if 1 <= month_now <= 6:
@@ -161,10 +251,10 @@ def complete_enrollment(request, bonus_id):
             inicio = date(year_now, 9, 1)
             fin = date(year_now, 12, 31)
 
-        content += f" Válido de {inicio.strftime('%d/%m/%Y')} - {fin.strftime('%d/%m/%Y')}."
         product_bonus = ProductBonus.objects.create(
             user=user, bonus=bonus, date_begin=inicio, date_end=fin)
-        Notification.objects.create(user=user, title=title, content=content)
+        notify(user, 'payment_done', **payment,
+               validity=f"Válido de {inicio.strftime('%d/%m/%Y')} - {fin.strftime('%d/%m/%Y')}.")
     elif bonus.bonus_type == 'annual':
         if 1 <= month_now <= 6:
             inicio = date((year_now-1), 9, 1)
@@ -173,11 +263,10 @@ def complete_enrollment(request, bonus_id):
             inicio = date(year_now, 9, 1)
             fin = date((year_now+1), 6, 30)
 
-        content += f" Válido de {inicio.strftime('%d/%m/%Y')} - {fin.strftime('%d/%m/%Y')}."
-
         product_bonus = ProductBonus.objects.create(
             user=user, bonus=bonus, date_begin=inicio, date_end=fin)
-        Notification.objects.create(user=user, title=title, content=content)
+        notify(user, 'payment_done', **payment,
+               validity=f"Válido de {inicio.strftime('%d/%m/%Y')} - {fin.strftime('%d/%m/%Y')}.")
 
     return redirect('payment-activity-success', product_bonus_id=product_bonus.id)
 
@@ -252,7 +341,8 @@ def payment_facility_failed(request, facility_id):
 @login_required
 def waiting_list(request):
     """Redirects to the waiting lists page"""
-    waiting_lists = request.user.waiting_lists.all()
+    waiting_lists = WaitingList.with_positions(request.user.waiting_lists.select_related(
+        'session__activity', 'session__facility'))
     context = {'waiting_lists': waiting_lists, 'active_tab': 'waiting_list'}
     return render(request, 'waiting_list.html', context)
 
@@ -267,10 +357,8 @@ def cancel_waiting_list(request, waiting_list_id):
         session = waiting_entry.session
         waiting_entry.delete()
 
-        title = "Has sido eliminado de la lista de espera"
-        content = f"Te has borrado de la lista de espera de {session.activity.name}."
-        Notification.objects.create(
-            user=request.user, title=title, content=content)
+        notify(request.user, 'waiting_list_left',
+               activity=session.activity.name)
 
     return redirect('waiting-list')
 
@@ -303,7 +391,7 @@ def join_waiting_list(request, session_id):
 
         # Check if the user does not have another session at the same time
         users_sessions_day = request.user.reservations.filter(
-            session__date=session.date)
+            session__date=session.date).select_related('session')
         requested_start = session.start_time
         requested_end = session.end_time
 
@@ -331,18 +419,14 @@ def join_waiting_list(request, session_id):
             return redirect('activity_detail', session.activity.id)
 
         # Add to waiting list and notify
-        WaitingList.objects.create(user=request.user, session=session)
+        waiting_entry = WaitingList.objects.create(
+            user=request.user, session=session)
         messages.success(
             request, "Te has apuntado correctamente a la lista de espera.")
-        waiting_list = WaitingList.objects.filter(
-            session=session).order_by('join_date')
-        position = list(waiting_list).index(
-            request.user.waiting_lists.get(session=session)) + 1
-
-        title = "Añadido a la lista de espera"
-        content = f"Te has apuntado a la lista de espera de {session.activity.name}. Te encuentras en la posición {position}, en caso de que se produzca una cancelación se te notificará para proceder con la reserva."
-        Notification.objects.create(
-            user=request.user, title=title, content=content)
+        position = waiting_entry.get_position()
+
+        notify(request.user, 'waiting_list_joined',
+               activity=session.activity.name, position=position)
         return redirect('activity_detail', session.activity.id)
 
     return redirect('index')
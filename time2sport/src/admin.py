@@ -3,5 +3,19 @@ from django.contrib import admin
 from .models import Reservation, Session
 # Register your models here.
 
+
+@admin.action(description="Cancelar las sesiones seleccionadas y notificar a los usuarios")
+def cancel_sessions(modeladmin, request, queryset):
+    counts = Session.cancel_sessions(queryset)
+    modeladmin.message_user(
+        request, f"{counts['sessions']} sesiones canceladas, {counts['reservations']} reservas anuladas, "
+        f"{counts['bonuses']} bonos devueltos y {counts['notified']} usuarios notificados.")
+
+
+@admin.register(Session)
+class SessionAdmin(admin.ModelAdmin):
+    list_filter = ['date', 'activity', 'facility']
+    actions = [cancel_sessions]
+
+
 admin.site.register(Reservation)
-admin.site.register(Session)
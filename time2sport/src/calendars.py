@@ -0,0 +1,73 @@
+import hmac
+import io
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from sbai.exports import session_event, write_ics
+from sgu.models import User
+from .models import Reservation
+
+
+def feed_key(user_id):
+    return f'calendar:{user_id}'
+
+
+def get_calendar_feed(user_id):
+    ''' Gets the token and the version of the reservations calendar of a user, None if the user doesn't exist.
+    A new version is started when the calendar is not in the cache, so the old files are not used. '''
+    cache = caches['calendars']
+    feed = cache.get(feed_key(user_id))
+    if feed is None:
+        token = User.objects.filter(id=user_id).values_list('calendar_token', flat=True).first()
+        if token is None:
+            return None
+        # If a concurrent request started the calendar first, its version is kept
+        cache.add(feed_key(user_id), {'token': str(token), 'version': time.time()}, timeout=None)
+        feed = cache.get(feed_key(user_id))
+    return feed
+
+
+def check_calendar_token(feed, token):
+    ''' Checks the token of the URL of a calendar in constant time. '''
+    return feed is not None and hmac.compare_digest(feed['token'], str(token))
+
+
+def renew_calendars(user_ids):
+    ''' Renews the reservations calendars of the users, and their tokens, once the current transaction is committed. '''
+    keys = [feed_key(user_id) for user_id in set(user_ids)]
+    if keys:
+        transaction.on_commit(lambda: caches['calendars'].delete_many(keys))
+
+
+def render_reservations_calendar(user_id, day=None):
+    ''' Renders the iCalendar file of the upcoming reservations of a user and the ones of the last CALENDAR_PAST_DAYS days,
+    counted from a day (today by default). '''
+    first_day = (day or timezone.localdate()) - timedelta(days=settings.CALENDAR_PAST_DAYS)
+    sessions = Reservation.objects.filter(user_id=user_id, session__date__gte=first_day).order_by(
+        'session__date', 'session__start_time').values_list(
+        'session_id', 'session__date', 'session__start_time', 'session__end_time',
+        'session__activity__name', 'session__activity__location', 'session__facility__name')
+
+    output = io.BytesIO()
+    write_ics(output, (
+        session_event(session_id, day, start_time, end_time, activity or facility, location or facility)
+        for session_id, day, start_time, end_time, activity, location, facility in sessions
+    ), "Mis reservas")
+    return output.getvalue()
+
+
+def get_reservations_calendar(user_id, version, day):
+    ''' Gets the iCalendar file of the reservations of a user for a version of its calendar and a day,
+    rendered once per version and day, as the oldest reservations leave the calendar every day. '''
+    cache = caches['calendars']
+    key = f'{feed_key(user_id)}:{version}:{day.isoformat()}'
+    calendar = cache.get(key)
+    if calendar is None:
+        calendar = render_reservations_calendar(user_id, day)
+        cache.set(key, calendar, settings.CALENDAR_CACHE_TIMEOUT)
+    return calendar
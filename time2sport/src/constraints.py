@@ -0,0 +1,48 @@
+import warnings
+
+from django.contrib.postgres.constraints import ExclusionConstraint
+
+
+class ExtensionExclusionConstraint(ExclusionConstraint):
+    ''' Exclusion constraint that needs a PostgreSQL extension, e.g. btree_gist to compare a scalar column with =.
+    As Django does with the constraints a database doesn't support, it is not created without the extension. '''
+
+    def __init__(self, *args, extension, **kwargs):
+        self.extension = extension
+        super().__init__(*args, **kwargs)
+
+    def is_supported(self, schema_editor):
+        ''' Method to check if the extension is installed in the database of the schema editor. '''
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM pg_extension WHERE extname = %s", [self.extension])
+            supported = cursor.fetchone() is not None
+        if not supported:
+            warnings.warn(
+                f"The constraint {self.name} is not created, the {self.extension} extension is not installed.")
+        return supported
+
+    def constraint_sql(self, model, schema_editor):
+        if not self.is_supported(schema_editor):
+            return None
+        return super().constraint_sql(model, schema_editor)
+
+    def create_sql(self, model, schema_editor):
+        if not self.is_supported(schema_editor):
+            return None
+        return super().create_sql(model, schema_editor)
+
+    def remove_sql(self, model, schema_editor):
+        if not self.is_supported(schema_editor):
+            return None
+        return super().remove_sql(model, schema_editor)
+
+    def deconstruct(self):
+        path, args, kwargs = super().deconstruct()
+        kwargs['extension'] = self.extension
+        return path, args, kwargs
+
+    def __eq__(self, other):
+        if isinstance(other, ExtensionExclusionConstraint):
+            return super().__eq__(other) and self.extension == other.extension
+        return super().__eq__(other)
@@ -0,0 +1,36 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sbai.models import SportFacility
+from src.models import Session
+
+
+class Command(BaseCommand):
+    help = 'Cancels the sessions of a day (of an activity or a facility), gives back the bonuses and notifies the users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('date', type=date.fromisoformat,
+                            help='Day of the sessions (YYYY-MM-DD)')
+        parser.add_argument('--activity', type=int,
+                            help='Only the sessions of this activity')
+        parser.add_argument('--facility', type=int,
+                            help='Only the sessions of this facility and of every instance of its group')
+
+    def handle(self, *args, **options):
+        if options['activity'] is None and options['facility'] is None:
+            raise CommandError("Indica una actividad (--activity) o una instalación (--facility).")
+
+        sessions = Session.objects.filter(date=options['date'])
+        if options['activity'] is not None:
+            sessions = sessions.filter(activity_id=options['activity'])
+        if options['facility'] is not None:
+            facility = SportFacility.objects.filter(id=options['facility']).first()
+            if facility is None:
+                raise CommandError("La instalación indicada no existe.")
+            sessions = sessions.filter(facility__in=facility.get_instances())
+
+        counts = Session.cancel_sessions(sessions)
+        self.stdout.write(self.style.SUCCESS(
+            f"{counts['sessions']} sesiones canceladas, {counts['reservations']} reservas anuladas, "
+            f"{counts['bonuses']} bonos devueltos y {counts['notified']} usuarios notificados."))
@@ -1,162 +1,434 @@
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
+from django.conf import settings
+from django.contrib.postgres.fields import DateTimeRangeField, RangeOperators
+from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
 from enum import Enum
 from django.utils import timezone
-from datetime import datetime, date
+from datetime import datetime, date, time
 from datetime import timedelta
 
 from sbai.models import Bonus, Activity, SportFacility, Schedule
 from sgu.models import User
+from slegpn.models import ProductBonus, WaitingList
+from slegpn.notifier import notify_each
+from .constraints import ExtensionExclusionConstraint
+
+OVERLAPPING_RESERVATIONS = 'exclude_overlapping_reservations'
+
+
+class ReservationStatus(Enum):
+    ''' Possible outcomes of a reservation attempt. '''
+    RESERVED = 'reserved'
+    FULL = 'full'
+    NO_BONUS = 'no_bonus'
+    ALREADY_RESERVED = 'already_reserved'
+    NOT_FOUND = 'not_found'
+    OVERLAPPING = 'overlapping'
+
+
+class ReservationResult:
+    ''' Class representing the result of a reservation attempt. '''
+    __slots__ = ('status', 'reservation')
+
+    def __init__(self, status, reservation=None):
+        self.status = status
+        self.reservation = reservation
+
+    def __bool__(self):
+        return self.status is ReservationStatus.RESERVED
+
+    def __repr__(self):
+        return f"ReservationResult({self.status.name}, {self.reservation!r})"
+
+
+class FacilitySlot:
+    ''' Class representing a facility session selected by the user, kept in the user session in compact form. '''
+    __slots__ = ('session_id', 'facility_id', 'date', 'start_time', 'end_time')
+
+    def __init__(self, session_id, facility_id, date, start_time, end_time):
+        self.session_id = session_id
+        self.facility_id = facility_id
+        self.date = date
+        self.start_time = start_time
+        self.end_time = end_time
+
+    @staticmethod
+    def parse_ids(value):
+        ''' Static method to get the session ids of a comma separated selection, ignoring invalid or repeated ones. '''
+        session_ids = []
+        for token in value.split(','):
+            token = token.strip()
+            if token.isdigit() and int(token) not in session_ids:
+                session_ids.append(int(token))
+        return session_ids
+
+    @classmethod
+    def load(cls, session_ids):
+        ''' Class method to get the slots of the facility sessions with one query, in the order of the ids. '''
+        rows = {row[0]: row for row in Session.objects.filter(
+            id__in=session_ids, facility__isnull=False).values_list(
+                'id', 'facility_id', 'date', 'start_time', 'end_time')}
+        return [cls(*rows[session_id]) for session_id in session_ids if session_id in rows]
+
+    def to_compact(self):
+        ''' Method to get the slot as a list of integers: session, facility, date ordinal and start and end minutes. '''
+        return [self.session_id, self.facility_id, self.date.toordinal(),
+                self.start_time.hour * 60 + self.start_time.minute,
+                self.end_time.hour * 60 + self.end_time.minute]
+
+    @classmethod
+    def from_compact(cls, value):
+        ''' Class method to get the slot back from its compact form. '''
+        session_id, facility_id, day, start, end = value
+        return cls(session_id, facility_id, date.fromordinal(day),
+                   time(*divmod(start, 60)), time(*divmod(end, 60)))
+
+    def overlaps(self, other):
+        ''' Method to check if two slots take place at the same time. '''
+        return (self.date == other.date and self.start_time < other.end_time
+                and other.start_time < self.end_time)
+
+    def __eq__(self, other):
+        return isinstance(other, FacilitySlot) and self.to_compact() == other.to_compact()
+
+    def __str__(self):
+        return f"{self.start_time.strftime('%H:%M')} - {self.end_time.strftime('%H:%M')}"
+
+    def __repr__(self):
+        return f"FacilitySlot({self.session_id}, {self.date.isoformat()} {self})"
+
+
+class SessionManager(models.Manager):
+    ''' Manager of the sessions that hides the cancelled ones. '''
+
+    def get_queryset(self):
+        return super().get_queryset().filter(cancelled=False)
 
 
 class Session(models.Model):
     ''' Class representing a session of an activity or facility. '''
+    # Indexed by the composite indexes of Meta
     activity = models.ForeignKey(
-        Activity, on_delete=models.CASCADE, related_name="sessions", null=True)
+        Activity, on_delete=models.CASCADE, related_name="sessions", null=True, db_index=False)
     facility = models.ForeignKey(
-        SportFacility, on_delete=models.CASCADE, related_name="sessions", null=True)
+        SportFacility, on_delete=models.CASCADE, related_name="sessions", null=True, db_index=False)
     schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE)
     capacity = models.IntegerField(default=1)
     free_places = models.IntegerField(default=1)
     date = models.DateField()
     start_time = models.TimeField()
     end_time = models.TimeField()
+    # Cancelled sessions are kept, so they aren't generated again, and hidden by the default manager
+    cancelled = models.BooleanField(default=False)
+
+    objects = SessionManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['activity', 'schedule', 'date', 'start_time'], condition=Q(activity__isnull=False),
+                name='unique_activity_session'),
+            models.UniqueConstraint(
+                fields=['facility', 'schedule', 'date', 'start_time'], condition=Q(facility__isnull=False),
+                name='unique_facility_session'),
+        ]
+        indexes = [
+            # Sessions of an activity by day
+            models.Index(fields=['activity', 'date', 'start_time'], condition=Q(activity__isnull=False),
+                         name='session_activity_date_idx'),
+            # Availability grid and slot lookup of the facilities
+            models.Index(fields=['facility', 'date', 'start_time', 'end_time'], condition=Q(facility__isnull=False),
+                         name='session_facility_date_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if not adding and (update_fields is None or {'date', 'start_time', 'end_time'} & set(update_fields)):
+            # Keep the period of the reservations and the calendars of their users
+            self.reservations.update(period=self.period)
+            from .calendars import renew_calendars
+            renew_calendars(self.reservations.values_list('user_id', flat=True))
+
+    @property
+    def period(self):
+        ''' Time range of the session, it ends the next day if it ends after midnight. '''
+        start = timezone.make_aware(datetime.combine(self.date, self.start_time))
+        end = timezone.make_aware(datetime.combine(self.date, self.end_time))
+        if self.end_time < self.start_time:
+            end += timedelta(days=1)
+        return DateTimeTZRange(start, end)
 
     def is_full(self):
         ''' Method to check if the session is full. '''
         return self.free_places == 0
 
-    def add_reservation_activity(self, user):
-        ''' Method to add a reservation for an activity session. '''
-        # Check if the session is full
+    def reserve_activity(self, user):
+        ''' Method to reserve a place in an activity session, returns a ReservationResult. '''
+        # Check if the session is full (cheap check on the loaded instance)
         if self.is_full():
-            return None
+            return ReservationResult(ReservationStatus.FULL)
 
-        # Check if the user has a valid bonus for the activity
-        if not user.has_valid_bono_for_activity(self.activity):
-            return None
-
-        # Check if the user has already reserved for this session
-        if Reservation.objects.filter(user=user, session=self).exists():
-            return None
-
-        # Get bonus
+        # Get a valid bonus of the user for the activity
         bonus_available = user.get_valid_bono_for_activity(self.activity)
+        if bonus_available is None:
+            return ReservationResult(ReservationStatus.NO_BONUS)
+
+        try:
+            with transaction.atomic():
+                # Check if the user has already reserved for this session
+                if Reservation.objects.filter(user=user, session=self).exists():
+                    return ReservationResult(ReservationStatus.ALREADY_RESERVED)
+
+                # Claim a place with a conditional update so concurrent requests can't overbook
+                claimed = Session.objects.filter(pk=self.pk, free_places__gt=0).update(
+                    free_places=F('free_places') - 1)
+                if not claimed:
+                    return ReservationResult(ReservationStatus.FULL)
+
+                # If bonus is single-use, consume it in the same transaction
+                if bonus_available.bonus.bonus_type == 'single':
+                    consumed = ProductBonus.objects.filter(
+                        pk=bonus_available.pk, one_use_available=True).update(one_use_available=False)
+                    if not consumed:
+                        # The bonus was used by another request, release the claimed place
+                        transaction.set_rollback(True)
+                        return ReservationResult(ReservationStatus.NO_BONUS)
+                    bonus_available.one_use_available = False
+                    user.forget_valid_bonos()
+
+                # Make reservation
+                reservation = Reservation.objects.create(
+                    user=user, session=self, bonus=bonus_available)
+        except IntegrityError as error:
+            # A concurrent request reserved this session, or another one at the same time, for the user
+            return ReservationResult(Reservation.integrity_status(error))
 
-        # Make reservation
-        reservation = Reservation.objects.create(
-            user=user, session=self, bonus=bonus_available)
         self.free_places -= 1
+        return ReservationResult(ReservationStatus.RESERVED, reservation)
+
+    def add_reservation_activity(self, user):
+        ''' Method to add a reservation for an activity session. '''
+        return self.reserve_activity(user).reservation
+
+    @staticmethod
+    def _to_time(value):
+        ''' Static method to get a time from a schedule hour, which can be a string if the schedule is not reloaded. '''
+        if isinstance(value, str):
+            return datetime.strptime(value, "%H:%M:%S").time()
+        return value
 
-        # If bonus is single-use, mark it as used
-        if bonus_available.bonus.bonus_type == 'single':
-            bonus_available.use_single_use()
+    @staticmethod
+    def _hour_blocks(start_time, end_time):
+        ''' Static method to divide a time range into 1 hour intervals. '''
+        blocks = []
+        current_time = datetime.combine(date.today(), start_time)
+        while current_time.time() < end_time:
+            next_time = current_time + timedelta(hours=1)
+            blocks.append((current_time.time(), next_time.time()))
+            current_time = next_time
+        return blocks
 
-        reservation.save()
-        self.save()
-        return reservation
+    @staticmethod
+    def _session_dates(day_of_week, first_date, last_date):
+        ''' Static method to get the dates between first_date and last_date that fall on the given day of the week. '''
+        days_diff = (int(day_of_week) - first_date.weekday()) % 7
+        session_date = first_date + timedelta(days=days_diff)
+        dates = []
+        while session_date <= last_date:
+            dates.append(session_date)
+            session_date += timedelta(weeks=1)
+        return dates
 
     @staticmethod
-    def create_sessions(schedules, activity=None, facility=None, capacity=10):
-        ''' Static method to create sessions for the week based on the provided schedules. '''
+    def build_sessions(schedules, activity=None, facility=None, capacity=10, weeks=1, first_date=None, last_date=None):
+        ''' Static method to build (without saving) the sessions based on the provided schedules.
+        By default the sessions of the next weeks starting tomorrow are built. '''
 
         # Check if both or none activity and facility are provided
         if (activity and facility) or (not activity and not facility):
             return []
 
+        today = date.today()
+        first_date = first_date or today + timedelta(days=1)
+        last_date = last_date or today + timedelta(weeks=weeks)
         sessions = []
-        today = datetime.today()
 
         if activity:
             for schedule in schedules:
-                # Get the schedule for the activity
-                day_of_week = schedule.day_of_week
-                target_day_index = int(day_of_week)
-                today_day_index = today.weekday()
-
-                # Calculate the difference in days
-                days_diff = target_day_index - today_day_index
-                if days_diff <= 0:
-                    days_diff += 7
-
-                # Calculate the date of the first session
-                first_session_date = today + timedelta(days=days_diff)
-
-                date = first_session_date
-                session = Session.objects.create(
-                    activity=activity,
-                    facility=None,
-                    schedule=schedule,
-                    date=first_session_date,
-                    capacity=capacity,
-                    free_places=capacity,
-                    start_time=schedule.hour_begin,
-                    end_time=schedule.hour_end
-                )
-                sessions.append(session)
+                start_time = Session._to_time(schedule.hour_begin)
+                end_time = Session._to_time(schedule.hour_end)
+
+                for session_date in Session._session_dates(schedule.day_of_week, first_date, last_date):
+                    sessions.append(Session(
+                        activity=activity,
+                        facility=None,
+                        schedule=schedule,
+                        date=session_date,
+                        capacity=capacity,
+                        free_places=capacity,
+                        start_time=start_time,
+                        end_time=end_time
+                    ))
 
         elif facility:
-            # Get the facility schedulesof the main facility
-            if facility.number_of_facilities > 1:
-                if not facility.name[-1].isdigit():
-                    facility_name = facility.name
-                else:
-                    facility_name = ' '.join(facility.name.split(" ")[:-1])
+            # Get the facility instances of the group
+            instances = list(facility.get_instances())
 
-                instances = SportFacility.objects.filter(
-                    name__regex=f"^{facility_name}( [0-9]+)?$")
-            else:
-                instances = [facility]
-
-            facility_schedules = facility.schedules.all()
+            facility_schedules = set(
+                facility.schedules.values_list('id', flat=True))
 
             for schedule in schedules:
-                if schedule in facility_schedules:
-                    sch = facility_schedules.get(
-                        day_of_week=schedule.day_of_week, hour_begin=schedule.hour_begin, hour_end=schedule.hour_end)
-
-                    day_of_week = schedule.day_of_week
-                    target_day_index = int(day_of_week)
-                    today_day_index = today.weekday()
-
-                    # Calculate the difference in days
-                    days_diff = target_day_index - today_day_index
-                    if days_diff <= 0:
-                        days_diff += 7
+                if schedule.id not in facility_schedules:
+                    continue
 
-                    # Calculate the date of the first session
-                    first_session_date = today + timedelta(days=days_diff)
+                blocks = Session._hour_blocks(
+                    Session._to_time(schedule.hour_begin), Session._to_time(schedule.hour_end))
 
-                    start_time = schedule.hour_begin
-                    end_time = schedule.hour_end
-                    start_time = datetime.strptime(
-                        start_time, "%H:%M:%S").time()
-                    end_time = datetime.strptime(end_time, "%H:%M:%S").time()
-
-                    current_time = datetime.combine(today, start_time)
-
-                    # Divide the time range into 1 hour intervals
-                    while current_time.time() < end_time:
-                        # Define next time
-                        next_time = current_time + timedelta(hours=1)
-
-                        # Create a session for each facility instance
+                # Create a session for each date, hour block and facility instance
+                for session_date in Session._session_dates(schedule.day_of_week, first_date, last_date):
+                    for start_time, end_time in blocks:
                         for instance in instances:
-                            session = Session.objects.create(
+                            sessions.append(Session(
                                 activity=None,
                                 facility=instance,
-                                schedule=sch,
-                                date=first_session_date,
+                                schedule=schedule,
+                                date=session_date,
                                 capacity=1,
                                 free_places=1,
-                                start_time=current_time.time(),
-                                end_time=next_time.time()
-                            )
-                            sessions.append(session)
-
-                        current_time = next_time
+                                start_time=start_time,
+                                end_time=end_time
+                            ))
 
         return sessions
 
+    @staticmethod
+    def create_sessions(schedules, activity=None, facility=None, capacity=10, weeks=1, batch_size=None):
+        ''' Static method to create the sessions of the next weeks based on the provided schedules.
+        Sessions are inserted in batches and the ones that already exist are skipped.
+        Returns the saved sessions of the schedules in those weeks, the new ones and the ones that already existed. '''
+        sessions = Session.build_sessions(
+            schedules, activity=activity, facility=facility, capacity=capacity, weeks=weeks)
+        if not sessions:
+            return []
+
+        Session.objects.bulk_create(
+            sessions, batch_size=batch_size or settings.SESSIONS_BATCH_SIZE, ignore_conflicts=True)
+        # The skipped sessions have no id, so the saved ones are read again
+        dates = [session.date for session in sessions]
+        saved = Session.objects.filter(
+            schedule__in={session.schedule_id for session in sessions}, date__range=(min(dates), max(dates)))
+        if activity:
+            saved = saved.filter(activity=activity)
+        else:
+            saved = saved.filter(facility__in={session.facility_id for session in sessions})
+        return list(saved.order_by('date', 'start_time', 'facility', 'id'))
+
+    @staticmethod
+    def reserve_facility_slots(user, slots):
+        ''' Static method to reserve several facility slots (FacilitySlot) at once. The sessions are
+        locked with one query, the places claimed with one update and the reservations created in bulk.
+        Returns a ReservationResult for every slot, in the same order. If the database rejects one of
+        the reservations because the user has another one at the same time, none is made. '''
+        if not slots:
+            return []
+
+        with transaction.atomic():
+            # Locked in id order so concurrent bookings of the same slots can't deadlock
+            sessions = {
+                session.id: session
+                for session in Session.objects.select_for_update(of=('self',)).filter(
+                    id__in=[slot.session_id for slot in slots], facility__isnull=False).select_related(
+                        'facility__group').order_by('id')
+            }
+            reserved = set(Reservation.objects.filter(
+                user=user, session__in=sessions.values()).values_list('session_id', flat=True))
+
+            statuses = []
+            claimed = {}
+            for slot in slots:
+                session = sessions.get(slot.session_id)
+                if session is None:
+                    statuses.append(ReservationStatus.NOT_FOUND)
+                elif session.free_places <= 0:
+                    statuses.append(ReservationStatus.FULL)
+                elif session.id in reserved or session.id in claimed:
+                    statuses.append(ReservationStatus.ALREADY_RESERVED)
+                else:
+                    claimed[session.id] = session
+                    statuses.append(ReservationStatus.RESERVED)
+
+            if claimed:
+                Session.objects.filter(id__in=claimed, free_places__gt=0).update(
+                    free_places=F('free_places') - 1)
+                try:
+                    with transaction.atomic():
+                        reservations = {reservation.session_id: reservation for reservation in Reservation.objects.bulk_create(
+                            [Reservation(user=user, session=session, period=session.period)
+                             for session in claimed.values()])}
+                except IntegrityError as error:
+                    # Another booking of the user at the same time was made meanwhile, nothing is reserved
+                    transaction.set_rollback(True)
+                    status = Reservation.integrity_status(error)
+                    return [ReservationResult(status if result is ReservationStatus.RESERVED else result)
+                            for result in statuses]
+                for session in claimed.values():
+                    session.free_places -= 1
+                # The reservations created in bulk don't send post_save
+                from .calendars import renew_calendars
+                renew_calendars([user.id])
+
+        return [
+            ReservationResult(status, reservations[slot.session_id]
+                              if status is ReservationStatus.RESERVED else None)
+            for slot, status in zip(slots, statuses)
+        ]
+
+    @staticmethod
+    def cancel_sessions(sessions):
+        ''' Static method to cancel a queryset of sessions (closure of a facility, bad weather...).
+        Marks the sessions as cancelled, deletes their reservations and waiting lists, gives back the single-use
+        bonuses and notifies the users with a reservation or in the waiting list. Returns the counts. '''
+        from .calendars import renew_calendars
+        with transaction.atomic():
+            # Sessions data for the notifications
+            contexts = {session_id: {'name': name, 'date': day, 'time': start}
+                        for session_id, name, day, start in sessions.values_list(
+                            'id', Coalesce('activity__name', 'facility__name'), 'date', 'start_time')}
+            session_ids = list(contexts)
+            reservations = Reservation.objects.filter(session_id__in=session_ids)
+
+            reserved = list(reservations.values_list('user_id', 'session_id'))
+            waiting = list(WaitingList.objects.filter(
+                session_id__in=session_ids).values_list('user_id', 'session_id'))
+
+            bonuses = ProductBonus.objects.filter(
+                reservations__in=reservations, bonus__bonus_type='single',
+                one_use_available=False).update(one_use_available=True)
+
+            # Deleted without the signals of every reservation, the calendars of their users are renewed at once
+            reservations._raw_delete(reservations.db)
+            WaitingList.objects.filter(session_id__in=session_ids).delete()
+            Session.objects.filter(id__in=session_ids).update(cancelled=True, free_places=0)
+            renew_calendars([user_id for user_id, _ in reserved])
+
+            notify_each(
+                [(user_id, 'session_cancelled', contexts[session_id])
+                 for user_id, session_id in reserved] +
+                [(user_id, 'waiting_list_session_cancelled', contexts[session_id])
+                 for user_id, session_id in waiting])
+
+        return {
+            'sessions': len(session_ids),
+            'reservations': len(reserved),
+            'bonuses': bonuses,
+            'notified': len(reserved) + len(waiting),
+        }
+
     def __str__(self):
         if self.activity is None:
             return f"{self.facility.name} - {self.date.strftime('%d/%m/%Y')} {self.start_time.strftime('%H:%M')}:{self.end_time.strftime('%H:%M')} ({self.free_places}/{self.capacity} disponibles)"
@@ -165,15 +437,54 @@ class Session(models.Model):
 
 class Reservation(models.Model):
     ''' Class representing a reservation for a session. '''
+    # Indexed by the unique user and session constraint
     user = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name="reservations")
+        User, on_delete=models.CASCADE, related_name="reservations", db_index=False)
     session = models.ForeignKey(
         Session, on_delete=models.CASCADE, related_name="reservations")
     bonus = models.ForeignKey(
         'slegpn.ProductBonus', on_delete=models.SET_NULL, null=True, related_name="reservations")
+    # Time range of the session, copied so the database can reject overlapping reservations of a user
+    period = DateTimeRangeField(null=True, editable=False)
+
+    # Whether the overlapping reservations constraint exists, it needs btree_gist
+    _overlaps_enforced = None
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'session'], name='unique_user_session_reservation'),
+            ExtensionExclusionConstraint(
+                name=OVERLAPPING_RESERVATIONS, extension='btree_gist',
+                expressions=[('user', RangeOperators.EQUAL), ('period', RangeOperators.OVERLAPS)]),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.period is None and self.session_id is not None:
+            self.period = self.session.period
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def overlaps_enforced(cls):
+        ''' Class method to know if the database rejects the overlapping reservations of a user. '''
+        if cls._overlaps_enforced is None:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM pg_constraint WHERE conname = %s", [OVERLAPPING_RESERVATIONS])
+                cls._overlaps_enforced = cursor.fetchone() is not None
+        return cls._overlaps_enforced
+
+    @staticmethod
+    def integrity_status(error):
+        ''' Static method to get the ReservationStatus of an IntegrityError raised when reserving. '''
+        diag = getattr(error.__cause__, 'diag', None)
+        if getattr(diag, 'constraint_name', None) == OVERLAPPING_RESERVATIONS:
+            return ReservationStatus.OVERLAPPING
+        return ReservationStatus.ALREADY_RESERVED
 
     def cancel(self):
-        ''' Method to cancel a reservation. '''
+        ''' Method to cancel a reservation.
+        Raises Reservation.DoesNotExist if it was already cancelled. '''
         # Check if there are more than 2 hours in advance
         now = datetime.now()
         session_date_time = datetime.combine(
@@ -184,16 +495,21 @@ class Reservation(models.Model):
         if time_difference < timedelta(hours=2):
             return False
 
-        # Update the session's free places
-        self.session.free_places += 1
-        self.session.save()
-
-        # If the reservation was made with a single-use bonus, update the bonus
-        if self.session.activity:
-            if self.bonus.bonus.bonus_type == 'single':
-                self.bonus.cancel_single_use()
-
-        self.delete()
+        with transaction.atomic():
+            # Deleting first makes a repeated cancellation fail instead of freeing the place twice
+            deleted, _ = Reservation.objects.filter(pk=self.pk).delete()
+            if not deleted:
+                raise Reservation.DoesNotExist("The reservation was already cancelled.")
+
+            # Update the session's free places
+            Session.objects.filter(pk=self.session_id).update(
+                free_places=F('free_places') + 1)
+
+            # If the reservation was made with a single-use bonus, update the bonus
+            if self.session.activity and self.bonus:
+                if self.bonus.bonus.bonus_type == 'single':
+                    ProductBonus.objects.filter(pk=self.bonus_id).update(
+                        one_use_available=True)
         return True
 
     def __str__(self):
@@ -0,0 +1,28 @@
+import warnings
+
+from django.db import DatabaseError, connections, transaction
+from django.db.models.signals import post_delete, post_save, pre_migrate
+from django.dispatch import receiver
+
+from .calendars import renew_calendars
+from .models import Reservation
+
+
+@receiver(pre_migrate)
+def create_extensions(sender, app_config, using, **kwargs):
+    ''' Creates the btree_gist extension used by the overlapping reservations constraint before migrating src.
+    The migrations are generated by each installation, so the extension can't be created by one of them. '''
+    connection = connections[using]
+    if app_config.label != 'src' or connection.vendor != 'postgresql':
+        return
+    try:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+    except DatabaseError as error:
+        warnings.warn(f"The btree_gist extension can't be created: {error}")
+
+
+@receiver([post_save, post_delete], sender=Reservation)
+def reservation_changed(sender, instance, **kwargs):
+    ''' Renews the reservations calendar of the user when a reservation is made or cancelled. '''
+    renew_calendars([instance.user_id])
@@ -1,10 +1,10 @@
 from django.test import TestCase
 from datetime import datetime, time, date
-from src.models import Session, Reservation
+from src.models import FacilitySlot, Session, Reservation
 from sbai.models import Schedule, SportFacility, Activity, Bonus, DayOfWeek
 from sgu.models import User
 from slegpn.models import ProductBonus
-from src.views import _is_conflict_reserved_sessions, _is_conflict_chosen_sessions, _get_session_split_data
+from src.views import _is_conflict_reserved_sessions, _is_conflict_chosen_sessions, _is_conflict_reserved_slots
 
 
 class AuxiliarReservationFunctionsView(TestCase):
@@ -92,8 +92,8 @@ class AuxiliarReservationFunctionsView(TestCase):
     def test_is_conflict_chosen_sessions(self):
         """Confirms that there is a conflict between two sessions"""
         selected_sessions = [
-            "1|09:00|10:00|April 21 2025",
-            "1|09:30|10:30|April 21 2025"
+            FacilitySlot(1, 1, date(2025, 4, 21), time(9, 0), time(10, 0)),
+            FacilitySlot(2, 1, date(2025, 4, 21), time(9, 30), time(10, 30))
         ]
 
         result = _is_conflict_chosen_sessions(selected_sessions)
@@ -102,18 +102,52 @@ class AuxiliarReservationFunctionsView(TestCase):
     def test_no_conflict_chosen_sessions(self):
         """Confirms that there is no conflict between two sessions"""
         selected_sessions = [
-            "1|09:00|10:00|April 21 2025",
-            "1|10:00|11:00|April 21 2025"
+            FacilitySlot(1, 1, date(2025, 4, 21), time(9, 0), time(10, 0)),
+            FacilitySlot(2, 1, date(2025, 4, 21), time(10, 0), time(11, 0)),
+            FacilitySlot(3, 1, date(2025, 4, 22), time(9, 30), time(10, 30))
         ]
 
         result = _is_conflict_chosen_sessions(selected_sessions)
         self.assertFalse(result)
 
-    def test_get_session_split_data(self):
-        """Checks that the data is correctly splitted"""
-        input_string = "1|09:00|10:00|April 21 2025"
-        facility_id, day, start, end = _get_session_split_data(input_string)
-        self.assertEqual(facility_id, "1")
-        self.assertEqual(start, time(9, 0))
-        self.assertEqual(end, time(10, 0))
-        self.assertEqual(day, datetime(2025, 4, 21))
+    def test_conflict_chosen_sessions_not_consecutive(self):
+        """Confirms that a long session conflicts with a later one even if another one starts between them"""
+        selected_sessions = [
+            FacilitySlot(1, 1, date(2025, 4, 21), time(13, 0), time(14, 0)),
+            FacilitySlot(2, 1, date(2025, 4, 21), time(9, 0), time(14, 0)),
+            FacilitySlot(3, 1, date(2025, 4, 21), time(10, 0), time(11, 0))
+        ]
+
+        result = _is_conflict_chosen_sessions(selected_sessions)
+        self.assertTrue(result)
+
+    def test_is_conflict_reserved_slots(self):
+        """Confirms that only the overlaps between a chosen slot and a reserved session are conflicts"""
+        day = date(2025, 4, 21)
+        reserved = [
+            Session(date=day, start_time=time(8, 0), end_time=time(12, 0)),
+            Session(date=day, start_time=time(9, 0), end_time=time(10, 0)),
+            Session(date=date(2025, 4, 22), start_time=time(12, 0), end_time=time(13, 0))
+        ]
+
+        self.assertFalse(_is_conflict_reserved_slots(
+            [FacilitySlot(1, 1, day, time(12, 0), time(13, 0))], reserved))
+        self.assertTrue(_is_conflict_reserved_slots(
+            [FacilitySlot(1, 1, day, time(11, 0), time(12, 0))], reserved))
+        self.assertTrue(_is_conflict_reserved_slots(
+            [FacilitySlot(1, 1, day, time(7, 0), time(8, 30))], reserved))
+        self.assertFalse(_is_conflict_reserved_slots([], reserved))
+
+    def test_parse_slot_ids(self):
+        """Checks that the selected session ids are parsed ignoring invalid and repeated ones"""
+        self.assertEqual(FacilitySlot.parse_ids("3,1, 7,,x,3"), [3, 1, 7])
+        self.assertEqual(FacilitySlot.parse_ids(""), [])
+
+    def test_slot_compact_form(self):
+        """Checks that a slot is kept in the session as integers and read back"""
+        slot = FacilitySlot(5, 2, date(2025, 4, 21), time(9, 0), time(10, 30))
+        compact = slot.to_compact()
+
+        self.assertTrue(all(isinstance(value, int) for value in compact))
+        self.assertEqual(FacilitySlot.from_compact(compact), slot)
+        self.assertEqual(str(slot), "09:00 - 10:30")
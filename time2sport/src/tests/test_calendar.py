@@ -0,0 +1,181 @@
+import uuid
+from datetime import date, time, timedelta
+from unittest.mock import patch
+
+from django.conf import settings
+
+from django.core.cache import caches
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from sbai.models import Activity, DayOfWeek, Schedule, SportFacility
+from sgu.models import User
+from src.models import FacilitySlot, Reservation, Session
+
+
+class ReservationsCalendarTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.schedule = Schedule.objects.create(
+            day_of_week=DayOfWeek.LUNES, hour_begin=time(8, 0), hour_end=time(22, 0))
+        cls.activity = Activity.objects.create(
+            name="Zumba", location="Sala 4", description="Zumba", activity_type="Terrestre")
+        cls.facility = SportFacility.objects.create(
+            name="Pista de Tenis", number_of_facilities=1, description="Pista", hour_price=10,
+            facility_type="Exterior")
+        cls.user = User.objects.create_user(username="ramon", password="test1234")
+        cls.other_user = User.objects.create_user(username="lucia", password="test1234")
+
+        tomorrow = date.today() + timedelta(days=1)
+        cls.session = Session.objects.create(
+            activity=cls.activity, schedule=cls.schedule, capacity=5, free_places=4,
+            date=tomorrow, start_time=time(8, 0), end_time=time(9, 0))
+        cls.old_session = Session.objects.create(
+            activity=cls.activity, schedule=cls.schedule, capacity=5, free_places=4,
+            date=date.today() - timedelta(days=60), start_time=time(8, 0), end_time=time(9, 0))
+        cls.facility_session = Session.objects.create(
+            facility=cls.facility, schedule=cls.schedule, capacity=1, free_places=1,
+            date=tomorrow, start_time=time(18, 0), end_time=time(19, 0))
+        cls.reservation = Reservation.objects.create(user=cls.user, session=cls.session)
+        Reservation.objects.create(user=cls.user, session=cls.old_session)
+
+    def setUp(self):
+        caches['calendars'].clear()
+
+    def feed_url(self, user=None):
+        user = user or self.user
+        return reverse('reservations_calendar', args=[user.id, user.calendar_token])
+
+    def test_feed(self):
+        """The feed has the upcoming reservations of the user without logging in"""
+        response = self.client.get(self.feed_url())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        self.assertIn('ETag', response)
+        content = response.content.decode('utf-8')
+        self.assertEqual(content.count("BEGIN:VEVENT"), 1)
+        self.assertIn(f"UID:session-{self.session.id}@time2sport\r\n", content)
+        self.assertIn("SUMMARY:Zumba\r\nLOCATION:Sala 4\r\n", content)
+
+    def test_wrong_token(self):
+        """The feed isn't found with another token or user"""
+        url = reverse('reservations_calendar', args=[self.user.id, uuid.uuid4()])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        url = reverse('reservations_calendar', args=[self.user.id, self.other_user.calendar_token])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        url = reverse('reservations_calendar', args=[uuid.uuid4(), self.user.calendar_token])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_not_modified(self):
+        """A client with the current version gets a 304 from the cache"""
+        response = self.client.get(self.feed_url())
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.feed_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.feed_url())
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_day_renews_feed(self):
+        """The reservations leaving the calendar at the end of the day are removed from the next day"""
+        today = timezone.localdate()
+        past_session = Session.objects.create(
+            activity=self.activity, schedule=self.schedule, capacity=5, free_places=4,
+            date=today - timedelta(days=settings.CALENDAR_PAST_DAYS), start_time=time(8, 0), end_time=time(9, 0))
+        Reservation.objects.create(user=self.user, session=past_session)
+        caches['calendars'].clear()
+        response = self.client.get(self.feed_url())
+        self.assertIn(f"UID:session-{past_session.id}@time2sport", response.content.decode('utf-8'))
+
+        with patch('django.utils.timezone.localdate', return_value=today + timedelta(days=1)):
+            response = self.client.get(self.feed_url(), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(f"UID:session-{past_session.id}@time2sport", response.content.decode('utf-8'))
+        self.assertIn(f"UID:session-{self.session.id}@time2sport", response.content.decode('utf-8'))
+
+    def test_reservation_renews_feed(self):
+        """Reserving a session starts a new version of the calendar"""
+        etag = self.client.get(self.feed_url())['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.facility_session.reserve_facility_slots(
+                self.user, FacilitySlot.load([self.facility_session.id]))
+
+        response = self.client.get(self.feed_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn(f"UID:session-{self.facility_session.id}@time2sport",
+                      response.content.decode('utf-8'))
+
+    def test_cancellation_renews_feed(self):
+        """Cancelling a reservation removes it from the calendar"""
+        etag = self.client.get(self.feed_url())['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reservation.delete()
+
+        response = self.client.get(self.feed_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("BEGIN:VEVENT", response.content.decode('utf-8'))
+
+    def test_session_change_renews_feed(self):
+        """Moving a session changes the reservations calendars of its users"""
+        etag = self.client.get(self.feed_url())['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.session.start_time = time(10, 0)
+            self.session.end_time = time(11, 0)
+            self.session.save()
+
+        response = self.client.get(self.feed_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_other_users_unchanged(self):
+        """A reservation of another user keeps the calendar"""
+        etag = self.client.get(self.feed_url())['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Reservation.objects.create(user=self.other_user, session=self.session)
+
+        response = self.client.get(self.feed_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_renew_token(self):
+        """A new link can be generated and the previous one stops working"""
+        old_url = self.feed_url()
+        self.client.get(old_url)
+        self.client.force_login(self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('renew_calendar_token'))
+        self.assertRedirects(response, reverse('reservations'))
+
+        self.user.refresh_from_db()
+        self.assertNotEqual(self.feed_url(), old_url)
+        self.assertEqual(self.client.get(old_url).status_code, 404)
+        self.assertEqual(self.client.get(self.feed_url()).status_code, 200)
+
+    def test_reservations_page_link(self):
+        """The reservations page shows the link of the calendar"""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('reservations'))
+
+        self.assertContains(response, f"http://testserver{self.feed_url()}")
+
+    def test_activity_calendar(self):
+        """The activity calendar has its upcoming sessions"""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('download_activity_calendar', args=[self.activity.id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        content = response.content.decode('utf-8')
+        self.assertIn("X-WR-CALNAME:Zumba\r\n", content)
+        self.assertEqual(content.count("BEGIN:VEVENT"), 1)
+        self.assertIn(f"UID:session-{self.session.id}@time2sport", content)
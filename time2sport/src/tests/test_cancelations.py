@@ -1,13 +1,18 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from io import StringIO
+from unittest.mock import patch
 from datetime import datetime, time, date, timedelta
 from django.urls import reverse
 from src.models import Session, Reservation
-from sbai.models import Schedule, Activity, Bonus, DayOfWeek
+from sbai.models import Schedule, Activity, Bonus, DayOfWeek, SportFacility
 from sgu.models import User
-from slegpn.models import ProductBonus, Notification
-from src.views import _is_conflict_reserved_sessions, _is_conflict_chosen_sessions, _get_session_split_data
+from slegpn.models import ProductBonus, Notification, WaitingList
+from src.views import _is_conflict_reserved_sessions, _is_conflict_chosen_sessions
 
 
+@override_settings(NOTIFICATIONS_SYNC_DELIVERY=True)
 class CancelReservationViewTest(TestCase):
 
     @classmethod
@@ -184,3 +189,139 @@ class CancelReservationViewTest(TestCase):
         response = self.client.get(
             reverse('cancel_reservation', args=[self.reservation.id]))
         self.assertEqual(response.status_code, 404)
+
+
+@override_settings(NOTIFICATIONS_SYNC_DELIVERY=True)
+class CancelSessionsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        schedule = Schedule.objects.create(
+            day_of_week=DayOfWeek.MARTES, hour_begin="08:00:00", hour_end="10:00:00")
+        cls.activity = Activity.objects.create(
+            name="Yoga", location="Pabellón", description="Yoga", activity_type="Terrestre")
+        cls.day = date.today() + timedelta(days=3)
+
+        cls.sessions = [
+            Session.objects.create(
+                activity=cls.activity, schedule=schedule, capacity=10, free_places=10,
+                date=cls.day, start_time=time(hour, 0), end_time=time(hour + 1, 0))
+            for hour in (8, 9)
+        ]
+        cls.other_day_session = Session.objects.create(
+            activity=cls.activity, schedule=schedule, capacity=10, free_places=10,
+            date=cls.day + timedelta(days=7), start_time=time(8, 0), end_time=time(9, 0))
+
+        single = Bonus.objects.create(
+            activity=cls.activity, bonus_type='single', price=5.0)
+        semester = Bonus.objects.create(
+            activity=cls.activity, bonus_type='semester', price=50.0)
+
+        cls.users = User.objects.bulk_create(
+            [User(username=f"user{i}", password="!") for i in range(4)])
+        cls.single_bonuses = []
+        for user, session in zip(cls.users[:3], [cls.sessions[0], cls.sessions[0], cls.sessions[1]]):
+            product_bonus = ProductBonus.objects.create(
+                user=user, bonus=single, one_use_available=False)
+            cls.single_bonuses.append(product_bonus)
+            Reservation.objects.create(user=user, session=session, bonus=product_bonus)
+
+        semester_bonus = ProductBonus.objects.create(
+            user=cls.users[3], bonus=semester, date_begin=date.today(), date_end=date.today() + timedelta(days=90))
+        Reservation.objects.create(
+            user=cls.users[3], session=cls.other_day_session, bonus=semester_bonus)
+        WaitingList.objects.create(user=cls.users[3], session=cls.sessions[1])
+
+    def test_cancel_sessions(self):
+        """Cancels the sessions, gives back the single-use bonuses and notifies the users"""
+        counts = Session.cancel_sessions(Session.objects.filter(date=self.day))
+
+        self.assertEqual(counts, {'sessions': 2, 'reservations': 3, 'bonuses': 3, 'notified': 4})
+        self.assertFalse(Session.objects.filter(date=self.day).exists())
+        self.assertFalse(WaitingList.objects.exists())
+        self.assertEqual(Reservation.objects.get().session, self.other_day_session)
+
+        for product_bonus in self.single_bonuses:
+            product_bonus.refresh_from_db()
+            self.assertTrue(product_bonus.one_use_available)
+
+        notification = Notification.objects.get(user=self.users[2])
+        self.assertEqual(notification.title, "Sesión cancelada")
+        self.assertIn(
+            f"Yoga del día {self.day.strftime('%d/%m/%Y')} a las 09:00", notification.content)
+        self.assertIn("lista de espera", Notification.objects.get(user=self.users[3]).content)
+
+    def test_cancel_sessions_queries(self):
+        """The number of queries does not depend on the number of reservations"""
+        # The reservations are read once to notify their users and renew their calendars
+        with self.assertNumQueries(11):
+            Session.cancel_sessions(Session.objects.filter(date=self.day))
+
+    def test_cancelled_sessions_not_generated_again(self):
+        """The cancelled sessions are kept hidden, so generating the sessions again skips them"""
+        with patch('src.calendars.renew_calendars') as renew, patch('src.signals.renew_calendars', renew):
+            Session.cancel_sessions(Session.objects.filter(date=self.day))
+        # The calendars of all the users are renewed at once
+        renew.assert_called_once()
+        self.assertCountEqual(renew.call_args.args[0], [user.id for user in self.users[:3]])
+
+        self.assertEqual(Session.all_objects.filter(date=self.day, cancelled=True).count(), 2)
+        self.assertFalse(Session.objects.filter(date=self.day).exists())
+        schedule = self.sessions[0].schedule
+        self.assertNotIn(self.day, [session.date for session in Session.create_sessions(
+            [schedule], activity=self.activity, weeks=2)])
+        self.assertFalse(Session.objects.filter(date=self.day).exists())
+
+    def test_cancel_sessions_command(self):
+        """The management command cancels the sessions of the day and reports the counts"""
+        out = StringIO()
+        call_command('cancel_sessions', self.day.isoformat(),
+                     '--activity', str(self.activity.id), stdout=out)
+
+        self.assertIn("2 sesiones canceladas, 3 reservas anuladas", out.getvalue())
+        self.assertTrue(Session.objects.filter(id=self.other_day_session.id).exists())
+
+    def test_cancel_sessions_command_facility_instances(self):
+        """The command cancels the sessions of every instance of the facility"""
+        schedule = Schedule.objects.create(
+            day_of_week=DayOfWeek.MARTES, hour_begin="18:00:00", hour_end="19:00:00")
+        facility = SportFacility.objects.create(
+            name="Pista de Tenis", number_of_facilities=2, description="Pista", hour_price=10,
+            facility_type="Exterior")
+        other_facility = SportFacility.objects.create(
+            name="Pista de Pádel", number_of_facilities=1, description="Pista", hour_price=10,
+            facility_type="Exterior")
+        for instance in [*facility.get_instances(), other_facility]:
+            Session.objects.create(
+                facility=instance, schedule=schedule, capacity=1, free_places=1,
+                date=self.day, start_time=time(18, 0), end_time=time(19, 0))
+
+        out = StringIO()
+        call_command('cancel_sessions', self.day.isoformat(),
+                     '--facility', str(facility.get_instances()[1].id), stdout=out)
+
+        self.assertIn("2 sesiones canceladas", out.getvalue())
+        self.assertEqual(list(Session.objects.filter(facility__isnull=False).values_list('facility', flat=True)),
+                         [other_facility.id])
+        with self.assertRaises(CommandError):
+            call_command('cancel_sessions', self.day.isoformat(), '--facility', '0')
+
+    def test_cancel_sessions_command_requires_filter(self):
+        """The command refuses to cancel every session of a day"""
+        with self.assertRaises(CommandError):
+            call_command('cancel_sessions', self.day.isoformat())
+
+    def test_cancel_sessions_admin_action(self):
+        """The admin action cancels the selected sessions"""
+        admin = User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="admin")
+        self.client.force_login(admin)
+
+        response = self.client.post(reverse('admin:src_session_changelist'), {
+            'action': 'cancel_sessions',
+            '_selected_action': [self.sessions[0].id],
+        }, follow=True)
+
+        self.assertContains(response, "1 sesiones canceladas, 2 reservas anuladas")
+        self.assertFalse(Session.objects.filter(id=self.sessions[0].id).exists())
+        self.assertTrue(Session.objects.filter(id=self.sessions[1].id).exists())
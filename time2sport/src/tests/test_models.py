@@ -1,6 +1,7 @@
 import os
+from django.db import IntegrityError, transaction
 from django.test import TestCase
-from src.models import Session, Reservation
+from src.models import FacilitySlot, Session, Reservation, ReservationStatus
 from sbai.models import Schedule, SportFacility, Activity, Bonus, DayOfWeek
 from sgu.models import User
 from slegpn.models import ProductBonus
@@ -173,6 +174,62 @@ class SessionModelTest(TestCase):
         self.assertEqual(reservation.user, self.user)
         self.assertEqual(reservation.session, session)
 
+    def test_reserve_activity_returns_typed_result(self):
+        """Verifies that a reservation attempt returns its status and reservation"""
+        ProductBonus.objects.create(
+            user=self.user,
+            bonus=Bonus.objects.create(
+                activity=self.session_activity.activity, bonus_type='semester', price=50.0),
+            date_begin=date.today(),
+            date_end=date.today() + timedelta(days=30)
+        )
+
+        result = self.session_activity.reserve_activity(self.user)
+
+        self.assertTrue(result)
+        self.assertEqual(result.status, ReservationStatus.RESERVED)
+        self.assertEqual(result.reservation.session, self.session_activity)
+
+        # A second attempt reports the duplicate reservation
+        result = self.session_activity.reserve_activity(self.user)
+        self.assertFalse(result)
+        self.assertEqual(result.status, ReservationStatus.ALREADY_RESERVED)
+        self.assertIsNone(result.reservation)
+
+    def test_reserve_activity_no_bonus(self):
+        """Verifies that a reservation can't be made without a valid bonus"""
+        self.product_bonus.one_use_available = False
+        self.product_bonus.save()
+
+        result = self.session_activity.reserve_activity(self.user)
+
+        self.assertEqual(result.status, ReservationStatus.NO_BONUS)
+        self.session_activity.refresh_from_db()
+        self.assertEqual(self.session_activity.free_places, 5)
+
+    def test_no_overbooking_with_stale_session(self):
+        """Verifies that a stale session instance can't reserve a place that was already taken"""
+        Session.objects.filter(pk=self.session_activity.pk).update(free_places=0)
+
+        # The loaded instance still believes there are free places
+        result = self.session_activity.reserve_activity(self.user)
+
+        self.assertEqual(result.status, ReservationStatus.FULL)
+        self.assertFalse(Reservation.objects.filter(
+            session=self.session_activity).exists())
+        self.product_bonus.refresh_from_db()
+        self.assertTrue(self.product_bonus.one_use_available)
+
+        self.session_activity.refresh_from_db()
+        self.assertEqual(self.session_activity.free_places, 0)
+
+    def test_duplicate_reservation_rejected_by_database(self):
+        """Verifies that the database rejects a second reservation of the same session for a user"""
+        Reservation.objects.create(user=self.user, session=self.session_activity)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Reservation.objects.create(user=self.user, session=self.session_activity)
+
     def test_session_activity_str(self):
         """Checks that the string format of the session activity is correct"""
         s = self.session_activity
@@ -186,6 +243,150 @@ class SessionModelTest(TestCase):
         self.assertEqual(str(s), expected)
 
 
+class FacilitySlotReservationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        schedule = Schedule.objects.create(
+            day_of_week=DayOfWeek.JUEVES,
+            hour_begin="09:00:00",
+            hour_end="14:00:00"
+        )
+        cls.facility = SportFacility.objects.create(
+            name="Pista de Padel",
+            number_of_facilities=1,
+            description="Pista de padel cubierta.",
+            hour_price=20.0,
+            facility_type="Interior",
+        )
+        cls.sessions = Session.objects.bulk_create([
+            Session(facility=cls.facility, schedule=schedule, capacity=1, free_places=1,
+                    date=date.today(), start_time=time(hour, 0), end_time=time(hour + 1, 0))
+            for hour in range(9, 14)
+        ])
+        cls.user = User.objects.create(
+            username="lucia",
+            email="lucia@example.com",
+            password="test1234",
+        )
+
+    def slot(self, session):
+        return FacilitySlot(session.id, self.facility.id, session.date, session.start_time, session.end_time)
+
+    def test_reserve_facility_slots_in_constant_queries(self):
+        """Verifies that every slot is reserved with the same queries, whatever their number"""
+        # Lock, reserved check, update, bulk insert and the savepoints
+        with self.assertNumQueries(8):
+            results = Session.reserve_facility_slots(
+                self.user, [self.slot(session) for session in self.sessions])
+
+        self.assertTrue(all(results))
+        self.assertEqual(
+            [result.reservation.session_id for result in results], [session.id for session in self.sessions])
+        self.assertFalse(Session.objects.filter(
+            id__in=[session.id for session in self.sessions], free_places__gt=0).exists())
+
+    def test_reserve_facility_slots_reports_every_slot(self):
+        """Verifies that a failed slot doesn't prevent the reservation of the others"""
+        Session.objects.filter(pk=self.sessions[1].pk).update(free_places=0)
+        missing = FacilitySlot(0, self.facility.id, date.today(), time(20, 0), time(21, 0))
+
+        results = Session.reserve_facility_slots(self.user, [
+            self.slot(self.sessions[0]), self.slot(self.sessions[1]), missing, self.slot(self.sessions[0])])
+
+        self.assertEqual([result.status for result in results], [
+            ReservationStatus.RESERVED, ReservationStatus.FULL,
+            ReservationStatus.NOT_FOUND, ReservationStatus.ALREADY_RESERVED])
+        self.assertEqual(Reservation.objects.filter(user=self.user).count(), 1)
+
+
+class OverlappingReservationsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        schedule = Schedule.objects.create(
+            day_of_week=DayOfWeek.JUEVES,
+            hour_begin="09:00:00",
+            hour_end="14:00:00"
+        )
+        cls.facility = SportFacility.objects.create(
+            name="Pista de Squash",
+            number_of_facilities=1,
+            description="Pista de squash.",
+            hour_price=15.0,
+            facility_type="Interior",
+        )
+        cls.activity = Activity.objects.create(
+            name="Yoga",
+            location="Sala 1",
+            description="Clase de yoga",
+            activity_type="Terrestre",
+        )
+        day = date.today() + timedelta(days=3)
+        cls.session = Session.objects.create(
+            facility=cls.facility, schedule=schedule, capacity=1, free_places=1,
+            date=day, start_time=time(9, 0), end_time=time(10, 0))
+        cls.overlapping = Session.objects.create(
+            activity=cls.activity, schedule=schedule, capacity=5, free_places=5,
+            date=day, start_time=time(9, 30), end_time=time(10, 30))
+        cls.next = Session.objects.create(
+            facility=cls.facility, schedule=schedule, capacity=1, free_places=1,
+            date=day, start_time=time(10, 0), end_time=time(11, 0))
+        cls.user = User.objects.create(
+            username="marta",
+            email="marta@example.com",
+            password="test1234",
+        )
+        ProductBonus.objects.create(
+            user=cls.user,
+            bonus=Bonus.objects.create(activity=cls.activity, bonus_type='semester', price=50.0),
+            date_begin=date.today(),
+            date_end=date.today() + timedelta(days=30)
+        )
+
+    def skip_without_constraint(self):
+        if not Reservation.overlaps_enforced():
+            self.skipTest("The database has no btree_gist to enforce the overlapping reservations constraint")
+
+    def test_reservation_period_follows_session(self):
+        """Verifies that the reservation keeps the time range of its session"""
+        reservation = Reservation.objects.create(user=self.user, session=self.session)
+        self.assertEqual(reservation.period, self.session.period)
+        self.assertEqual(reservation.period.upper - reservation.period.lower, timedelta(hours=1))
+
+        self.session.start_time = time(12, 0)
+        self.session.end_time = time(13, 0)
+        self.session.save()
+
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.period.lower, timezone.make_aware(
+            datetime.combine(self.session.date, time(12, 0))))
+
+    def test_database_rejects_overlapping_reservation(self):
+        """Verifies that the database rejects a reservation overlapping another one of the user"""
+        self.skip_without_constraint()
+        Reservation.objects.create(user=self.user, session=self.session)
+
+        result = self.overlapping.reserve_activity(self.user)
+
+        self.assertEqual(result.status, ReservationStatus.OVERLAPPING)
+        self.overlapping.refresh_from_db()
+        self.assertEqual(self.overlapping.free_places, 5)
+        self.assertFalse(Reservation.objects.filter(session=self.overlapping).exists())
+
+    def test_database_rejects_overlapping_facility_slots(self):
+        """Verifies that no facility slot is reserved when one overlaps a reservation of the user"""
+        self.skip_without_constraint()
+        self.overlapping.reserve_activity(self.user)
+        slots = [FacilitySlot(session.id, self.facility.id, session.date, session.start_time, session.end_time)
+                 for session in (self.session, self.next)]
+
+        results = Session.reserve_facility_slots(self.user, slots)
+
+        self.assertEqual([result.status for result in results], [ReservationStatus.OVERLAPPING] * 2)
+        self.assertFalse(Reservation.objects.filter(session__facility=self.facility).exists())
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.free_places, 1)
+
+
 class ReservationModelTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -290,3 +491,88 @@ class ReservationModelTest(TestCase):
         self.assertFalse(was_cancelled)
         self.assertTrue(Reservation.objects.filter(
             id=self.reservation.id).exists())
+
+
+class SessionGenerationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.schedule_activity = Schedule.objects.create(
+            day_of_week=DayOfWeek.MARTES,
+            hour_begin="08:00:00",
+            hour_end="09:00:00"
+        )
+        cls.schedule_facility = Schedule.objects.create(
+            day_of_week=DayOfWeek.JUEVES,
+            hour_begin="09:00:00",
+            hour_end="11:00:00"
+        )
+
+        cls.activity = Activity.objects.create(
+            name="Partido de Futbol",
+            location="Campo de Fútbol",
+            description="Entrenamiento futbol sala para 5 jugadores",
+            activity_type="Terrestre",
+        )
+        cls.activity.schedules.add(cls.schedule_activity)
+
+        cls.facility = SportFacility.objects.create(
+            name="Pista de Tenis",
+            number_of_facilities=2,
+            description="Una pista de tenis bien mantenida.",
+            hour_price=30.0,
+            facility_type="Exterior",
+            schedules=[cls.schedule_facility]
+        )
+
+    def test_create_activity_sessions_for_several_weeks(self):
+        """Checks that one session per week is created for an activity schedule"""
+        Session.create_sessions(
+            [self.schedule_activity], activity=self.activity, capacity=5, weeks=4)
+
+        sessions = Session.objects.filter(
+            activity=self.activity).order_by('date')
+        self.assertEqual(sessions.count(), 4)
+        for i, session in enumerate(sessions):
+            self.assertEqual(session.date.weekday(), DayOfWeek.MARTES)
+            self.assertGreater(session.date, date.today())
+            self.assertEqual(session.date, sessions[0].date + timedelta(weeks=i))
+            self.assertEqual(session.free_places, 5)
+            self.assertEqual(session.start_time, time(8, 0))
+
+    def test_create_facility_sessions_for_every_instance(self):
+        """Checks that facility sessions are split in hours for every facility instance"""
+        Session.create_sessions(
+            [self.schedule_facility], facility=self.facility, weeks=2, batch_size=3)
+
+        sessions = Session.objects.filter(facility__isnull=False)
+        # 2 weeks x 2 hour blocks x 2 instances
+        self.assertEqual(sessions.count(), 8)
+        self.assertEqual(
+            set(sessions.values_list('start_time', flat=True)), {time(9, 0), time(10, 0)})
+        self.assertEqual(sessions.values('facility').distinct().count(), 2)
+
+    def test_create_sessions_is_idempotent(self):
+        """Checks that generating the same sessions twice does not duplicate them"""
+        created = Session.create_sessions(
+            [self.schedule_activity], activity=self.activity, weeks=3)
+        self.assertEqual(Session.create_sessions(
+            [self.schedule_activity], activity=self.activity, weeks=3), created)
+        Session.create_sessions(
+            [self.schedule_facility], facility=self.facility, weeks=1)
+        sessions = Session.create_sessions(
+            [self.schedule_facility], facility=self.facility, weeks=1)
+
+        # The sessions that already existed are returned saved
+        self.assertEqual(len(sessions), 4)
+        self.assertTrue(all(session.pk for session in sessions))
+
+        self.assertEqual(Session.objects.filter(
+            activity=self.activity).count(), 3)
+        self.assertEqual(Session.objects.filter(
+            facility__isnull=False).count(), 4)
+
+    def test_create_sessions_needs_activity_or_facility(self):
+        """Checks that no sessions are created without an activity or facility, or with both"""
+        self.assertEqual(Session.create_sessions([self.schedule_activity]), [])
+        self.assertEqual(Session.create_sessions(
+            [self.schedule_activity], activity=self.activity, facility=self.facility), [])
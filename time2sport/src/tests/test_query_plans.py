@@ -0,0 +1,119 @@
+import json
+from datetime import date, time, timedelta
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from sbai.models import Activity, DayOfWeek, Schedule, SportFacility
+from sgu.models import User
+from slegpn.models import Notification, WaitingList
+from src.models import Reservation, Session
+
+
+def plan_nodes(plan):
+    ''' Walks the nodes of a plan returned by EXPLAIN (FORMAT JSON). '''
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+class QueryPlanTest(TestCase):
+    ''' Checks with EXPLAIN that the hot queries use the indexes on a seeded database. '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = date.today()
+        schedule = Schedule.objects.create(
+            day_of_week=DayOfWeek.LUNES, hour_begin=time(8, 0), hour_end=time(9, 0))
+        cls.users = User.objects.bulk_create(
+            [User(username=f"user{i}", password="!") for i in range(100)])
+        activities = Activity.objects.bulk_create([
+            Activity(name=f"Actividad {i}", location="Pabellón", description="Actividad", activity_type="terrestre")
+            for i in range(10)])
+        cls.facilities = [SportFacility.objects.create(
+            name=f"Pista {i}", number_of_facilities=1, description="Pista", hour_price=10, facility_type="Exterior")
+            for i in range(10)]
+
+        # 100 days with 2 sessions per day for every activity and facility
+        slots = [(cls.today + timedelta(days=i // 2), time(8 + i % 2, 0), time(9 + i % 2, 0)) for i in range(200)]
+        activity_sessions = Session.objects.bulk_create([
+            Session(activity=activity, schedule=schedule, capacity=50, free_places=10,
+                    date=day, start_time=start, end_time=end)
+            for activity in activities for day, start, end in slots])
+        Session.objects.bulk_create([
+            Session(facility=facility, schedule=schedule, capacity=1, free_places=1,
+                    date=day, start_time=start, end_time=end)
+            for facility in cls.facilities for day, start, end in slots])
+
+        Reservation.objects.bulk_create([
+            Reservation(user=user, session=activity_sessions[(i * 40 + j) % len(activity_sessions)])
+            for i, user in enumerate(cls.users) for j in range(40)])
+        now = timezone.now()
+        WaitingList.objects.bulk_create([
+            WaitingList(user=user, session=activity_sessions[(i * 20 + j) % len(activity_sessions)],
+                        join_date=now - timedelta(minutes=j),
+                        notified_at=now if j == 0 and i % 10 == 0 else None)
+            for i, user in enumerate(cls.users) for j in range(20)])
+        Notification.objects.bulk_create([
+            Notification(user=user, title="Aviso", content="Aviso", read=j % 20 != 0,
+                         timestamp=now - timedelta(days=1 if j else 200, minutes=j))
+            for user in cls.users for j in range(100)])
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def assertUsesIndex(self, queryset, index_name, table):
+        ''' Asserts the query reads the table through the given index and never scans it sequentially. '''
+        plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+        nodes = list(plan_nodes(plan))
+        self.assertIn(index_name, {node.get('Index Name') for node in nodes}, plan)
+        self.assertNotIn(('Seq Scan', table), {(node['Node Type'], node.get('Relation Name')) for node in nodes}, plan)
+
+    def test_activity_sessions_by_date(self):
+        ''' The sessions of an activity for a day use the activity and date index. '''
+        activity = Activity.objects.first()
+        self.assertUsesIndex(
+            Session.objects.filter(activity=activity, date=self.today + timedelta(days=7)).order_by('start_time'),
+            'session_activity_date_idx', 'src_session')
+
+    def test_facility_sessions_by_date_and_time(self):
+        ''' The availability grid and the slot lookup of a facility use the facility index. '''
+        facility = self.facilities[0]
+        self.assertUsesIndex(
+            Session.objects.filter(facility__in=self.facilities[:2],
+                                   date__range=(self.today, self.today + timedelta(days=6))),
+            'session_facility_date_idx', 'src_session')
+        self.assertUsesIndex(
+            facility.sessions.filter(date=self.today + timedelta(days=3), start_time=time(8, 0), end_time=time(9, 0)),
+            'session_facility_date_idx', 'src_session')
+
+    def test_user_reservations_by_date(self):
+        ''' The reservations of a user for a day start from the unique user and session index. '''
+        self.assertUsesIndex(
+            self.users[0].reservations.filter(session__date=self.today + timedelta(days=7)),
+            'unique_user_session_reservation', 'src_reservation')
+
+    def test_waiting_list_promotion_and_sweep(self):
+        ''' The promotions read the session queues by their index and the sweep the notified entries by a partial one. '''
+        session_ids = list(WaitingList.objects.values_list('session_id', flat=True)[:3])
+        self.assertUsesIndex(
+            WaitingList.objects.filter(session_id__in=session_ids, notified_at__isnull=True).order_by(
+                'session_id', 'join_date'),
+            'waitinglist_session_idx', 'slegpn_waitinglist')
+        self.assertUsesIndex(
+            WaitingList.objects.filter(notified_at__lte=timezone.now()),
+            'waitinglist_notified_idx', 'slegpn_waitinglist')
+
+    def test_notifications(self):
+        ''' The inbox page, the unread counter and the archive use the notification indexes. '''
+        user = self.users[0]
+        self.assertUsesIndex(
+            user.notifications.order_by('read', '-timestamp', '-id')[:20],
+            'notification_inbox_idx', 'slegpn_notification')
+        self.assertUsesIndex(
+            Notification.objects.filter(user=user, read=False),
+            'notification_unread_idx', 'slegpn_notification')
+        self.assertUsesIndex(
+            Notification.objects.filter(read=True, timestamp__lt=timezone.now() - timedelta(days=90)),
+            'notification_archive_idx', 'slegpn_notification')
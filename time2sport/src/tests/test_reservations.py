@@ -1,13 +1,20 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from datetime import datetime, time, date, timedelta
 from django.urls import reverse
-from src.models import Session, Reservation
+from src.models import FacilitySlot, Session, Reservation
 from sbai.models import Schedule, SportFacility, Activity, Bonus, DayOfWeek
 from sgu.models import User
 from slegpn.models import ProductBonus, Notification
-from src.views import _is_conflict_reserved_sessions, _is_conflict_chosen_sessions, _get_session_split_data
+from src.views import _is_conflict_reserved_sessions, _is_conflict_chosen_sessions
 
 
+def selected_slots(*sessions):
+    """Compact form of the facility sessions selected by the user, as kept in the session"""
+    return [FacilitySlot(session.id, session.facility_id, session.date, session.start_time,
+                         session.end_time).to_compact() for session in sessions]
+
+
+@override_settings(NOTIFICATIONS_SYNC_DELIVERY=True)
 class ReserveActivitySessionViewTest(TestCase):
 
     @classmethod
@@ -251,16 +258,15 @@ class CheckReserveFacilitySessionViewTest(TestCase):
         # Delete reservation from db
         self.reservation.delete()
 
-        selected = f"{self.facility.id}|09:00|10:00|{date.today().strftime('%B %d %Y')}"
-
         response = self.client.post(reverse('check_reserve_facility_session'), {
             'facility_id': self.facility.id,
-            'selected_sessions': f"{selected}"
+            'selected_sessions': f"{self.session.id}"
         })
 
         self.assertRedirects(response, reverse(
             'invoice_facility', args=[self.facility.id]))
-        self.assertEqual(self.client.session['selected_sessions'], [selected])
+        self.assertEqual(
+            self.client.session['selected_sessions'], selected_slots(self.session))
 
     def test_check_reserve_facility_multiple_sessions(self):
         """Checks that multiple valid sessions proceed to invoice"""
@@ -269,18 +275,15 @@ class CheckReserveFacilitySessionViewTest(TestCase):
         # Delete reservation from db
         self.reservation.delete()
 
-        selected_1 = f"{self.facility.id}|09:00|10:00|{date.today().strftime('%B %d %Y')}"
-        selected_2 = f"{self.facility.id}|10:00|11:00|{date.today().strftime('%B %d %Y')}"
-
         response = self.client.post(reverse('check_reserve_facility_session'), {
             'facility_id': self.facility.id,
-            'selected_sessions': f"{selected_1},{selected_2}"
+            'selected_sessions': f"{self.session.id},{self.session_2.id}"
         })
 
         self.assertRedirects(response, reverse(
             'invoice_facility', args=[self.facility.id]))
-        self.assertEqual(self.client.session['selected_sessions'], [
-                         selected_1, selected_2])
+        self.assertEqual(self.client.session['selected_sessions'], selected_slots(
+            self.session, self.session_2))
 
     def test_no_sessions_selected(self):
         """Checks that an error message is given when no sessions are selected"""
@@ -302,13 +305,21 @@ class CheckReserveFacilitySessionViewTest(TestCase):
         """Checks that redirects in case of a schedule conflict"""
         self.client.force_login(self.user)
 
-        selected_1 = f"{self.facility.id}|09:00|10:00|{date.today().strftime('%B %d %Y')}"
         # solapa con la anterior
-        selected_2 = f"{self.facility.id}|09:30|10:30|{date.today().strftime('%B %d %Y')}"
+        session_overlap = Session.objects.create(
+            activity=None,
+            facility=self.facility,
+            schedule=self.session.schedule,
+            capacity=2,
+            free_places=2,
+            date=date.today(),
+            start_time=time(9, 30),
+            end_time=time(10, 30)
+        )
 
         response = self.client.post(reverse('check_reserve_facility_session'), {
             'facility_id': self.facility.id,
-            'selected_sessions': f"{selected_1},{selected_2}"
+            'selected_sessions': f"{self.session.id},{session_overlap.id}"
         })
 
         self.assertRedirects(response, reverse(
@@ -321,11 +332,9 @@ class CheckReserveFacilitySessionViewTest(TestCase):
         """Checks that redirects in case of attempting making a reservation on a already reserved spot"""
         self.client.force_login(self.user)
 
-        selected = f"{self.facility.id}|09:00|10:00|{date.today().strftime('%B %d %Y')}"
-
         response = self.client.post(reverse('check_reserve_facility_session'), {
             'facility_id': self.facility.id,
-            'selected_sessions': selected
+            'selected_sessions': f"{self.session.id}"
         })
 
         self.assertRedirects(response, reverse(
@@ -334,6 +343,7 @@ class CheckReserveFacilitySessionViewTest(TestCase):
         self.assertIn("Ya tienes una reserva para esa hora", str(messages[0]))
 
 
+@override_settings(NOTIFICATIONS_SYNC_DELIVERY=True)
 class ReserveFacilitySessionViewTest(TestCase):
 
     @classmethod
@@ -413,9 +423,8 @@ class ReserveFacilitySessionViewTest(TestCase):
 
     def test_redirect_for_unauthenticated_users(self):
         """Verifies that the users ared logged in before accessing the template"""
-        selected = f"{self.facility.id}|09:00|10:00|{date.today().strftime('%B %d %Y')}"
         session = self.client.session
-        session['selected_sessions'] = [selected]
+        session['selected_sessions'] = selected_slots(self.session)
         session.save()
 
         self.client.logout()
@@ -428,9 +437,8 @@ class ReserveFacilitySessionViewTest(TestCase):
         """Creates the reservation of the facility"""
         self.client.force_login(self.user)
 
-        selected = f"{self.facility.id}|10:00|11:00|{date.today().strftime('%B %d %Y')}"
         session = self.client.session
-        session['selected_sessions'] = [selected]
+        session['selected_sessions'] = selected_slots(self.session_2)
         session.save()
 
         response = self.client.get(
@@ -453,14 +461,11 @@ class ReserveFacilitySessionViewTest(TestCase):
         """Creates multiple reservations for the facility"""
         self.client.force_login(self.user)
 
-        selected_1 = f"{self.facility.id}|09:00|10:00|{date.today().strftime('%B %d %Y')}"
-        selected_2 = f"{self.facility.id}|10:00|11:00|{date.today().strftime('%B %d %Y')}"
-
         Reservation.objects.filter(
             user=self.user, session=self.session).delete()  # limpieza
 
         session = self.client.session
-        session['selected_sessions'] = [selected_1, selected_2]
+        session['selected_sessions'] = selected_slots(self.session, self.session_2)
         session.save()
 
         response = self.client.get(
@@ -483,9 +488,8 @@ class ReserveFacilitySessionViewTest(TestCase):
         self.session.free_places = 0
         self.session.save()
 
-        selected = f"{self.facility.id}|09:00|10:00|{date.today().strftime('%B %d %Y')}"
         session = self.client.session
-        session['selected_sessions'] = [selected]
+        session['selected_sessions'] = selected_slots(self.session)
         session.save()
 
         response = self.client.get(
@@ -500,3 +504,55 @@ class ReserveFacilitySessionViewTest(TestCase):
                 for message in messages),
             "No se encontró el mensaje de error esperado en messages"
         )
+
+    def test_reservation_uses_selected_date(self):
+        """Checks that the session of the selected day is reserved, not another one at the same time"""
+        self.client.force_login(self.user)
+        tomorrow = date.today() + timedelta(days=1)
+        session_tomorrow = Session.objects.create(
+            activity=None,
+            facility=self.facility,
+            schedule=self.session_2.schedule,
+            capacity=1,
+            free_places=1,
+            date=tomorrow,
+            start_time=time(10, 0),
+            end_time=time(11, 0)
+        )
+
+        session = self.client.session
+        session['selected_sessions'] = selected_slots(session_tomorrow)
+        session.save()
+
+        self.client.get(
+            reverse('payment-facility-success', args=[self.facility.id]))
+
+        self.assertTrue(Reservation.objects.filter(
+            user=self.user, session=session_tomorrow).exists())
+        self.assertFalse(Reservation.objects.filter(
+            user=self.user, session=self.session_2).exists())
+        session_tomorrow.refresh_from_db()
+        self.assertEqual(session_tomorrow.free_places, 0)
+
+    def test_reservation_partial_failure(self):
+        """Checks that the free slots are reserved and every failed slot is reported"""
+        self.client.force_login(self.user)
+        # The last session was removed after being selected
+        removed = FacilitySlot(0, self.facility.id, date.today(), time(12, 0), time(13, 0))
+
+        session = self.client.session
+        session['selected_sessions'] = selected_slots(
+            self.session, self.session_2) + [removed.to_compact()]
+        session.save()
+
+        response = self.client.get(
+            reverse('payment-facility-success', args=[self.facility.id]))
+
+        self.assertTrue(Reservation.objects.filter(
+            user=self.user, session=self.session_2).exists())
+        messages = [str(message) for message in response.wsgi_request._messages]
+        self.assertIn("Ya tienes reservada la hora 09:00 - 10:00.", messages)
+        self.assertIn("La hora 12:00 - 13:00 no está disponible.", messages)
+        self.assertIn("Reserva realizada con éxito.", messages)
+        self.assertEqual(list(Notification.objects.filter(user=self.user).order_by(
+            'id').values_list('title', flat=True)), ["Reserva realizada correctamente", "Error en la reserva"])
@@ -5,7 +5,7 @@ from src.models import Session, Reservation
 from sbai.models import Schedule, SportFacility, Activity, Bonus, DayOfWeek
 from sgu.models import User
 from slegpn.models import ProductBonus
-from src.views import _is_conflict_reserved_sessions, _is_conflict_chosen_sessions, _get_session_split_data
+from src.views import _is_conflict_reserved_sessions, _is_conflict_chosen_sessions
 
 
 class ReservationsViewTest(TestCase):
@@ -1,6 +1,7 @@
 from django.urls import path
 from .views import reserve_activity_session, check_reserve_facility_session
 from .views import reservations, past_reservations, cancel_reservation
+from .views import reservations_calendar, renew_calendar_token
 
 urlpatterns = [
     path('reserve/<int:session_id>/', reserve_activity_session,
@@ -11,4 +12,7 @@ urlpatterns = [
     path('past-reservations/', past_reservations, name='past-reservations'),
     path('cancel-reservation/<int:reservation_id>/',
          cancel_reservation, name='cancel_reservation'),
+    path('calendar/<uuid:user_id>/<uuid:token>/reservations.ics',
+         reservations_calendar, name='reservations_calendar'),
+    path('calendar/renew/', renew_calendar_token, name='renew_calendar_token'),
 ]
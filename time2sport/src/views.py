@@ -1,17 +1,28 @@
 from django.shortcuts import render, redirect, get_object_or_404
 
-from .models import Reservation, Session
+from .models import FacilitySlot, Reservation, ReservationStatus, Session
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 
 from django.contrib import messages
-from sbai.models import Bonus, SportFacility, Schedule
+from sbai.models import Bonus, Schedule
 from src.models import Reservation
-from slegpn.models import ProductBonus, Notification, WaitingList
-from slegpn.tasks import check_waiting_list_timeout
+from slegpn.models import ProductBonus, WaitingList
+from slegpn.notifier import notify, notify_each
+from slegpn.tasks import place_notification, promote_waiting_users
+from django.db import transaction
+from django.http import Http404, HttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_POST, require_safe
+from .calendars import check_calendar_token, get_calendar_feed, get_reservations_calendar, renew_calendars
 
-from datetime import datetime, date
-from django.utils.timezone import now
+import uuid
+
+from datetime import date, time
+
+OVERLAPPING_MESSAGE = "Ya tienes una reserva para esa hora. Puedes ver tus reservas en la sección de 'Mis Reservas'."
 
 
 def _is_conflict_reserved_sessions(users_sessions_day, requested_start, requested_end):
@@ -27,42 +38,47 @@ def _is_conflict_reserved_sessions(users_sessions_day, requested_start, requeste
     return False
 
 
-def _is_conflict_chosen_sessions(selected_sessions):
-    ''' Check if the user has chosen sessions that overlap each other '''
-
-    session_times = []
-
-    for session in selected_sessions:
-        facility_id, start, end, day = session.split('|')
-        day = datetime.strptime(day, "%B %d %Y")
-        requested_start = datetime.strptime(start, '%H:%M').time()
-        requested_end = datetime.strptime(end, '%H:%M').time()
+def _is_conflict_chosen_sessions(selected_slots):
+    ''' Check if the user has chosen sessions that overlap each other.
+    Sweep line over the slots sorted by day and start, O(n log n) '''
+    current_day, latest_end = None, None
 
-        session_times.append((requested_start, requested_end, day))
+    for slot in sorted(selected_slots, key=lambda slot: (slot.date, slot.start_time)):
+        if slot.date != current_day:
+            current_day, latest_end = slot.date, slot.end_time
+        elif slot.start_time < latest_end:
+            return True
+        else:
+            latest_end = max(latest_end, slot.end_time)
+    return False
 
-    for i, session1 in enumerate(session_times):
-        start1, end1, day1 = session1
-        for j, session2 in enumerate(session_times):
 
-            if i == j:
-                continue
+def _is_conflict_reserved_slots(selected_slots, reserved_sessions):
+    ''' Check if any chosen slot overlaps a session already reserved by the user.
+    Sweep line over both groups sorted by day and start, O(n log n), only the overlaps
+    between a chosen slot and a reserved session count '''
+    intervals = sorted(
+        [(slot.date, slot.start_time, slot.end_time, True) for slot in selected_slots] +
+        [(session.date, session.start_time, session.end_time, False) for session in reserved_sessions])
+    current_day, chosen_end, reserved_end = None, None, None
 
-            start2, end2, day2 = session2
+    for day, start, end, chosen in intervals:
+        if day != current_day:
+            current_day, chosen_end, reserved_end = day, time.min, time.min
 
-            if day1 == day2:
-                if start1 < end2 and end1 > start2:
-                    return True
+        # It starts before the latest interval of the other group has ended
+        if start < (reserved_end if chosen else chosen_end):
+            return True
+        if chosen:
+            chosen_end = max(chosen_end, end)
+        else:
+            reserved_end = max(reserved_end, end)
     return False
 
 
-def _get_session_split_data(session):
-    ''' Get the session data from the session string '''
-    facility_id, start, end, day = session.split('|')
-    day = datetime.strptime(day, "%B %d %Y")
-    requested_start = datetime.strptime(start, '%H:%M').time()
-    requested_end = datetime.strptime(end, '%H:%M').time()
-
-    return facility_id, day, requested_start, requested_end
+def _get_selected_slots(request):
+    ''' Get the facility slots selected by the user from their compact form in the session '''
+    return [FacilitySlot.from_compact(slot) for slot in request.session['selected_sessions']]
 
 
 @login_required
@@ -74,25 +90,28 @@ def reserve_activity_session(request, session_id):
 
     user = request.user
 
-    # Check if the user does not have another session at the same time
-    users_sessions_day = user.reservations.filter(session__date=session.date)
-    requested_start = session.start_time
-    requested_end = session.end_time
+    # Check if the user does not have another session at the same time, the database
+    # rejects it by itself when it has the overlapping reservations constraint
+    if not Reservation.overlaps_enforced():
+        users_sessions_day = user.reservations.filter(
+            session__date=session.date).select_related('session')
+        requested_start = session.start_time
+        requested_end = session.end_time
 
-    if _is_conflict_reserved_sessions(users_sessions_day, requested_start, requested_end):
-        messages.error(
-            request, "Ya tienes una reserva para esa hora. Puedes ver tus reservas en la sección de 'Mis Reservas'.")
-        return redirect('activity_detail', session.activity.id)
+        if _is_conflict_reserved_sessions(users_sessions_day, requested_start, requested_end):
+            messages.error(request, OVERLAPPING_MESSAGE)
+            return redirect('activity_detail', session.activity.id)
 
-    reservation = session.add_reservation_activity(user)
-    if reservation:
+    result = session.reserve_activity(user)
+    if result:
         messages.success(request, "Reserva realizada con éxito.")
-        title = "Reserva realizada con éxito"
-        content = f"Has realizado una reserva de {session.activity} para el día {session.date.strftime('%d/%m/%Y')}."
-        Notification.objects.create(user=user, title=title, content=content)
+        notify(user, 'reservation_done',
+               activity=session.activity, date=session.date)
 
         # If user was in the waiting list delete entry
         WaitingList.objects.filter(user=user, session=session).delete()
+    elif result.status is ReservationStatus.OVERLAPPING:
+        messages.error(request, OVERLAPPING_MESSAGE)
     else:
         messages.error(request, "Error al realizar la reserva.")
 
@@ -103,84 +122,60 @@ def reserve_activity_session(request, session_id):
 def check_reserve_facility_session(request):
     ''' Check if the user can reserve the facility session '''
     if request.method == 'POST':
-        selected_sessions = [s for s in request.POST.get(
-            'selected_sessions', '').split(',') if s]
-        request.session['selected_sessions'] = selected_sessions
+        facility_id = request.POST.get('facility_id')
+        selected_slots = FacilitySlot.load(
+            FacilitySlot.parse_ids(request.POST.get('selected_sessions', '')))
+        request.session['selected_sessions'] = [
+            slot.to_compact() for slot in selected_slots]
 
         # Check if the user has selected sessions
-        if not selected_sessions:
+        if not selected_slots:
             messages.error(request, 'No se ha seleccionado ninguna sesión.')
-            return redirect('facility_detail', facility_id=request.POST.get('facility_id'))
+            return redirect('facility_detail', facility_id=facility_id)
 
         # Check if the user has selected sessions that overlap each other
-        if _is_conflict_chosen_sessions(selected_sessions):
+        if _is_conflict_chosen_sessions(selected_slots):
             messages.error(request, "Las reservas seleccionadas se solapan.")
-            return redirect('facility_detail', facility_id=request.POST.get('facility_id'))
-
-        # Check if the user has already a reservation for the same time
-        for session in selected_sessions:
-            facility_id, day, requested_start, requested_end = _get_session_split_data(
-                session)
+            return redirect('facility_detail', facility_id=facility_id)
 
-            user_sessions = request.user.reservations.filter(session__date=day)
-
-            if _is_conflict_reserved_sessions(user_sessions, requested_start, requested_end):
-                messages.error(
-                    request, "Ya tienes una reserva para esa hora. Puedes ver tus reservas en la sección de 'Mis Reservas'.")
-                return redirect('facility_detail', facility_id=facility_id)
+        # Check if the user has already a reservation for the same time (one query for all the days)
+        reserved_sessions = [reservation.session for reservation in request.user.reservations.filter(
+            session__date__in={slot.date for slot in selected_slots}).select_related('session')]
+        if _is_conflict_reserved_slots(selected_slots, reserved_sessions):
+            messages.error(request, OVERLAPPING_MESSAGE)
+            return redirect('facility_detail', facility_id=facility_id)
 
         return redirect('invoice_facility', facility_id=facility_id)
 
 
 @login_required
 def reserve_facility_session(request):
-    ''' Reserve the facility session '''
-    selected_sessions = request.session['selected_sessions']
-
-    for session in selected_sessions:
-        facility_id, start, end, day = session.split('|')
-
-        # Convert date to day of the week
-        day_number = datetime.strptime(day, '%B %d %Y').weekday()
-
-        start_time = datetime.strptime(start, '%H:%M').time()
-        end_time = datetime.strptime(end, '%H:%M').time()
-
-        # Get the facility and session
-        facility = get_object_or_404(SportFacility, id=facility_id)
-        session = facility.sessions.filter(
-            start_time=start_time, end_time=end_time).first()
-
-        # Check if session is already reserved
-        if session and session.free_places > 0:
-            Reservation.objects.create(
-                session=session,
-                user=request.user
-            )
-
-            # Update session free places
-            session.free_places -= 1
-            session.save()
-
-            title = "Reserva realizada correctamente"
-            content = f"Has reservado la instalación "
-
-            if facility.number_of_facilities > 1:
-                content += ' '.join(facility.name.split(" ")[:-1])
-            else:
-                content += f"{facility}"
-            content += f" el día {session.date.strftime('%d/%m/%Y')}"
-
+    ''' Reserve the facility sessions selected by the user '''
+    slots = _get_selected_slots(request)
+    results = Session.reserve_facility_slots(request.user, slots)
+
+    notifications = []
+    for slot, result in zip(slots, results):
+        hours = str(slot)
+        if result:
+            session = result.reservation.session
+            notifications.append((request.user, 'facility_reservation_done', {
+                'facility': session.facility.group_name, 'date': session.date}))
+        elif result.status is ReservationStatus.ALREADY_RESERVED:
+            messages.error(request, f'Ya tienes reservada la hora {hours}.')
+        elif result.status is ReservationStatus.OVERLAPPING:
+            messages.error(request, OVERLAPPING_MESSAGE)
+        elif result.status is ReservationStatus.NOT_FOUND:
+            messages.error(request, f'La hora {hours} no está disponible.')
         else:
-            title = "Error en la reserva"
-            content = "Se ha producido un error. Intentelo más tarde"
-            messages.error(
-                request, f'La hora {start} - {end} ya está ocupada.')
+            messages.error(request, f'La hora {hours} ya está ocupada.')
 
     # Notify the user
-    Notification.objects.create(
-        title=title, content=content, user=request.user)
-    messages.success(request, 'Reserva realizada con éxito.')
+    if not all(results):
+        notifications.append((request.user, 'facility_reservation_failed', {}))
+    notify_each(notifications)
+    if any(results):
+        messages.success(request, 'Reserva realizada con éxito.')
 
 
 @login_required
@@ -193,12 +188,49 @@ def reservations(request):
 
     context = {
         'active_tab': 'future_reservations',
-        'reservations': reservations
+        'reservations': reservations,
+        'calendar_url': request.build_absolute_uri(
+            reverse('reservations_calendar', args=[user.id, user.calendar_token])),
     }
 
     return render(request, 'reservations.html', context)
 
 
+@require_safe
+def reservations_calendar(request, user_id, token):
+    ''' iCalendar feed of the reservations of a user for the calendar applications, which can't log in.
+    The user is identified by the secret token of the URL. The clients polling it with the ETag
+    of their copy get a 304 from the cache until the reservations change or the day ends. '''
+    feed = get_calendar_feed(user_id)
+    if not check_calendar_token(feed, token):
+        raise Http404
+
+    today = timezone.localdate()
+    etag = f'"{user_id}-{feed["version"]:.6f}-{today:%Y%m%d}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(
+            get_reservations_calendar(user_id, feed['version'], today), content_type='text/calendar; charset=utf-8')
+        response['Content-Disposition'] = 'inline; filename="reservations.ics"'
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+@require_POST
+def renew_calendar_token(request):
+    ''' Changes the URL of the reservations calendar of the user, the previous one stops working '''
+    user = request.user
+    user.calendar_token = uuid.uuid4()
+    user.save(update_fields=['calendar_token'])
+    renew_calendars([user.id])
+
+    messages.success(
+        request, "Se ha generado un nuevo enlace del calendario. Actualiza la suscripción de tu aplicación de calendario.")
+    return redirect('reservations')
+
+
 @login_required
 def past_reservations(request):
     ''' List all past reservations of the user '''
@@ -222,42 +254,31 @@ def cancel_reservation(request, reservation_id):
         Reservation, id=reservation_id, user=request.user)
     session = reservation.session
 
-    is_cancelled = reservation.cancel()
+    with transaction.atomic():
+        try:
+            is_cancelled = reservation.cancel()
+        except Reservation.DoesNotExist:
+            # Already cancelled by a concurrent request
+            raise Http404
+        # The freed place goes to the first user of the waiting list not notified yet,
+        # the periodic sweep notifies the next one if this one does not reserve in time
+        promoted = promote_waiting_users({session.id: 1}) if is_cancelled else []
+        notify_each([place_notification(entry) for entry in promoted])
+
     # If the reservation was not cancelled, it means that the user tried to cancel it with less than 2 hours before the session
     if not is_cancelled:
         messages.error(
             request, "No puedes cancelar una reserva con menos de 2 horas de antelación.")
     # The reservation was cancelled
     else:
-        # Update the waiting list
-        waiting_list = session.waiting_list.order_by('join_date')
-
-        # Find the first user who hasn't been notified
-        next_entry = waiting_list.filter(notified_at__isnull=True).first()
-        if next_entry:
-            # Mark as notified
-            next_entry.notified_at = now()
-            next_entry.save()
-
-            Notification.objects.create(
-                title="¡Apúntate a la sesión, se ha liberado una plaza!",
-                content=f"Se ha liberado una plaza en {session.activity.name} para el día {session.date.strftime('%d/%m/%Y')} a las {session.start_time.strftime('%H:%M')}. Tienes {settings.WAITING_LIST_NOTIFICATION_MINS} minutos para confirmar.",
-                user=next_entry.user
-            )
-
-            # Monitor 20 minutes task
-            check_waiting_list_timeout.apply_async(
-                (session.id,), countdown=settings.WAITING_LIST_NOTIFICATION_MINS*60)
         messages.success(request, "Reserva cancelada con éxito.")
 
         if session.activity:
-            content = f"Has cancelado tu reserva de {session.activity.name} correctamente."
+            name = session.activity.name
         elif session.facility:
-            content = f"Has cancelado tu reserva de {session.facility.name} correctamente."
+            name = session.facility.name
 
         # Notify the user
-        title = "Reserva cancelada con éxito"
-        Notification.objects.create(
-            title=title, content=content, user=request.user)
+        notify(request.user, 'reservation_cancelled', name=name)
 
     return redirect('reservations')
@@ -1,10 +1,10 @@
 from slegpn.models import Notification
+from slegpn.push import push_available
 
 
 def unread_notifications(request):
-    """Gets the unread notification count"""
+    """Gets the unread notification count and whether the page can receive its changes by push"""
     if request.user.is_authenticated:
-        count = Notification.objects.filter(
-            user=request.user, read=False).count()
-        return {'unread_notifications': count}
+        count = Notification.get_unread_count(request.user.id)
+        return {'unread_notifications': count, 'notifications_push': push_available(request)}
     return {}
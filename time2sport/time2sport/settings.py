@@ -14,6 +14,7 @@ from pathlib import Path
 import os
 import random
 import string
+from celery.schedules import crontab
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.sites',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'django_extensions',
     'sgu',
     'sbai',
@@ -153,6 +155,11 @@ DATABASES = {
         'PASSWORD': 'alumnodb',
         'HOST': 'localhost',
         'PORT': '5432',
+        # The full-text search of the Spanish texts needs a UTF-8 database, whatever the server default
+        'TEST': {
+            'CHARSET': 'UTF8',
+            'TEMPLATE': 'template0',
+        },
     }
 }
 
@@ -235,5 +242,93 @@ PAYPAL_RECEIVER_EMAIL = 'sb-ruupa38090694@business.example.com'
 PAYPAL_BUY_BUTTON_IMAGE = 'https://i.postimg.cc/tJwc9N6N/paypal-pay-button.png'
 
 # Celery configuration
+# Seconds between the sweeps of the expired waiting list notifications
+WAITING_LIST_SWEEP_SECONDS = 60
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
+CELERY_BEAT_SCHEDULE = {
+    'extend-sessions-horizon': {
+        'task': 'slegpn.tasks.extend_sessions_horizon',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'purge-old-sessions': {
+        'task': 'slegpn.tasks.purge_old_sessions',
+        'schedule': crontab(hour=3, minute=30),
+    },
+    'expire-waiting-list-notifications': {
+        'task': 'slegpn.tasks.expire_waiting_list_notifications',
+        'schedule': WAITING_LIST_SWEEP_SECONDS,
+    },
+    'archive-read-notifications': {
+        'task': 'slegpn.tasks.archive_read_notifications',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'delete-old-exports': {
+        'task': 'sbai.tasks.delete_old_exports',
+        'schedule': crontab(minute=15),
+    },
+}
 WAITING_LIST_NOTIFICATION_MINS = 20
+
+# Caches of the unread notifications counters, the schedules pages and PDFs and the reservations calendars
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'notifications': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/2',
+    },
+    'schedules': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/3',
+    },
+    'calendars': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/4',
+    },
+}
+NOTIFICATIONS_UNREAD_CACHE_TIMEOUT = 60 * 60 * 24
+# Seconds a counter filled by counting the notifications is kept, it can miss a concurrent change
+NOTIFICATIONS_UNREAD_RECOUNT_TIMEOUT = 60
+
+# The tests run with local memory caches instead of the Redis ones
+TEST_RUNNER = 'time2sport.test_runner.LocalCachesTestRunner'
+
+# Seconds an old version of the schedules pages and PDFs is kept in the cache
+SCHEDULES_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# Seconds a version of the reservations calendar of a user is kept in the cache, and days of past reservations in it
+CALENDAR_CACHE_TIMEOUT = 60 * 60 * 24
+CALENDAR_PAST_DAYS = 30
+
+# Activities and facilities per page of the search results
+SEARCH_RESULTS_PER_PAGE = 20
+
+# Rows per table of the PDF exports and bytes of an export kept in memory before using a temporary file
+EXPORT_ROWS_PER_TABLE = 500
+EXPORT_SPOOL_MAX_SIZE = 1024 * 1024
+
+# Seconds a finished export is given to the users asking for the same file, and hours its file is kept
+EXPORTS_REUSE_SECONDS = 5 * 60
+EXPORTS_KEEP_HOURS = 24
+# Minutes an export can wait or be rendered before it is considered failed
+EXPORTS_STALE_MINUTES = 30
+
+# Notifications are written by a Celery worker in batches, or right away with the synchronous delivery
+NOTIFICATIONS_SYNC_DELIVERY = False
+NOTIFICATIONS_BATCH_SIZE = 1000
+
+# Notifications per inbox page and days after which read notifications are archived
+NOTIFICATIONS_PAGE_SIZE = 20
+NOTIFICATIONS_ARCHIVE_DAYS = 90
+
+# Push of the unread notifications count (server-sent events with long polling fallback)
+NOTIFICATIONS_REDIS_URL = 'redis://localhost:6379/1'
+NOTIFICATIONS_KEEPALIVE_SECONDS = 15
+NOTIFICATIONS_LONG_POLL_SECONDS = 25
+
+# Number of sessions inserted per query when generating sessions
+SESSIONS_BATCH_SIZE = 500
+# Days ahead with generated sessions and days the past sessions are kept
+SESSIONS_HORIZON_DAYS = 28
+SESSIONS_RETENTION_DAYS = 180
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class LocalCachesTestRunner(DiscoverRunner):
+    ''' Test runner that replaces every cache by a local memory one while the tests run,
+    so they never read, write or flush the Redis caches of the application. '''
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        # Every alias needs its own location, the local memory caches of a location are shared
+        self.local_caches = override_settings(CACHES={
+            alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': alias}
+            for alias in settings.CACHES
+        })
+        self.local_caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.local_caches.disable()
+        super().teardown_test_environment(**kwargs)